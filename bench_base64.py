@@ -0,0 +1,81 @@
+"""
+Micro-benchmark dell'ingest delle immagini base64.
+
+Confronta il percorso precedente (regex sull'intera stringa + b64decode(validate=True)
+in _clean_base64, poi una seconda decodifica prima di caption/embedding; per gli upload
+multipart anche la codifica base64 iniziale) con quello attuale (_image_from_base64:
+una sola decodifica binascii strict, byte tenuti nel record, base64 solo su richiesta).
+
+Per ogni dimensione riporta ms per immagine e picco di memoria allocata (tracemalloc).
+
+Uso:
+  python bench_base64.py                 # 1, 4 e 10 MB
+  python bench_base64.py --sizes 2 8 --repeat 20
+"""
+import argparse
+import base64
+import os
+import re
+import time
+import tracemalloc
+
+import image_worker
+
+
+def _old_json(image_b64: str) -> bytes:
+    if not re.match(r"^[A-Za-z0-9+/=]+$", image_b64):
+        raise ValueError("invalid")
+    base64.b64decode(image_b64, validate=True)
+    return base64.b64decode(image_b64)
+
+
+def _new_json(image_b64: str) -> bytes:
+    return image_worker.decode_base64(image_b64)
+
+
+def _old_multipart(data: bytes) -> bytes:
+    return _old_json(base64.b64encode(data).decode("utf-8"))
+
+
+def _new_multipart(data: bytes) -> bytes:
+    return data
+
+
+def _measure(fn, arg, repeat: int):
+    fn(arg)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(arg)
+    ms = (time.perf_counter() - t0) * 1000.0 / repeat
+    tracemalloc.start()
+    fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return ms, peak
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 10], help="MB di immagine decodificata")
+    ap.add_argument("--repeat", type=int, default=10)
+    args = ap.parse_args()
+
+    print(f"{'MB':>5}  {'percorso':<10}{'prima ms':>10}{'ora ms':>9}{'prima MB':>10}{'ora MB':>9}")
+    for mb in args.sizes:
+        data = os.urandom(int(mb * 1024 * 1024))
+        image_b64 = base64.b64encode(data).decode("ascii")
+        assert _new_json(image_b64) == _old_json(image_b64)
+        for label, old, new, arg in (
+            ("json", _old_json, _new_json, image_b64),
+            ("multipart", _old_multipart, _new_multipart, data),
+        ):
+            old_ms, old_peak = _measure(old, arg, args.repeat)
+            new_ms, new_peak = _measure(new, arg, args.repeat)
+            print(
+                f"{mb:>5g}  {label:<10}{old_ms:>10.2f}{new_ms:>9.2f}"
+                f"{old_peak / 1e6:>10.1f}{new_peak / 1e6:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
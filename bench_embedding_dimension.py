@@ -0,0 +1,76 @@
+"""
+Benchmark delle dimensioni degli embedding Vertex (128/256/512/1408).
+
+Su un campione di oggetti della collection calcola gli embedding a ciascuna dimensione e riporta:
+- latenza media / p95 della chiamata Vertex
+- recall@k dei vicini image→image rispetto ai vicini a 1408 dimensioni
+- byte per vettore (float32)
+
+Uso:
+  python bench_embedding_dimension.py --collection Sinde --sample 100 -k 10
+"""
+import argparse
+import time
+
+import numpy as np
+
+import knn_graph
+import serve
+
+
+def _sample_objects(collection: str, sample: int):
+    client = serve._connect()
+    try:
+        coll = client.collections.get(collection)
+        out = []
+        for o in coll.iterator(return_properties=["caption", "image_b64"]):
+            if (o.properties or {}).get("image_b64"):
+                out.append(o.properties)
+            if len(out) >= sample:
+                break
+        return out
+    finally:
+        client.close()
+
+
+def _neighbours(mat, k: int):
+    mat = knn_graph.normalize_rows(mat)
+    sims = mat @ mat.T
+    np.fill_diagonal(sims, -np.inf)
+    return np.argsort(-sims, axis=1)[:, :k]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--collection", default=serve._get_default_collection())
+    ap.add_argument("--sample", type=int, default=100)
+    ap.add_argument("-k", type=int, default=10)
+    args = ap.parse_args()
+
+    objs = _sample_objects(args.collection, args.sample)
+    if len(objs) <= args.k:
+        raise SystemExit(f"Servono più di {args.k} oggetti con image_b64 in {args.collection}")
+
+    vectors, latencies = {}, {}
+    for dim in sorted(serve._VERTEX_EMBED_DIMENSIONS, reverse=True):
+        rows, ms = [], []
+        for props in objs:
+            t0 = time.perf_counter()
+            # la cache embedding è indicizzata anche per dimensione: ogni chiamata qui è a freddo
+            rows.append(serve._reembed_properties(props, dim))
+            ms.append((time.perf_counter() - t0) * 1000.0)
+        vectors[dim] = np.asarray(rows, dtype=np.float32)
+        latencies[dim] = np.asarray(ms)
+
+    truth = _neighbours(vectors[serve._VERTEX_DEFAULT_DIMENSION], args.k)
+    print(f"collection: {args.collection}  oggetti: {len(objs)}  k={args.k}")
+    print(f"{'dim':>6}{'mean ms':>10}{'p95 ms':>10}{'recall@k':>10}{'bytes':>8}")
+    for dim in sorted(vectors):
+        nn = _neighbours(vectors[dim], args.k)
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(nn.tolist(), truth.tolist())])
+        lat = latencies[dim]
+        print(f"{dim:>6}{lat.mean():>10.1f}{np.percentile(lat, 95):>10.1f}{recall:>10.3f}{dim * 4:>8}")
+
+
+if __name__ == "__main__":
+    main()
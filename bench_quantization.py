@@ -0,0 +1,85 @@
+"""
+Benchmark della quantizzazione dei vettori (store locale della replica).
+
+Confronta recall@k e memoria di int8 / float16 rispetto ai vettori float32 esatti,
+con e senza re-scoring esatto dei top candidati.
+
+Uso:
+  python bench_quantization.py                      # vettori sintetici
+  python bench_quantization.py --collection Sinde   # vettori reali dalla collection
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+import knn_graph
+import local_replica
+import serve
+import vector_store
+
+
+def _synthetic(n: int, dim: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(8, n // 200), dim)).astype(np.float32)
+    assign = rng.integers(0, centers.shape[0], size=n)
+    return centers[assign] + 0.35 * rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def _from_collection(collection: str):
+    replica = local_replica.LocalReplica(collection, "none")
+    client = serve._connect()
+    try:
+        serve._replica_full_sync(replica, client.collections.get(collection))
+    finally:
+        client.close()
+    if replica.vectors is None:
+        raise SystemExit(f"Nessun vettore '{serve._get_image_vector_name()}' in {collection}")
+    return np.asarray(replica.vectors.full, dtype=np.float32)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--collection", default=None)
+    ap.add_argument("-n", type=int, default=20000)
+    ap.add_argument("--dim", type=int, default=1408)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("-k", type=int, default=10)
+    ap.add_argument("--rescore-factor", type=int, default=4)
+    args = ap.parse_args()
+
+    mat = _from_collection(args.collection) if args.collection else _synthetic(args.n, args.dim)
+    mat = knn_graph.normalize_rows(mat.astype(np.float32))
+    rng = np.random.default_rng(1)
+    qidx = rng.choice(mat.shape[0], size=min(args.queries, mat.shape[0]), replace=False)
+    queries = mat[qidx] + 0.05 * rng.normal(size=(qidx.size, mat.shape[1])).astype(np.float32)
+    k = args.k
+
+    exact_top = [set(np.argsort(-(mat @ q))[:k].tolist()) for q in queries]
+    print(f"vettori: {mat.shape[0]} x {mat.shape[1]}  query: {len(queries)}  k={k}")
+    print(f"{'mode':<10}{'rescore':>8}{'recall@k':>10}{'ms/query':>10}{'RAM MB':>9}{'disk MB':>9}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in vector_store.QUANTIZATION_MODES:
+            store = vector_store.QuantizedVectorStore.from_matrix(mat, mode, Path(tmp) / f"{mode}.npy")
+            for factor in ([1, args.rescore_factor] if mode != "none" else [1]):
+                hits, t0 = 0, time.perf_counter()
+                for q, truth in zip(queries, exact_top):
+                    if factor == 1:
+                        approx = store.approx_similarities(q)
+                        rows = np.argpartition(-approx, k - 1)[:k]
+                    else:
+                        rows, _ = store.search(q, k, rescore_factor=factor)
+                    hits += len(truth.intersection(rows.tolist()))
+                ms = (time.perf_counter() - t0) * 1000.0 / len(queries)
+                size = store.nbytes()
+                print(
+                    f"{mode:<10}{factor if factor > 1 else '-':>8}{hits / (k * len(queries)):>10.4f}"
+                    f"{ms:>10.2f}{size['ram_bytes'] / 1e6:>9.1f}{size['disk_bytes'] / 1e6:>9.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""
+Job offline: costruisce il grafo k-NN sui vettori immagine della collection
+e lo salva in KNN_GRAPH_PATH (default data/knn_graph.npz), letto da related_items.
+
+Uso:
+    python build_knn_graph.py [collection] [k]
+"""
+import json
+import sys
+
+import serve
+
+
+def main() -> None:
+    collection = sys.argv[1] if len(sys.argv) > 1 else None
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    result = serve.build_knn_graph(collection=collection, k=k)
+    print(json.dumps(result, indent=2))
+    if "error" in result:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Lavoro CPU sulle immagini (base64, decodifica, resize, ricodifica) eseguito nei
+processi del pool di serve.py, fuori dal GIL del server.
+
+Il modulo non importa serve, così i worker restano leggeri con qualunque start method.
+Le funzioni restituiscono bytes (mai stringhe base64 da serializzare) e la
+configurazione arriva come dict di opzioni già letto dal processo principale.
+"""
+import base64
+import binascii
+import io
+
+# Pillow per il pre-processing (opzionale: senza, i byte vanno alle API così come sono)
+try:
+    from PIL import Image as PILImage, ImageOps
+
+    PIL_AVAILABLE = True
+except Exception:
+    PILImage = None
+    ImageOps = None
+    PIL_AVAILABLE = False
+
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+try:
+    binascii.a2b_base64(b"", strict_mode=True)
+    _STRICT_BASE64 = True
+except TypeError:
+    _STRICT_BASE64 = False
+
+# Formati accettati così come sono sia da OpenAI sia da Vertex (WEBP no: Vertex non lo supporta)
+PASSTHROUGH_MIME_TYPES = ("image/png", "image/jpeg", "image/gif")
+
+
+def detect_mime(data: bytes):
+    """MIME type dai magic bytes (bastano i primi 12), None se non è un formato riconosciuto."""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime in _IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    return None
+
+
+def sniff_mime(data: bytes) -> str:
+    """MIME type dai magic bytes (default image/png, come prima del pre-processing)."""
+    return detect_mime(data) or "image/png"
+
+
+def decode_base64(data) -> bytes:
+    """
+    Valida e decodifica in un solo passaggio (str ASCII o bytes): solleva
+    binascii.Error/ValueError se il base64 non è valido. Con Python < 3.11
+    (niente strict_mode) si usa b64decode(validate=True), equivalente ma più lento.
+    """
+    if _STRICT_BASE64:
+        return binascii.a2b_base64(data, strict_mode=True)
+    return base64.b64decode(data, validate=True)
+
+
+def encode_base64(data: bytes) -> bytes:
+    """Base64 come bytes ASCII: la conversione a str la fa il chiamante."""
+    return binascii.b2a_base64(data, newline=False)
+
+
+def _crop_margins(img, threshold: int):
+    """Ritaglia i margini bianchi attorno al disegno, lasciando un piccolo bordo."""
+    mask = img.convert("L").point(lambda p: 255 if p < threshold else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return img
+    pad = max(4, min(img.size) // 100)
+    left, top, right, bottom = bbox
+    bbox = (max(0, left - pad), max(0, top - pad), min(img.width, right + pad), min(img.height, bottom + pad))
+    if bbox == (0, 0, img.width, img.height):
+        return img
+    return img.crop(bbox)
+
+
+def preprocess(data: bytes, options: dict):
+    """
+    Decodifica una volta, riduce a options["max_edge"], opzionalmente converte in
+    scala di grigi e ritaglia i margini, poi ricodifica: JPEG per le sorgenti JPEG,
+    PNG per le altre. Restituisce (bytes, mime, resized), con bytes None se va
+    bene l'originale (non cambia nulla o il risultato è più grande): così
+    non torna indietro dal worker una copia inutile.
+    """
+    mime = sniff_mime(data)
+    if not PIL_AVAILABLE:
+        return None, mime, False
+
+    img = PILImage.open(io.BytesIO(data))
+    if getattr(img, "is_animated", False):
+        # GIF animate: solo il primo frame arriva comunque alle API
+        img.seek(0)
+    original_size = img.size
+    max_edge = options.get("max_edge") or 0
+    if max_edge and mime == "image/jpeg" and max(img.size) > max_edge:
+        # decodifica JPEG già ridotta (scala DCT), molto più economica di un decode a piena risoluzione
+        ratio = max_edge / max(img.size)
+        img.draft(img.mode, (int(img.width * ratio) + 1, int(img.height * ratio) + 1))
+    changed = mime not in PASSTHROUGH_MIME_TYPES
+    if img.getexif().get(0x0112, 1) != 1:
+        img = ImageOps.exif_transpose(img)
+        changed = True
+
+    if options.get("grayscale") and img.mode not in ("L", "1"):
+        img = img.convert("L")
+        changed = True
+    if options.get("crop_margins"):
+        cropped = _crop_margins(img, options.get("crop_threshold", 245))
+        changed = changed or cropped is not img
+        img = cropped
+    if max_edge and max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), PILImage.LANCZOS)
+        changed = True
+    elif img.size != original_size:
+        changed = True
+
+    if not changed:
+        return None, mime, False
+
+    out = io.BytesIO()
+    if mime == "image/jpeg":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(out, format="JPEG", quality=options.get("jpeg_quality", 85), optimize=True)
+        out_mime = "image/jpeg"
+    else:
+        if img.mode not in ("RGB", "RGBA", "L", "LA", "P", "1"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        img.save(out, format="PNG")
+        out_mime = "image/png"
+    encoded = out.getvalue()
+
+    resized = img.size != original_size
+    if len(encoded) >= len(data) and mime in PASSTHROUGH_MIME_TYPES:
+        return None, mime, resized
+    return encoded, out_mime, resized
+
+
+def _dct_matrix(n: int):
+    import numpy as np
+
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * x + 1) * k / (2 * n))
+
+
+def _bits_to_int(bits) -> int:
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bool(bit))
+    return value
+
+
+def perceptual_hashes(data: bytes):
+    """
+    Hash percettivi a 64 bit dell'immagine: (dhash, phash).
+    dHash: gradienti orizzontali su 9x8 in scala di grigi. pHash: segno dei
+    coefficienti DCT 8x8 a bassa frequenza (di 32x32) rispetto alla mediana;
+    None se NumPy non è installato. Solleva eccezione se Pillow manca o
+    l'immagine non è leggibile.
+    """
+    if not PIL_AVAILABLE:
+        raise RuntimeError("Pillow not installed")
+    img = PILImage.open(io.BytesIO(data))
+    img.draft("L", (64, 64))
+    img = ImageOps.exif_transpose(img).convert("L")
+
+    small = img.resize((9, 8), PILImage.LANCZOS)
+    px = small.tobytes()
+    dhash = _bits_to_int(px[row * 9 + col] > px[row * 9 + col + 1] for row in range(8) for col in range(8))
+
+    try:
+        import numpy as np
+    except ImportError:
+        return dhash, None
+    pixels = np.asarray(img.resize((32, 32), PILImage.LANCZOS), dtype=np.float64)
+    dct = _dct_matrix(32)
+    low = (dct @ pixels @ dct.T)[:8, :8].flatten()
+    median = np.median(low[1:])
+    phash = _bits_to_int(low > median)
+    return dhash, phash
@@ -0,0 +1,152 @@
+"""
+Grafo k-NN precomputato sui vettori immagine di una collection.
+
+Prodotto matriciale a blocchi, top-k per riga, salvato in un .npz compatto
+(vettori float16 normalizzati, vicini int32, punteggi float16). serve.py lo
+costruisce offline (build_knn_graph), lo tiene in memoria per related_items e
+lo aggiorna in modo incrementale dopo gli inserimenti.
+
+Il modulo non importa serve: path, k e vettori arrivano come argomenti.
+"""
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# NumPy è opzionale anche qui: senza, serve.py non costruisce né carica il grafo
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except Exception:
+    np = None
+    NUMPY_AVAILABLE = False
+
+
+def normalize_rows(matrix):
+    """Righe a norma unitaria (le righe nulle restano nulle)."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class KnnGraph:
+    """Grafo dei k vicini più prossimi (similarità coseno) sugli oggetti di una collection."""
+
+    def __init__(self, collection: str, uuids: List[str], vectors, neighbors, scores):
+        self.collection = collection
+        self.uuids = list(uuids)
+        self.index = {u: i for i, u in enumerate(self.uuids)}
+        self.vectors = vectors  # (n, d) float16, righe normalizzate
+        self.neighbors = neighbors  # (n, k) int32, -1 = vuoto
+        self.scores = scores  # (n, k) float16, ordinati decrescenti
+        self.built_at = time.time()
+        self.unsaved_updates = 0  # inserimenti incrementali non ancora salvati su disco
+
+    @property
+    def k(self) -> int:
+        return int(self.neighbors.shape[1])
+
+    @classmethod
+    def build(cls, collection: str, uuids: List[str], vectors, k: int, block_size: int = 1024):
+        mat = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        n = mat.shape[0]
+        k = min(k, max(n - 1, 0))
+        neighbors = np.full((n, k), -1, dtype=np.int32)
+        scores = np.zeros((n, k), dtype=np.float16)
+        if k > 0:
+            for start in range(0, n, block_size):
+                stop = min(start + block_size, n)
+                sims = mat[start:stop] @ mat.T
+                # esclude l'oggetto stesso dai propri vicini
+                sims[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+                top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+                top_sims = np.take_along_axis(sims, top, axis=1)
+                order = np.argsort(-top_sims, axis=1)
+                neighbors[start:stop] = np.take_along_axis(top, order, axis=1)
+                scores[start:stop] = np.take_along_axis(top_sims, order, axis=1)
+        return cls(collection, uuids, mat.astype(np.float16), neighbors, scores)
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp_path,
+            collection=np.array(self.collection),
+            uuids=np.array(self.uuids, dtype="U36"),
+            vectors=self.vectors,
+            neighbors=self.neighbors,
+            scores=self.scores,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "KnnGraph":
+        with np.load(path) as data:
+            graph = cls(
+                str(data["collection"]),
+                data["uuids"].tolist(),
+                data["vectors"],
+                data["neighbors"],
+                data["scores"],
+            )
+        graph.built_at = path.stat().st_mtime
+        return graph
+
+    def related(self, uuid_str: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        row = self.index.get(uuid_str)
+        if row is None:
+            return None
+        out = []
+        for j, score in zip(self.neighbors[row, :limit], self.scores[row, :limit]):
+            if j < 0:
+                break
+            out.append({"uuid": self.uuids[j], "similarity": round(float(score), 4)})
+        return out
+
+    def add(self, uuid_str: str, vector: List[float]) -> int:
+        """
+        Aggiornamento incrementale: aggiunge (o sostituisce) un oggetto, calcola i suoi
+        vicini e aggiorna solo le righe esistenti per cui il nuovo oggetto entra nel top-k.
+        Restituisce il numero di righe esistenti modificate.
+        """
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        v = v / norm if norm else v
+        if uuid_str in self.index:
+            self.vectors[self.index[uuid_str]] = v.astype(np.float16)
+            row = self.index[uuid_str]
+        else:
+            row = len(self.uuids)
+            self.uuids.append(uuid_str)
+            self.index[uuid_str] = row
+            self.vectors = np.vstack([self.vectors, v.astype(np.float16)[None, :]])
+            self.neighbors = np.vstack(
+                [self.neighbors, np.full((1, self.k), -1, dtype=np.int32)]
+            )
+            self.scores = np.vstack([self.scores, np.zeros((1, self.k), dtype=np.float16)])
+        if self.k == 0:
+            return 0
+
+        sims = self.vectors.astype(np.float32) @ v
+        sims[row] = -np.inf
+        top = np.argsort(-sims)[: self.k]
+        self.neighbors[row] = top
+        self.scores[row] = sims[top]
+
+        # righe in cui il nuovo oggetto batte il k-esimo vicino attuale
+        kth = np.where(self.neighbors[:, -1] < 0, -np.inf, self.scores[:, -1].astype(np.float32))
+        affected = np.nonzero(sims > kth)[0]
+        affected = affected[affected != row]
+        for i in affected:
+            mask = self.neighbors[i] != row
+            nb = np.concatenate([self.neighbors[i][mask], [row]]).astype(np.int32)
+            sc = np.concatenate([self.scores[i][mask].astype(np.float32), [sims[i]]])
+            valid = nb >= 0
+            nb, sc = nb[valid], sc[valid]
+            order = np.argsort(-sc)[: self.k]
+            self.neighbors[i] = -1
+            self.scores[i] = 0
+            self.neighbors[i, : len(order)] = nb[order]
+            self.scores[i, : len(order)] = sc[order]
+        return int(len(affected))
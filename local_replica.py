@@ -0,0 +1,267 @@
+"""
+Replica in memoria di una collection per serve.py: proprietà leggere, vettori
+immagine quantizzati (vector_store) e indice invertito BM25 su caption/name.
+
+Il modulo non importa serve: la sincronizzazione con Weaviate (iterator, fetch
+degli oggetti aggiornati) resta in serve.py, che passa qui righe e vettori già
+estratti. Le query restituiscono oggetti con la stessa forma dei risultati
+Weaviate (uuid, properties, metadata.score/distance).
+"""
+import re
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+# NumPy opzionale come in serve.py, che senza non avvia la replica
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+from vector_store import QuantizedVectorStore
+
+# Proprietà tenute in RAM. image_b64 resta solo in Weaviate: chi lo chiede lo
+# recupera per UUID con un'unica fetch sui risultati
+PROPERTIES = ("name", "source_pdf", "page_index", "mediaType", "caption")
+TEXT_FIELDS = ("caption", "name")
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: Any) -> List[str]:
+    return re.findall(r"\w+", str(text or "").lower())
+
+
+def make_row(properties: Dict[str, Any], updated_ms: int) -> Dict[str, Any]:
+    """Riga della replica: solo PROPERTIES, più i token dei campi testo per l'indice BM25."""
+    return {
+        "properties": {k: properties[k] for k in PROPERTIES if k in properties},
+        "tokens": {f: tokenize(properties.get(f)) for f in TEXT_FIELDS},
+        "updated_ms": updated_ms,
+    }
+
+
+class LocalReplica:
+    """Replica in memoria di una collection: proprietà, vettori e indice BM25."""
+
+    def __init__(self, collection: str, quantization: str = "int8", store_path: Optional[Path] = None):
+        self.collection = collection
+        self.quantization = quantization
+        self.store_path = store_path  # file memory-mapped dei vettori float32 esatti
+        self.uuids: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.properties: List[Dict[str, Any]] = []
+        self.vectors: Optional[QuantizedVectorStore] = None  # vettori immagine normalizzati
+        self.synced_at: Optional[float] = None
+        self.full_synced_at: Optional[float] = None
+        self.last_update_ms: int = 0
+        self.sync_count = 0
+        self.local_queries = 0
+        self.fallbacks = 0
+        self._postings: Dict[str, Dict[str, Any]] = {}
+        self._doc_terms: Dict[str, List[tuple]] = {}  # termini distinti per documento
+        self._doc_len: Dict[str, Any] = {}
+        self._avgdl: Dict[str, float] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.uuids)
+
+    # --- sincronizzazione ---------------------------------------------------
+    def replace(self, rows: Dict[str, Dict[str, Any]], vectors: Dict[str, Any]) -> None:
+        """Sync completo: sostituisce tutto il contenuto (così spariscono anche le cancellazioni)."""
+        with self._lock:
+            self._reset()
+            self._apply(rows, vectors)
+            self.full_synced_at = self.synced_at = time.time()
+            self.sync_count += 1
+
+    def update(self, rows: Dict[str, Dict[str, Any]], vectors: Dict[str, Any]) -> None:
+        """Sync incrementale: applica solo le righe nuove o modificate."""
+        with self._lock:
+            if rows:
+                self._apply(rows, vectors)
+            self.synced_at = time.time()
+            self.sync_count += 1
+
+    def upsert(self, uuid_str: str, properties: Dict[str, Any], vector: Optional[List[float]]) -> None:
+        with self._lock:
+            vectors = {uuid_str: np.asarray(vector, dtype=np.float32)} if vector else {}
+            self._apply({uuid_str: make_row(properties, int(time.time() * 1000))}, vectors)
+
+    def _reset(self) -> None:
+        self.uuids, self.index, self.properties = [], {}, []
+        self.vectors = None
+        self.last_update_ms = 0
+        self._postings, self._doc_terms, self._doc_len, self._avgdl = {}, {}, {}, {}
+
+    def _apply(self, rows: Dict[str, Dict[str, Any]], vectors: Dict[str, Any]) -> None:
+        """
+        Applica righe nuove o modificate (chiamare col lock). Le righe esistenti mantengono
+        la posizione, le nuove vanno in coda: vettori e indice BM25 si aggiornano solo
+        sulle righe toccate, senza ricostruire né riscrivere lo store.
+        """
+        for u in rows:
+            if u not in self.index:
+                self.index[u] = len(self.uuids)
+                self.uuids.append(u)
+                self.properties.append({})
+        for u, row in rows.items():
+            self.properties[self.index[u]] = row["properties"]
+        self.last_update_ms = max([self.last_update_ms] + [r["updated_ms"] for r in rows.values()])
+        self._apply_vectors(rows, vectors)
+        self._apply_postings(rows)
+
+    def _apply_vectors(self, rows: Dict[str, Dict[str, Any]], vectors: Dict[str, Any]) -> None:
+        if self.vectors is None:
+            # primo sync (o nessun vettore finora): store costruito in un colpo solo
+            dims = {len(v) for v in vectors.values()}
+            if not dims:
+                return
+            dim = max(dims)
+            mat = np.zeros((len(self.uuids), dim), dtype=np.float32)
+            for u, vec in vectors.items():
+                if len(vec) == dim:
+                    mat[self.index[u]] = vec
+            self.vectors = QuantizedVectorStore.from_matrix(mat, self.quantization, self.store_path)
+            return
+        store = self.vectors
+        positions = [self.index[u] for u in rows]
+        mat = np.zeros((len(positions), store.dim), dtype=np.float32)
+        for j, u in enumerate(rows):
+            vec = vectors.get(u)
+            if vec is not None and len(vec) == store.dim:
+                mat[j] = vec
+        store.set_rows(positions, mat)
+
+    def _apply_postings(self, rows: Dict[str, Dict[str, Any]]) -> None:
+        n = len(self.uuids)
+        empty = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+        for field in TEXT_FIELDS:
+            doc_len = self._doc_len.get(field, np.zeros(0, dtype=np.float32))
+            if doc_len.shape[0] < n:
+                doc_len = np.concatenate([doc_len, np.zeros(n - doc_len.shape[0], dtype=np.float32)])
+            doc_terms = self._doc_terms.setdefault(field, [])
+            doc_terms.extend([()] * (n - len(doc_terms)))
+            removed: Dict[str, List[int]] = {}
+            added: Dict[str, Dict[int, int]] = {}
+            for u, row in rows.items():
+                i = self.index[u]
+                for t in doc_terms[i]:
+                    removed.setdefault(t, []).append(i)
+                tokens = row["tokens"][field]
+                counts: Dict[str, int] = {}
+                for t in tokens:
+                    counts[t] = counts.get(t, 0) + 1
+                for t, c in counts.items():
+                    added.setdefault(t, {})[i] = c
+                doc_terms[i] = tuple(counts)
+                doc_len[i] = len(tokens)
+            postings = self._postings.setdefault(field, {})
+            for t in set(removed) | set(added):
+                docs, tf = postings.get(t, empty)
+                if t in removed:
+                    keep = ~np.isin(docs, removed[t])
+                    docs, tf = docs[keep], tf[keep]
+                if t in added:
+                    d = added[t]
+                    docs = np.concatenate([docs, np.fromiter(d.keys(), dtype=np.int32, count=len(d))])
+                    tf = np.concatenate([tf, np.fromiter(d.values(), dtype=np.float32, count=len(d))])
+                if docs.size:
+                    postings[t] = (docs, tf)
+                else:
+                    postings.pop(t, None)
+            self._doc_len[field] = doc_len
+            self._avgdl[field] = float(doc_len.mean()) if n else 0.0
+
+    # --- query ------------------------------------------------------------
+    def is_fresh(self, max_age_s: float) -> bool:
+        return self.synced_at is not None and time.time() - self.synced_at <= max_age_s and bool(self.uuids)
+
+    def get_properties(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Proprietà (copie) degli UUID presenti nella replica."""
+        with self._lock:
+            return {u: dict(self.properties[self.index[u]]) for u in ids if u in self.index}
+
+    def bm25_scores(self, query: str, query_properties: Optional[List[str]] = None):
+        """Punteggi BM25 (somma sui campi) per tutti i documenti, vettorizzati con NumPy."""
+        n = len(self.uuids)
+        scores = np.zeros(n, dtype=np.float32)
+        fields = [f for f in (query_properties or TEXT_FIELDS) if f in self._postings]
+        terms = tokenize(query)
+        for field in fields:
+            postings = self._postings[field]
+            doc_len = self._doc_len[field]
+            avgdl = self._avgdl[field] or 1.0
+            for t in terms:
+                hit = postings.get(t)
+                if hit is None:
+                    continue
+                docs, tf = hit
+                idf = np.log(1.0 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                norm = tf + BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len[docs] / avgdl)
+                scores[docs] += idf * tf * (BM25_K1 + 1.0) / norm
+        return scores
+
+    @staticmethod
+    def _top(scores, limit: int, mask=None):
+        candidates = np.arange(scores.shape[0]) if mask is None else np.nonzero(mask)[0]
+        if candidates.size == 0 or limit <= 0:
+            return []
+        k = min(limit, candidates.size)
+        sub = scores[candidates]
+        top = np.argpartition(-sub, k - 1)[:k]
+        return candidates[top[np.argsort(-sub[top], kind="stable")]].tolist()
+
+    def _object(self, i: int, score=None, distance=None):
+        return SimpleNamespace(
+            uuid=self.uuids[i],
+            properties=dict(self.properties[i]),
+            metadata=SimpleNamespace(score=score, distance=distance),
+        )
+
+    def bm25(self, query: str, limit: int, query_properties=None, search_filters=None):
+        """
+        Top-`limit` BM25. `search_filters` è un oggetto con mask(properties) -> array
+        booleano (i filtri strutturati di serve.py).
+        """
+        with self._lock:
+            scores = self.bm25_scores(query, query_properties)
+            mask = scores > 0
+            if search_filters is not None:
+                mask &= search_filters.mask(self.properties)
+            top = self._top(scores, limit, mask=mask)
+            objects = [self._object(i, score=float(scores[i])) for i in top]
+        return SimpleNamespace(objects=objects)
+
+    def near_vector(self, query_vector: List[float], limit: int, search_filters=None):
+        """
+        Top-`limit` per similarità coseno sui vettori immagine; None se la replica non
+        ha vettori della stessa dimensione della query.
+        """
+        with self._lock:
+            store = self.vectors
+            if store is None or not query_vector or len(query_vector) != store.dim:
+                return None
+            mask = search_filters.mask(self.properties) if search_filters is not None else None
+            rows, sims = store.search(query_vector, limit, mask=mask)
+            objects = [
+                self._object(i, distance=float(1.0 - sim)) for i, sim in zip(rows.tolist(), sims.tolist())
+            ]
+        return SimpleNamespace(objects=objects)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "collection": self.collection,
+            "objects": len(self.uuids),
+            "dimensions": self.vectors.dim if self.vectors is not None else None,
+            "quantization": self.vectors.mode if self.vectors is not None else None,
+            "vectors": self.vectors.nbytes() if self.vectors is not None else None,
+            "terms": {f: len(p) for f, p in self._postings.items()},
+            "synced_age_s": round(time.time() - self.synced_at, 1) if self.synced_at else None,
+            "sync_count": self.sync_count,
+            "local_queries": self.local_queries,
+            "fallbacks": self.fallbacks,
+        }
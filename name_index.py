@@ -0,0 +1,139 @@
+"""
+Indice di autocompletamento sui nomi dei pezzi (proprietà `name`) per suggest_names.
+
+Array ordinato sulle chiavi normalizzate: per ogni nome si indicizzano il nome intero
+e i suffissi che iniziano a ogni parola ("vite m8" → "vite m8", "m8"). Prefissi corti
+(fino a BUCKET_CHARS caratteri): top-k già ordinato per prefisso, perché il loro
+intervallo copre gran parte delle chiavi. Prefissi più lunghi: bisect + scansione
+dell'intero intervallo con il prefisso.
+
+Il modulo non importa serve: i nomi arrivano da chi costruisce l'indice.
+"""
+import bisect
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from local_replica import tokenize
+
+BUCKET_CHARS = 3
+TOP_K = 50  # = limite massimo di suggest_names
+
+
+class NameIndex:
+    """Indice di prefissi sui nomi dei pezzi (array ordinato di chiavi)."""
+
+    def __init__(self):
+        self.keys: List[str] = []  # chiavi normalizzate, ordinate
+        self.entries: List[int] = []  # chiave → id del nome
+        self.whole: List[bool] = []  # chiave = nome intero (non suffisso da una parola interna)
+        self.names: List[str] = []  # id → nome (prima forma vista)
+        self.counts: List[int] = []  # id → oggetti con quel nome
+        self._ids: Dict[str, int] = {}  # nome normalizzato → id
+        # prefisso corto → [(id, intero)] già ordinati per rilevanza, al massimo TOP_K
+        self.buckets: Dict[str, List[tuple]] = {}
+        self._lock = threading.Lock()
+        self.built_at: Optional[float] = None
+
+    def _rank_key(self, item: tuple) -> tuple:
+        idx, whole = item
+        return (not whole, -self.counts[idx], len(self.names[idx]))
+
+    def _ranked(self, seen: Dict[int, bool], limit: int) -> List[tuple]:
+        return sorted(seen.items(), key=self._rank_key)[:limit]
+
+    def _bucket_merge(self, triples: List[tuple]) -> None:
+        """
+        Inserisce (chiave, id, intero) nei bucket dei prefissi corti e li riordina.
+        I conteggi crescono soltanto: un nome fuori dal top-k può entrarci, nessun
+        altro ne esce per ragioni diverse, quindi l'aggiornamento resta esatto.
+        """
+        touched: Dict[str, Dict[int, bool]] = {}
+        for key, idx, whole in triples:
+            for n in range(1, min(len(key), BUCKET_CHARS) + 1):
+                entry = touched.setdefault(key[:n], {})
+                entry[idx] = entry.get(idx, False) or whole
+        for prefix, entry in touched.items():
+            seen = dict(self.buckets.get(prefix, ()))
+            for idx, whole in entry.items():
+                seen[idx] = seen.get(idx, False) or whole
+            self.buckets[prefix] = self._ranked(seen, TOP_K)
+
+    def _register(self, raw: Any) -> Optional[tuple]:
+        """Conta il nome; restituisce (nuovo, chiavi) con chiavi = [(chiave, id, intero)]."""
+        tokens = tokenize(raw)
+        if not tokens:
+            return None
+        norm = " ".join(tokens)
+        idx = self._ids.get(norm)
+        is_new = idx is None
+        if is_new:
+            idx = self._ids[norm] = len(self.names)
+            self.names.append(str(raw).strip())
+            self.counts.append(1)
+        else:
+            self.counts[idx] += 1
+        return is_new, [(" ".join(tokens[i:]), idx, i == 0) for i in range(len(tokens))]
+
+    def add(self, name: Any) -> None:
+        with self._lock:
+            registered = self._register(name)
+            if registered is None:
+                return
+            is_new, triples = registered
+            if is_new:
+                for key, idx, whole in triples:
+                    pos = bisect.bisect_left(self.keys, key)
+                    self.keys.insert(pos, key)
+                    self.entries.insert(pos, idx)
+                    self.whole.insert(pos, whole)
+            # anche con un nome già noto il conteggio cambia l'ordine dei bucket
+            self._bucket_merge(triples)
+
+    @classmethod
+    def build(cls, names) -> "NameIndex":
+        index = cls()
+        triples: List[tuple] = []
+        for raw in names:
+            registered = index._register(raw)
+            if registered is not None and registered[0]:
+                triples.extend(registered[1])
+        triples.sort()
+        index.keys = [t[0] for t in triples]
+        index.entries = [t[1] for t in triples]
+        index.whole = [t[2] for t in triples]
+        # bucket dei prefissi corti calcolati a conteggi definitivi, in un solo passaggio
+        buckets: Dict[str, Dict[int, bool]] = {}
+        for key, idx, whole in triples:
+            for n in range(1, min(len(key), BUCKET_CHARS) + 1):
+                entry = buckets.setdefault(key[:n], {})
+                entry[idx] = entry.get(idx, False) or whole
+        index.buckets = {p: index._ranked(seen, TOP_K) for p, seen in buckets.items()}
+        index.built_at = time.time()
+        return index
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Completamenti ordinati: prima i nomi che iniziano col prefisso, poi per frequenza e lunghezza."""
+        p = " ".join(tokenize(prefix))
+        if not p:
+            return []
+        with self._lock:
+            if len(p) <= BUCKET_CHARS and limit <= TOP_K:
+                ranked = self.buckets.get(p, [])[:limit]
+            else:
+                start = bisect.bisect_left(self.keys, p)
+                stop = bisect.bisect_left(self.keys, p + "\U0010ffff", lo=start)
+                seen: Dict[int, bool] = {}
+                for pos in range(start, stop):
+                    idx = self.entries[pos]
+                    seen[idx] = seen.get(idx, False) or self.whole[pos]
+                ranked = self._ranked(seen, limit)
+            return [{"name": self.names[i], "count": self.counts[i]} for i, _ in ranked]
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "names": len(self.names),
+            "keys": len(self.keys),
+            "prefix_buckets": len(self.buckets),
+            "built_age_s": round(time.time() - self.built_at, 1) if self.built_at else None,
+        }
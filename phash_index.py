@@ -0,0 +1,123 @@
+"""
+Indice dei quasi-duplicati di una collection per serve.py: hash percettivo a 64 bit
+(pHash, o dHash senza NumPy) di ogni immagine in un BK-tree con distanza di Hamming,
+più lo sha256 dei byte per i duplicati esatti, salvato su disco in JSON.
+
+Il modulo non importa serve: gli hash si calcolano con image_worker.perceptual_hashes
+e arrivano qui già pronti.
+"""
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """BK-tree su hash a 64 bit: ricerca entro un raggio di Hamming senza scansione completa."""
+
+    def __init__(self):
+        self.root: Optional[list] = None  # [hash, [valori], {distanza: figlio}]
+        self.size = 0
+
+    def add(self, h: int, value: str) -> None:
+        node = self.root
+        if node is None:
+            self.root = [h, [value], {}]
+            self.size += 1
+            return
+        while True:
+            d = hamming(h, node[0])
+            if d == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, [value], {}]
+                self.size += 1
+                return
+            node = child
+
+    def search(self, h: int, radius: int) -> List[tuple]:
+        """Coppie (distanza, valore) entro `radius`, ordinate per distanza."""
+        out: List[tuple] = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                out.extend((d, v) for v in node[1])
+            for dist, child in node[2].items():
+                if d - radius <= dist <= d + radius:
+                    stack.append(child)
+        out.sort(key=lambda x: x[0])
+        return out
+
+
+class PerceptualIndex:
+    """Indice dei quasi-duplicati di una collection: uuid → (sha256, dhash, phash)."""
+
+    def __init__(self, collection: str, kind: str):
+        self.collection = collection
+        self.kind = kind  # "phash" oppure "dhash" (hash usato nel BK-tree)
+        self.items: Dict[str, list] = {}
+        self.by_sha: Dict[str, List[str]] = {}
+        self.tree = BKTree()
+        self.built_at: Optional[float] = None
+        self.version = 0  # cresce a ogni immagine aggiunta: invalida i lookup in cache
+        self._lock = threading.Lock()
+
+    def add(self, uid: str, sha: str, dhash: int, phash: Optional[int]) -> None:
+        h = phash if self.kind == "phash" else dhash
+        if h is None:
+            return
+        with self._lock:
+            if uid in self.items:
+                return
+            self.items[uid] = [sha, dhash, phash]
+            self.by_sha.setdefault(sha, []).append(uid)
+            self.tree.add(h, uid)
+            self.version += 1
+
+    def lookup(self, sha: str, dhash: int, phash: Optional[int], radius: int) -> List[Dict[str, Any]]:
+        """Duplicati esatti (stesso sha256) e quasi-duplicati entro `radius`, i più vicini prima."""
+        h = phash if self.kind == "phash" else dhash
+        with self._lock:
+            exact = set(self.by_sha.get(sha, ()))
+            near = self.tree.search(h, radius) if h is not None else []
+        out = [{"uuid": uid, "distance": 0, "exact": True} for uid in sorted(exact)]
+        for d, uid in near:
+            if uid not in exact:
+                out.append({"uuid": uid, "distance": d, "exact": False})
+        return out
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            data = {"collection": self.collection, "kind": self.kind, "items": dict(self.items)}
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path, collection: str, kind: str) -> "PerceptualIndex":
+        index = cls(collection, kind)
+        if path.exists():
+            data = json.loads(path.read_text(encoding="utf-8"))
+            if data.get("collection") == collection and data.get("kind") == kind:
+                for uid, (sha, dhash, phash) in data.get("items", {}).items():
+                    index.add(uid, sha, dhash, phash)
+        return index
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "collection": self.collection,
+            "kind": self.kind,
+            "images": len(self.items),
+            "distinct_hashes": self.tree.size,
+            "built_at": self.built_at,
+        }
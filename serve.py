@@ -3,10 +3,17 @@ import os
 import json
 import time
 import uuid
+import secrets
+import atexit
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 from dataclasses import dataclass
 from functools import lru_cache
+from types import SimpleNamespace
 from urllib.parse import urlparse
 import mcp.types as types
 
@@ -185,8 +192,8 @@ from starlette.responses import JSONResponse
 
 # --- Weaviate client imports (v4) ---
 import weaviate
-from weaviate.classes.init import Auth
-from weaviate.classes.query import MetadataQuery
+from weaviate.classes.init import AdditionalConfig, Auth, Timeout
+from weaviate.classes.query import Filter, GroupBy, MetadataQuery
 
 # OpenAI client per descrizioni immagini
 from openai import OpenAI
@@ -197,6 +204,31 @@ if os.environ.get("OPENAI_API_KEY"):
 else:
     print("[query-caption] WARNING: OPENAI_API_KEY non impostata, niente descrizioni testuali per le query.")
 
+# NumPy per fusione/re-rank locali (opzionale: senza, si usa solo la fusione lato Weaviate)
+try:
+    import numpy as np
+
+    _NUMPY_AVAILABLE = True
+except Exception:
+    np = None
+    _NUMPY_AVAILABLE = False
+
+# Lavoro CPU sulle immagini (base64, resize): gira anche nei processi del pool immagini
+import image_worker
+
+# Grafo k-NN precomputato per related_items (usa NumPy, se disponibile)
+import knn_graph
+
+# Vettori quantizzati e replica locale della collection (NumPy)
+import local_replica
+import vector_store
+
+# Indice dei nomi per suggest_names
+import name_index
+
+# Indice dei quasi-duplicati (hash percettivi in un BK-tree)
+import phash_index
+
 # In-memory stato Vertex
 _VERTEX_HEADERS: Dict[str, str] = {}
 _VERTEX_REFRESH_THREAD_STARTED = False
@@ -204,9 +236,8 @@ _VERTEX_USER_PROJECT: Optional[str] = None
 
 # In-memory storage per immagini caricate (temporaneo, scade dopo 1 ora)
 _UPLOADED_IMAGES: Dict[str, Dict[str, Any]] = {}
-
-# Ultimi risultati ricevuti dal widget Sinde (visibili ai tool MCP)
-_LAST_WIDGET_RESULTS: Dict[str, Any] = {}
+# Indice per contenuto: sha256 dei byte decodificati -> image_id ancora valido
+_UPLOADED_IMAGE_IDS_BY_HASH: Dict[str, str] = {}
 
 _BASE_DIR = Path(__file__).resolve().parent
 _DEFAULT_PROMPT_PATH = _BASE_DIR / "prompts" / "instructions.md"
@@ -299,6 +330,388 @@ def _get_default_alpha() -> float:
         return 0.2
 
 
+def _get_default_deadline_ms() -> Optional[int]:
+    """
+    Restituisce il budget di latenza di default (ms) per hybrid_search e /image-search.
+    Se SEARCH_DEADLINE_MS non è impostata (o non è valida), nessun deadline.
+    """
+    val = os.environ.get("SEARCH_DEADLINE_MS")
+    if not val:
+        return None
+    try:
+        ms = int(val)
+    except (TypeError, ValueError):
+        return None
+    return ms if ms > 0 else None
+
+
+def _get_image_vector_name() -> str:
+    """
+    Restituisce il nome del named vector con gli embedding Vertex delle immagini.
+    Se WEAVIATE_IMAGE_VECTOR è impostata usa quella; altrimenti 'image'.
+    """
+    return os.environ.get("WEAVIATE_IMAGE_VECTOR", "image")
+
+
+_VERTEX_EMBED_DIMENSIONS = (128, 256, 512, 1408)
+_VERTEX_DEFAULT_DIMENSION = 1408
+
+
+def _get_embedding_dimension(collection: Optional[str] = None) -> int:
+    """
+    Restituisce la dimensione degli embedding Vertex per la collection.
+    VERTEX_EMBED_DIMENSIONS: mappa JSON collection → dimensione (es. {"Sinde": 512});
+    altrimenti VERTEX_EMBED_DIMENSION, default 1408 (128/256/512/1408).
+    """
+    dim = os.environ.get("VERTEX_EMBED_DIMENSION")
+    raw = os.environ.get("VERTEX_EMBED_DIMENSIONS")
+    if raw and collection:
+        try:
+            dim = json.loads(raw).get(collection, dim)
+        except (ValueError, AttributeError):
+            print(f"[vertex] invalid VERTEX_EMBED_DIMENSIONS: {raw!r}")
+    try:
+        dim = int(dim) if dim else _VERTEX_DEFAULT_DIMENSION
+    except (TypeError, ValueError):
+        return _VERTEX_DEFAULT_DIMENSION
+    return dim if dim in _VERTEX_EMBED_DIMENSIONS else _VERTEX_DEFAULT_DIMENSION
+
+
+def _get_env_float(key: str, default: float) -> float:
+    val = os.environ.get(key)
+    if not val:
+        return default
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return default
+
+
+def _get_caption_fallback_mode() -> str:
+    """
+    Restituisce la modalità di ricerca usata quando la caption GPT non è disponibile.
+    CAPTION_FALLBACK_MODE: 'near_vector' (default, embedding Vertex), 'near_image' o 'bm25'.
+    """
+    mode = os.environ.get("CAPTION_FALLBACK_MODE", "near_vector").lower()
+    if mode not in ("near_vector", "near_image", "bm25"):
+        return "near_vector"
+    return mode
+
+
+_SEARCH_MODES = ("fast", "balanced", "accurate")
+
+
+def _get_default_search_mode() -> str:
+    """
+    Restituisce il livello di latenza di default per le ricerche per immagine.
+    Se SEARCH_DEFAULT_MODE è impostata (fast/balanced/accurate) usa quella; altrimenti 'accurate'.
+    """
+    mode = os.environ.get("SEARCH_DEFAULT_MODE", "accurate").lower()
+    return mode if mode in _SEARCH_MODES else "accurate"
+
+
+class _LRUCache:
+    """Cache LRU thread-safe con dimensione massima e TTL opzionale (s)."""
+
+    def __init__(self, maxsize: int = 256, ttl_s: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, stored_at = item
+            if self.ttl_s is not None and time.monotonic() - stored_at > self.ttl_s:
+                self._data.pop(key, None)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[0] if item is not None else default
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class _LatencyStats:
+    """Latenze recenti (ms) di una pipeline, per p50/p95 nelle metriche."""
+
+    def __init__(self, maxlen: int = 500):
+        self.count = 0
+        self._samples: deque = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, elapsed_ms: float) -> None:
+        with self._lock:
+            self.count += 1
+            self._samples.append(elapsed_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {"count": self.count}
+        return {
+            "count": self.count,
+            "p50_ms": round(samples[len(samples) // 2], 1),
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1),
+            "max_ms": round(samples[-1], 1),
+        }
+
+
+# Caption GPT e embedding Vertex già calcolati, per chiave contenuto dell'immagine
+_CAPTION_CACHE = _LRUCache(maxsize=512, ttl_s=24 * 3600)
+_EMBEDDING_CACHE = _LRUCache(maxsize=512, ttl_s=24 * 3600)
+
+# Latenze per livello di ricerca (fast / balanced / accurate) e tipo di query
+_TIER_METRICS: Dict[str, _LatencyStats] = {}
+
+
+def _record_tier_latency(mode: str, kind: str, elapsed_ms: float) -> None:
+    key = f"{mode}/{kind}"
+    stats = _TIER_METRICS.get(key)
+    if stats is None:
+        stats = _TIER_METRICS.setdefault(key, _LatencyStats())
+    stats.record(elapsed_ms)
+
+
+def _image_key(data: bytes) -> str:
+    """Chiave di contenuto dell'immagine (sha256 dei byte decodificati), usata dalle cache."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class _ImageRecord:
+    """
+    Immagine in ingresso, validata e decodificata una sola volta: i byte restano
+    accanto all'identità (sha256) e il base64 si ricalcola solo se un'API lo
+    richiede (near_image, proprietà image_b64 in Weaviate). Se l'immagine è
+    arrivata già in base64 si tiene la stringa originale, senza ricodificare.
+    """
+
+    __slots__ = ("data", "_key", "_b64")
+
+    def __init__(self, data: bytes, b64: Optional[str] = None, key: Optional[str] = None):
+        self.data = data
+        self._key = key
+        self._b64 = b64
+
+    @property
+    def key(self) -> str:
+        if self._key is None:
+            self._key = _image_key(self.data)
+        return self._key
+
+    @property
+    def b64(self) -> str:
+        if self._b64 is None:
+            self._b64 = _IMAGE_POOL.run(image_worker.encode_base64, self.data).decode("ascii")
+        return self._b64
+
+
+_FUSION_TYPES = ("server", "relative_score", "ranked")
+
+
+def _get_default_fusion() -> str:
+    """
+    Restituisce dove fondere le due gambe di hybrid_search.
+    HYBRID_FUSION: 'server' (default, Weaviate), 'relative_score' o 'ranked' (fusione locale NumPy).
+    """
+    fusion = os.environ.get("HYBRID_FUSION", "server").lower()
+    return fusion if fusion in _FUSION_TYPES else "server"
+
+
+# ==== Circuit breaker per le dipendenze esterne ===============================
+class _CircuitOpenError(RuntimeError):
+    """Sollevata quando una chiamata viene rifiutata perché il breaker è aperto."""
+
+
+class _CircuitBreaker:
+    """
+    Circuit breaker con finestra mobile di errori e latenze.
+
+    - closed: le chiamate passano; si apre quando nella finestra (window_s) ci sono
+      almeno min_calls chiamate e la quota di fallite o lente (> slow_call_s)
+      supera failure_ratio.
+    - open: le chiamate vengono rifiutate subito per cooldown_s.
+    - half_open: passa una sola chiamata di prova; se va bene si richiude,
+      altrimenti si riapre.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window_s: float = 60.0,
+        min_calls: int = 5,
+        failure_ratio: float = 0.5,
+        slow_call_s: float = 10.0,
+        cooldown_s: float = 30.0,
+    ):
+        self.name = name
+        self.window_s = window_s
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_s = slow_call_s
+        self.cooldown_s = cooldown_s
+        self.state = "closed"
+        self.opened_at: Optional[float] = None
+        self.rejected_calls = 0
+        self.total_calls = 0
+        self._probe_in_flight = False
+        self._calls: deque = deque()  # (timestamp, failed, latency_s)
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > self.window_s:
+            self._calls.popleft()
+
+    def is_open(self) -> bool:
+        """True se il breaker è aperto e il cooldown non è ancora trascorso (non consuma la prova)."""
+        with self._lock:
+            return (
+                self.state == "open"
+                and self.opened_at is not None
+                and time.monotonic() - self.opened_at < self.cooldown_s
+            )
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "open":
+                if self.opened_at is not None and now - self.opened_at >= self.cooldown_s:
+                    self.state = "half_open"
+                    self._probe_in_flight = False
+                else:
+                    self.rejected_calls += 1
+                    return False
+            if self.state == "half_open":
+                if self._probe_in_flight:
+                    self.rejected_calls += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record(self, ok: bool, latency_s: float) -> None:
+        failed = (not ok) or latency_s > self.slow_call_s
+        with self._lock:
+            now = time.monotonic()
+            self.total_calls += 1
+            if self.state == "half_open":
+                self._probe_in_flight = False
+                if failed:
+                    self._open(now)
+                else:
+                    self.state = "closed"
+                    self._calls.clear()
+                    print(f"[circuit] {self.name} closed after successful probe")
+                return
+            self._calls.append((now, failed, latency_s))
+            self._trim(now)
+            if self.state == "closed" and len(self._calls) >= self.min_calls:
+                failures = sum(1 for _, f, _ in self._calls if f)
+                if failures / len(self._calls) >= self.failure_ratio:
+                    self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = "open"
+        self.opened_at = now
+        print(f"[circuit] {self.name} OPEN for {self.cooldown_s:.0f}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            calls = list(self._calls)
+            latencies = sorted(lat for _, _, lat in calls)
+            retry_in = None
+            if self.state == "open" and self.opened_at is not None:
+                retry_in = max(0.0, self.cooldown_s - (now - self.opened_at))
+            return {
+                "state": self.state,
+                "window_calls": len(calls),
+                "window_failures": sum(1 for _, f, _ in calls if f),
+                "window_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+                "window_max_ms": round(latencies[-1] * 1000, 1) if latencies else None,
+                "total_calls": self.total_calls,
+                "rejected_calls": self.rejected_calls,
+                "retry_in_s": round(retry_in, 1) if retry_in is not None else None,
+            }
+
+
+def _make_breaker(name: str, slow_call_s: float) -> _CircuitBreaker:
+    prefix = f"CB_{name.upper()}_"
+    return _CircuitBreaker(
+        name,
+        window_s=_get_env_float(prefix + "WINDOW_S", _get_env_float("CB_WINDOW_S", 60.0)),
+        min_calls=int(_get_env_float(prefix + "MIN_CALLS", _get_env_float("CB_MIN_CALLS", 5))),
+        failure_ratio=_get_env_float(prefix + "FAILURE_RATIO", _get_env_float("CB_FAILURE_RATIO", 0.5)),
+        slow_call_s=_get_env_float(prefix + "SLOW_CALL_S", slow_call_s),
+        cooldown_s=_get_env_float(prefix + "COOLDOWN_S", _get_env_float("CB_COOLDOWN_S", 30.0)),
+    )
+
+
+_BREAKERS: Dict[str, _CircuitBreaker] = {
+    "openai_caption": _make_breaker("openai_caption", slow_call_s=15.0),
+    "vertex_embed": _make_breaker("vertex_embed", slow_call_s=8.0),
+    "weaviate_query": _make_breaker("weaviate_query", slow_call_s=8.0),
+}
+
+
+def _guarded_call(breaker_name: str, fn, *args, **kwargs):
+    """Esegue fn passando dal circuit breaker indicato (fail-fast se aperto)."""
+    breaker = _BREAKERS[breaker_name]
+    if not breaker.allow():
+        raise _CircuitOpenError(f"circuit breaker '{breaker_name}' is open")
+    t0 = time.monotonic()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception:
+        breaker.record(False, time.monotonic() - t0)
+        raise
+    breaker.record(True, time.monotonic() - t0)
+    return result
+
+
+def _circuit_breaker_snapshot() -> Dict[str, Any]:
+    return {name: b.snapshot() for name, b in _BREAKERS.items()}
+
+
+def _weaviate_unavailable() -> Optional[Dict[str, Any]]:
+    """Risposta di errore immediata se il breaker Weaviate è aperto, altrimenti None."""
+    breaker = _BREAKERS["weaviate_query"]
+    if not breaker.is_open():
+        return None
+    snap = breaker.snapshot()
+    return {
+        "error": (
+            "Weaviate temporaneamente non disponibile (circuit breaker aperto), "
+            f"riprova tra {snap['retry_in_s']}s."
+        ),
+        "circuit_breaker": snap,
+    }
+
+
 def _resolve_service_account_path() -> Optional[str]:
     gac_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
     if gac_path and os.path.exists(gac_path):
@@ -381,7 +794,7 @@ def _sync_refresh_vertex_token() -> bool:
     return True
 
 
-def _connect():
+def _connect(query_timeout_s: Optional[float] = None):
     url = _get_weaviate_url()
     key = _get_weaviate_api_key()
     _resolve_service_account_path()
@@ -420,10 +833,21 @@ def _connect():
     else:
         print("[vertex-oauth] WARNING: no Vertex token available for connection")
 
-    client = weaviate.connect_to_weaviate_cloud(
+    # Timeout delle query allineato al deadline della richiesta (se presente)
+    additional_config = None
+    if query_timeout_s is not None:
+        additional_config = AdditionalConfig(
+            timeout=Timeout(query=max(1, int(query_timeout_s + 0.999)))
+        )
+
+    # anche la connessione passa dal breaker: con Weaviate giù non aspettiamo il timeout
+    client = _guarded_call(
+        "weaviate_query",
+        weaviate.connect_to_weaviate_cloud,
         cluster_url=url,
         auth_credentials=Auth.api_key(key),
         headers=headers or None,
+        additional_config=additional_config,
     )
 
     # Imposta anche i metadata gRPC (necessari per Weaviate)
@@ -532,6 +956,47 @@ def _update_client_grpc_metadata(client):
         print(f"[vertex-oauth] warning: cannot update gRPC metadata: {e}")
 
 
+class _LazyClient:
+    """Client Weaviate aperto solo al primo uso (thread-safe); close() è un no-op se mai aperto."""
+
+    def __init__(self, query_timeout_s: Optional[float] = None):
+        self.query_timeout_s = query_timeout_s
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._client is None:
+                self._client = _connect(query_timeout_s=self.query_timeout_s)
+                _update_client_grpc_metadata(self._client)
+            return self._client
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+class _LazyCollection:
+    """
+    Collection risolta al primo accesso a un suo attributo (query, data, ...):
+    le cache locali (fusione, candidati) si consultano senza aprire la connessione.
+    `client` è un client Weaviate già aperto oppure un _LazyClient.
+    """
+
+    def __init__(self, name: str, client):
+        self.name = name
+        self._client = client
+        self._coll = None
+
+    def __getattr__(self, attr: str):
+        if self._coll is None:
+            client = self._client.get() if isinstance(self._client, _LazyClient) else self._client
+            self._coll = client.collections.get(self.name)
+        return getattr(self._coll, attr)
+
+
 def _load_text_source(env_keys, file_path):
     if isinstance(env_keys, str):
         env_keys = [env_keys]
@@ -823,6 +1288,11 @@ async def health(_request):
     return JSONResponse({"status": "ok", "service": "weaviate-mcp-http"})
 
 
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(_request):
+    return JSONResponse(get_metrics())
+
+
 @mcp.custom_route("/assets/{file_path:path}", methods=["GET"])
 async def serve_assets(request):
     from starlette.responses import FileResponse
@@ -878,35 +1348,217 @@ async def serve_assets(request):
     )
 
 
+def _get_upload_max_bytes() -> int:
+    """Dimensione massima di un'immagine caricata (UPLOAD_MAX_BYTES, default 10 MB come per gli URL)."""
+    return max(1, int(_get_env_float("UPLOAD_MAX_BYTES", 10 * 1024 * 1024)))
+
+
+# Margine per header multipart, altri campi e JSON attorno all'immagine
+_UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+
+_UPLOADED_IMAGE_TTL_S = 3600
+
+
+def _purge_expired_uploads() -> None:
+    current_time = time.time()
+    expired_ids = [
+        img_id
+        for img_id, data in _UPLOADED_IMAGES.items()
+        if data["expires_at"] < current_time
+    ]
+    for img_id in expired_ids:
+        _UPLOADED_IMAGES.pop(img_id, None)
+    for key, img_id in list(_UPLOADED_IMAGE_IDS_BY_HASH.items()):
+        if img_id not in _UPLOADED_IMAGES:
+            _UPLOADED_IMAGE_IDS_BY_HASH.pop(key, None)
+
+
+def _lookup_uploaded_image(sha256: str) -> Optional[str]:
+    """image_id ancora valido per questi byte (sha256 esadecimale), rinnovando la scadenza."""
+    image_id = _UPLOADED_IMAGE_IDS_BY_HASH.get((sha256 or "").lower())
+    entry = _UPLOADED_IMAGES.get(image_id) if image_id else None
+    if entry is None or entry["expires_at"] < time.time():
+        return None
+    entry["expires_at"] = time.time() + _UPLOADED_IMAGE_TTL_S
+    return image_id
+
+
+def _store_uploaded_image(image: _ImageRecord):
+    """
+    Salva l'immagine nello store temporaneo indicizzato per contenuto.
+    Se gli stessi byte sono già presenti con un image_id valido lo riusa
+    (scadenza rinnovata). Restituisce (image_id, reused).
+    """
+    _purge_expired_uploads()
+    image_id = _lookup_uploaded_image(image.key)
+    if image_id is not None:
+        return image_id, True
+    image_id = str(uuid.uuid4())
+    _UPLOADED_IMAGES[image_id] = {
+        "image": image,
+        "expires_at": time.time() + _UPLOADED_IMAGE_TTL_S,
+    }
+    _UPLOADED_IMAGE_IDS_BY_HASH[image.key] = image_id
+    return image_id, False
+
+
+def _is_sha256_hex(value: Any) -> bool:
+    return (
+        isinstance(value, str)
+        and len(value) == 64
+        and all(c in "0123456789abcdefABCDEF" for c in value)
+    )
+
+
+class _UploadError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _check_content_length(request, limit: int) -> None:
+    """Rifiuta subito (413) le richieste che dichiarano un corpo oltre il limite."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        raise _UploadError(f"Request body too large ({declared} bytes, max {limit})", 413)
+
+
+async def _read_body_capped(request, limit: int) -> bytes:
+    """Corpo della richiesta letto a blocchi, interrompendo appena supera `limit` byte."""
+    _check_content_length(request, limit)
+    chunks: List[bytes] = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise _UploadError(f"Request body too large (max {limit} bytes)", 413)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def _read_multipart_image(request, max_bytes: int) -> _ImageRecord:
+    """
+    Legge in streaming il campo `image` di un multipart/form-data, senza bufferizzare
+    il corpo né passare da file temporanei: limite di dimensione controllato a ogni
+    blocco, sha256 incrementale (diventa la chiave dell'immagine) e formato
+    riconosciuto dai primi byte, così un file troppo grande o non immagine viene
+    rifiutato prima di leggerlo tutto. Gli altri campi vengono ignorati.
+    """
+    try:
+        from python_multipart.multipart import MultipartParser, parse_options_header
+    except ImportError:  # python-multipart < 0.0.13
+        from multipart.multipart import MultipartParser, parse_options_header
+
+    _check_content_length(request, max_bytes + _UPLOAD_OVERHEAD_BYTES)
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise _UploadError("Missing multipart boundary")
+
+    part = {"headers": {}, "field": b"", "value": b"", "is_image": False}
+    chunks: List[bytes] = []
+    head = bytearray()
+    digest = hashlib.sha256()
+    state = {"found": False, "size": 0, "mime": None}
+
+    def check_format(final: bool) -> None:
+        if state["mime"] is None and (len(head) >= 12 or final):
+            state["mime"] = image_worker.detect_mime(bytes(head))
+            if state["mime"] is None:
+                raise _UploadError("Unsupported image format (expected JPEG, PNG, GIF, WEBP or BMP)", 415)
+
+    def on_part_begin():
+        part["headers"] = {}
+        part["is_image"] = False
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["is_image"] = options.get(b"name") == b"image" and not state["found"]
+        state["found"] = state["found"] or part["is_image"]
+
+    def on_part_data(data, start, end):
+        if not part["is_image"]:
+            return
+        piece = data[start:end]
+        state["size"] += len(piece)
+        if state["size"] > max_bytes:
+            raise _UploadError(f"Image too large (max {max_bytes} bytes)", 413)
+        if len(head) < 12:
+            head.extend(piece[: 12 - len(head)])
+            check_format(final=False)
+        digest.update(piece)
+        chunks.append(piece)
+
+    def on_part_end():
+        if part["is_image"]:
+            check_format(final=True)
+
+    parser = MultipartParser(
+        boundary,
+        {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        },
+    )
+    total, limit = 0, max_bytes + _UPLOAD_OVERHEAD_BYTES
+    async for chunk in request.stream():
+        total += len(chunk)
+        if total > limit:
+            raise _UploadError(f"Request body too large (max {limit} bytes)", 413)
+        parser.write(chunk)
+    parser.finalize()
+
+    if not state["found"]:
+        raise _UploadError("Missing 'image' field in form data")
+    image = _image_from_bytes(b"".join(chunks), key=digest.hexdigest())
+    if image is None:
+        raise _UploadError("Invalid image file")
+    return image
+
+
 @mcp.custom_route("/upload-image", methods=["POST"])
 async def upload_image_endpoint(request):
     """
     Endpoint HTTP per upload diretto di immagini.
+    Multipart letto in streaming, con limite UPLOAD_MAX_BYTES anche sul JSON base64.
     """
+    import asyncio
+
     try:
         content_type = request.headers.get("content-type", "")
         image_b64 = None
+        image = None
+        max_bytes = _get_upload_max_bytes()
 
         if "multipart/form-data" in content_type:
-            form = await request.form()
-            if "image" not in form:
-                return JSONResponse(
-                    {"error": "Missing 'image' field in form data"}, status_code=400
-                )
-
-            file = form["image"]
-            if hasattr(file, "read"):
-                import base64
-
-                file_bytes = await file.read()
-                image_b64 = base64.b64encode(file_bytes).decode("utf-8")
-            else:
-                return JSONResponse(
-                    {"error": "Invalid file upload"}, status_code=400
-                )
+            try:
+                image = await _read_multipart_image(request, max_bytes)
+            except _UploadError as e:
+                return JSONResponse({"error": str(e)}, status_code=e.status_code)
         else:
             try:
-                data = await request.json()
+                body = await _read_body_capped(request, max_bytes * 4 // 3 + _UPLOAD_OVERHEAD_BYTES)
+            except _UploadError as e:
+                return JSONResponse({"error": str(e)}, status_code=e.status_code)
+            try:
+                data = json.loads(body)
+                del body
                 image_b64 = data.get("image_b64")
                 if not image_b64:
                     return JSONResponse(
@@ -923,39 +1575,54 @@ async def upload_image_endpoint(request):
                     status_code=400,
                 )
 
-        if not image_b64:
-            return JSONResponse(
-                {"error": "No image data provided"}, status_code=400
-            )
-
-        cleaned_b64 = _clean_base64(image_b64)
-        if not cleaned_b64:
-            return JSONResponse(
-                {"error": "Invalid base64 image string"}, status_code=400
-            )
+        if image is None:
+            if not image_b64:
+                return JSONResponse(
+                    {"error": "No image data provided"}, status_code=400
+                )
+            image = await asyncio.to_thread(_image_from_base64, image_b64)
+            if image is None:
+                return JSONResponse(
+                    {"error": "Invalid base64 image string"}, status_code=400
+                )
 
-        image_id = str(uuid.uuid4())
+        image_id, reused = _store_uploaded_image(image)
+        duplicates = await asyncio.to_thread(_find_duplicates, image)
 
-        _UPLOADED_IMAGES[image_id] = {
-            "image_b64": cleaned_b64,
-            "expires_at": time.time() + 3600,
+        body: Dict[str, Any] = {
+            "image_id": image_id,
+            "expires_in": _UPLOADED_IMAGE_TTL_S,
+            "sha256": image.key,
         }
-
-        current_time = time.time()
-        expired_ids = [
-            img_id
-            for img_id, data in _UPLOADED_IMAGES.items()
-            if data["expires_at"] < current_time
-        ]
-        for img_id in expired_ids:
-            _UPLOADED_IMAGES.pop(img_id, None)
-
-        return JSONResponse({"image_id": image_id, "expires_in": 3600})
+        if reused:
+            body["reused"] = True
+        if duplicates is not None:
+            body["duplicates"] = duplicates
+        return JSONResponse(body)
     except Exception as e:
         print(f"[upload-image] error: {e}")
         return JSONResponse({"error": str(e)}, status_code=500)
 
 
+@mcp.custom_route("/images/{sha256}", methods=["GET", "HEAD"])
+async def uploaded_image_by_hash(request):
+    """
+    Negoziazione dell'upload per contenuto: il client calcola lo sha256 dei byte
+    dell'immagine e chiede se il server li ha già. 200 con l'image_id ancora
+    valido (anche nell'header X-Image-Id, per HEAD), 404 se serve l'upload.
+    """
+    sha256 = request.path_params.get("sha256", "")
+    if not _is_sha256_hex(sha256):
+        return JSONResponse({"error": "Invalid sha256"}, status_code=400)
+    image_id = _lookup_uploaded_image(sha256)
+    if image_id is None:
+        return JSONResponse({"upload_required": True}, status_code=404)
+    return JSONResponse(
+        {"image_id": image_id, "expires_in": _UPLOADED_IMAGE_TTL_S},
+        headers={"X-Image-Id": image_id, "Cache-Control": "no-store"},
+    )
+
+
 @mcp.custom_route("/image-search", methods=["POST"])
 async def image_search_http(request):
     """
@@ -964,9 +1631,17 @@ async def image_search_http(request):
       {
         "collection": "Sinde",
         "image_id": "uuid from /upload-image",
+        "image_sha256": "sha256 esadecimale dei byte (opzionale, al posto di image_id)",
         "image_url": "... (opzionale)",
         "caption": "... (opzionale, non più usato)",
-        "limit": 10
+        "limit": 10,
+        "deadline_ms": 3000 (opzionale, budget di latenza),
+        "mode": "fast" | "balanced" | "accurate" (opzionale),
+        "filters": {"source_pdf": "...", "page_index": {"gte": 1}} (opzionale),
+        "group_by": "source_pdf", "objects_per_group": 3 (opzionale),
+        "return_properties": [...] | "metadata" | "uuid" (opzionale),
+        "include_image": true (default: il widget mostra le miniature),
+        "auto_limit": 1 (opzionale, autocut dopo il primo salto di punteggio)
       }
     
     Usa hybrid_search che genera il vettore esternamente con Vertex AI + GPT,
@@ -982,10 +1657,26 @@ async def image_search_http(request):
     image_id = data.get("image_id")
     image_url = data.get("image_url")
     limit = data.get("limit") or 10
+    deadline_ms = data.get("deadline_ms")
+    mode = data.get("mode")
+    filters = data.get("filters")
+    group_by = data.get("group_by")
+    image_sha256 = data.get("image_sha256")
+
+    if not image_id and image_sha256 and not image_url:
+        if not _is_sha256_hex(image_sha256):
+            return JSONResponse({"error": "Invalid image_sha256"}, status_code=400)
+        image_id = _lookup_uploaded_image(image_sha256)
+        if image_id is None:
+            # nessuna immagine valida con questi byte: il client fa l'upload e riprova
+            return JSONResponse(
+                {"error": "Unknown image_sha256", "upload_required": True},
+                status_code=404,
+            )
 
     if not image_id and not image_url:
         return JSONResponse(
-            {"error": "Either image_id or image_url must be provided"},
+            {"error": "Either image_id, image_sha256 or image_url must be provided"},
             status_code=400,
         )
 
@@ -1000,6 +1691,14 @@ async def image_search_http(request):
             query_properties=["caption", "name"],
             image_id=image_id,
             image_url=image_url,
+            deadline_ms=deadline_ms,
+            mode=mode,
+            filters=filters,
+            group_by=group_by,
+            objects_per_group=data.get("objects_per_group") or 3,
+            return_properties=data.get("return_properties"),
+            include_image=data.get("include_image", True),
+            auto_limit=data.get("auto_limit"),
         )
         return JSONResponse(result)
     except Exception as e:
@@ -1009,11 +1708,172 @@ async def image_search_http(request):
         return JSONResponse({"error": str(e)}, status_code=500)
 
 
+@mcp.custom_route("/image-search-batch", methods=["POST"])
+async def image_search_batch_http(request):
+    """
+    Ricerca per più immagini in una sola chiamata, in parallelo.
+    Si aspetta un JSON tipo:
+      {
+        "collection": "Sinde",
+        "image_ids": ["uuid da /upload-image", ...],
+        "image_urls": ["...", ...] (opzionale),
+        "limit": 10,
+        "deadline_ms": 3000 (opzionale, per immagine),
+        "mode": "fast" | "balanced" | "accurate" (opzionale)
+      }
+    Risponde con un item per immagine (risultati + elapsed_ms) nello stesso ordine.
+    """
+    try:
+        data = await request.json()
+    except Exception:
+        return JSONResponse({"error": "Invalid JSON body"}, status_code=400)
+
+    requests_ = [{"image_id": i} for i in data.get("image_ids") or [] if i]
+    requests_ += [{"image_url": u} for u in data.get("image_urls") or [] if u]
+    if not requests_:
+        return JSONResponse(
+            {"error": "image_ids or image_urls must be a non-empty list"},
+            status_code=400,
+        )
+
+    try:
+        result = _run_search_batch(
+            data.get("collection"),
+            requests_,
+            deadline_ms=data.get("deadline_ms"),
+            query="",
+            limit=data.get("limit") or 10,
+            query_properties=["caption", "name"],
+            mode=data.get("mode"),
+            filters=data.get("filters"),
+            return_properties=data.get("return_properties"),
+            include_image=data.get("include_image", True),
+        )
+        status = 400 if "error" in result and "circuit_breaker" not in result else 200
+        return JSONResponse(result, status_code=status)
+    except Exception as e:
+        print(f"[image-search-batch-http] error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@mcp.custom_route("/similar", methods=["POST"])
+async def similar_http(request):
+    """
+    Endpoint HTTP "altri come questo" per il widget.
+    Si aspetta un JSON tipo: {"uuid": "<uuid di un risultato>", "limit": 10}
+    """
+    try:
+        data = await request.json()
+    except Exception:
+        return JSONResponse({"error": "Invalid JSON body"}, status_code=400)
+
+    source_uuid = data.get("uuid")
+    if not source_uuid:
+        return JSONResponse({"error": "uuid is required"}, status_code=400)
+
+    try:
+        result = similar_to(
+            uuid=source_uuid,
+            limit=data.get("limit") or 10,
+            return_properties=data.get("return_properties"),
+            include_image=data.get("include_image", True),
+        )
+        status = 400 if "error" in result and "circuit_breaker" not in result else 200
+        return JSONResponse(result, status_code=status)
+    except Exception as e:
+        print(f"[similar-http] error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@mcp.custom_route("/suggest", methods=["GET"])
+async def suggest_http(request):
+    """
+    Autocompletamento dei nomi per il widget: GET /suggest?q=<prefisso>&limit=10
+    """
+    prefix = request.query_params.get("q") or request.query_params.get("prefix") or ""
+    try:
+        limit = int(request.query_params.get("limit") or 10)
+    except ValueError:
+        return JSONResponse({"error": "limit must be an integer"}, status_code=400)
+    if limit < 1:
+        return JSONResponse({"error": "limit must be >= 1"}, status_code=400)
+    result = suggest_names(prefix, limit)
+    return JSONResponse(result, status_code=503 if "error" in result else 200)
+
+
+# Ultimi risultati del widget Sinde per sessione: solo UUID, punteggi e riassunto.
+# Le proprietà si rileggono da Weaviate (o dalla replica locale) quando servono.
+_WIDGET_RESULTS = _LRUCache(
+    maxsize=int(_get_env_float("WIDGET_RESULTS_MAX_SESSIONS", 256)),
+    ttl_s=_get_env_float("WIDGET_RESULTS_TTL_S", 24 * 3600.0),
+)
+_WIDGET_RESULTS_MAX_ROWS = 100
+# Proprietà restituite di default da get_last_sinde_results (image_b64 solo su richiesta)
+_WIDGET_RESULT_PROPERTIES = ["name", "source_pdf", "page_index", "mediaType", "caption"]
+
+
+def _compact_widget_rows(raw: Any) -> List[Dict[str, Any]]:
+    """UUID e punteggi (valori scalari) dei risultati inviati dal widget, senza proprietà."""
+    rows = raw.get("results") if isinstance(raw, dict) else raw
+    out: List[Dict[str, Any]] = []
+    for r in rows if isinstance(rows, list) else []:
+        if not isinstance(r, dict) or not r.get("uuid"):
+            continue
+        out.append(
+            {
+                k: v
+                for k, v in r.items()
+                if k == "uuid" or (isinstance(v, (int, float)) and not isinstance(v, bool))
+            }
+        )
+        if len(out) >= _WIDGET_RESULTS_MAX_ROWS:
+            break
+    return out
+
+
+def _hydrate_widget_rows(
+    collection: str, rows: List[Dict[str, Any]], properties: List[str]
+) -> Dict[str, Any]:
+    """Proprietà dei risultati salvati: replica locale se disponibile, altrimenti un'unica fetch per ID."""
+    ids = [r["uuid"] for r in rows]
+    props: Dict[str, Dict[str, Any]] = {}
+    served_by = "weaviate"
+    local = set(properties) - {"image_b64"} <= set(local_replica.PROPERTIES)
+    replica = _get_local_replica(collection) if local else None
+    if replica is not None:
+        props = replica.get_properties(ids)
+        served_by = "local_replica"
+    missing = [u for u in ids if u not in props]
+    if missing:
+        unavailable = _weaviate_unavailable()
+        if unavailable:
+            return unavailable
+        client = _connect()
+        try:
+            props.update(
+                _fetch_rows_by_ids(client.collections.get(collection), missing, properties)
+            )
+        finally:
+            client.close()
+        served_by = "weaviate"
+    hydrated = [
+        {**r, "properties": {k: v for k, v in props[r["uuid"]].items() if k in properties}}
+        for r in rows
+        if r["uuid"] in props
+    ]
+    if replica is not None:
+        unavailable = _attach_replica_images(collection, hydrated, properties)
+        if unavailable:
+            return unavailable
+    return {"results": hydrated, "served_by": served_by}
+
+
 @mcp.custom_route("/widget-push-results", methods=["POST"])
 async def widget_push_results(request):
     """
     Endpoint HTTP chiamato SOLO dal widget per salvare gli ultimi risultati
     di ricerca, in modo che un tool MCP possa poi restituirli a ChatGPT.
+    Per ogni session_id (generato se assente) conserva solo riassunto, UUID e punteggi.
     """
     try:
         data = await request.json()
@@ -1029,12 +1889,19 @@ async def widget_push_results(request):
             status_code=400,
         )
 
-    # Salva in memoria globale
-    global _LAST_WIDGET_RESULTS
-    _LAST_WIDGET_RESULTS["summary"] = summary
-    _LAST_WIDGET_RESULTS["raw_results"] = raw
+    session_id = str(data.get("session_id") or request.headers.get("x-widget-session") or uuid.uuid4())
+    rows = _compact_widget_rows(raw)
+    _WIDGET_RESULTS.put(
+        session_id,
+        {
+            "summary": summary,
+            "collection": data.get("collection") or _get_default_collection(),
+            "results": rows,
+            "stored_at": time.time(),
+        },
+    )
 
-    return JSONResponse({"ok": True})
+    return JSONResponse({"ok": True, "session_id": session_id, "stored": len(rows)})
 
 
 @mcp.tool()
@@ -1075,6 +1942,9 @@ def get_config() -> Dict[str, Any]:
         "weaviate_api_key_set": bool(os.environ.get("WEAVIATE_API_KEY")),
         "default_collection": _get_default_collection(),
         "default_alpha": _get_default_alpha(),
+        "default_deadline_ms": _get_default_deadline_ms(),
+        "default_search_mode": _get_default_search_mode(),
+        "embedding_dimension": _get_embedding_dimension(_get_default_collection()),
         "prompt_file": _MCP_INSTRUCTIONS_FILE,
         "openai_api_key_set": bool(
             os.environ.get("OPENAI_API_KEY") or os.environ.get("OPENAI_APIKEY")
@@ -1104,21 +1974,19 @@ def debug_widget() -> Dict[str, Any]:
 def sinde_widget_push_results(
     results_summary: Optional[str] = None,
     raw_results: Optional[Dict[str, Any]] = None,
+    session_id: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     Tool MCP che restituisce gli ultimi risultati salvati dal widget.
 
-    - Uso normale (ChatGPT che lo chiama): ignora gli argomenti e
-      restituisce quello che il widget ha mandato a /widget-push-results.
-    - Se per qualche motivo non c'è nulla in memoria, usa gli argomenti
-      passati (fallback, utile in test).
+    - Uso normale (ChatGPT che lo chiama con il session_id del widget): restituisce
+      quello che il widget ha mandato a /widget-push-results per quella sessione.
+    - Senza session_id, o se per quella sessione non c'è nulla in memoria, usa gli
+      argomenti passati (fallback, utile in test): mai i risultati di un'altra sessione.
     """
-    # Se il widget ha già pushato qualcosa via /widget-push-results
-    if _LAST_WIDGET_RESULTS:
-        return {
-            "summary": _LAST_WIDGET_RESULTS.get("summary"),
-            "raw_results": _LAST_WIDGET_RESULTS.get("raw_results"),
-        }
+    # Se il widget di questa sessione ha già pushato qualcosa via /widget-push-results
+    if session_id and _WIDGET_RESULTS.get(session_id) is not None:
+        return get_last_sinde_results(session_id)
 
     # Fallback: usa gli argomenti (per compatibilità)
     return {
@@ -1128,27 +1996,64 @@ def sinde_widget_push_results(
 
 
 @mcp.tool()
-def get_last_sinde_results() -> Dict[str, Any]:
+def get_last_sinde_results(
+    session_id: str,
+    properties: Optional[List[str]] = None,
+    include_image: bool = False,
+    include_properties: bool = True,
+) -> Dict[str, Any]:
     """
     Restituisce gli ultimi risultati che il widget Sinde ha salvato tramite /widget-push-results.
     
-    - Nessun argomento richiesto.
+    - session_id obbligatorio (sinde_session_id nello stato del widget): i risultati
+      sono per sessione e non si ripiega mai su quella di un altro utente.
+    - Le proprietà sono rilette con un'unica fetch per ID: di default quelle leggere
+      (nome, PDF, pagina, tipo, caption), `properties` per sceglierle, `include_image`
+      per aggiungere image_b64, `include_properties=False` per solo UUID e punteggi.
     - Se non ci sono risultati, restituisce summary/raw_results = None.
     """
-    if not _LAST_WIDGET_RESULTS:
+    if not session_id:
+        return {"error": "session_id is required (sinde_session_id from the widget state)"}
+    entry = _WIDGET_RESULTS.get(session_id)
+    if entry is None:
         return {
             "summary": None,
             "raw_results": None,
         }
 
+    rows = [dict(r) for r in entry["results"]]
+    raw_results: Dict[str, Any] = {"count": len(rows), "results": rows}
+    if include_properties and rows:
+        wanted = list(properties or _WIDGET_RESULT_PROPERTIES)
+        if include_image and "image_b64" not in wanted:
+            wanted.append("image_b64")
+        try:
+            hydrated = _hydrate_widget_rows(entry["collection"], rows, wanted)
+        except Exception as e:
+            print(f"[widget-results] rehydrate error: {e}")
+            hydrated = {"error": str(e)}
+        if "error" in hydrated:
+            raw_results["properties_error"] = hydrated["error"]
+        else:
+            raw_results.update(
+                count=len(hydrated["results"]),
+                results=hydrated["results"],
+                served_by=hydrated["served_by"],
+            )
+
     return {
-        "summary": _LAST_WIDGET_RESULTS.get("summary"),
-        "raw_results": _LAST_WIDGET_RESULTS.get("raw_results"),
+        "summary": entry["summary"],
+        "session_id": session_id,
+        "collection": entry["collection"],
+        "raw_results": raw_results,
     }
 
 
 @mcp.tool()
 def check_connection() -> Dict[str, Any]:
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
     client = _connect()
     try:
         ready = client.is_ready()
@@ -1163,50 +2068,42 @@ def upload_image(
 ) -> Dict[str, Any]:
     global _UPLOADED_IMAGES
 
-    cleaned_b64 = None
+    image = None
 
     if image_path:
         print(f"[upload_image] Loading image from path: {image_path}")
         try:
-            import base64
-
             if not os.path.exists(image_path):
                 return {"error": f"File not found: {image_path}"}
             with open(image_path, "rb") as f:
-                file_bytes = f.read()
-                image_b64_raw = base64.b64encode(file_bytes).decode("utf-8")
-                cleaned_b64 = _clean_base64(image_b64_raw)
+                image = _image_from_bytes(f.read())
         except Exception as e:
             return {
                 "error": f"Failed to load image from path {image_path}: {str(e)}"
             }
-        if not cleaned_b64:
+        if image is None:
             return {"error": f"Invalid image file: {image_path}"}
     elif image_url:
         print(f"[upload_image] Loading image from URL: {image_url}")
-        cleaned_b64 = _load_image_from_url(image_url)
-        if not cleaned_b64:
+        image = _load_image_from_url(image_url)
+        if image is None:
             return {"error": f"Failed to load image from URL: {image_url}"}
     else:
         return {"error": "Either image_url or image_path must be provided"}
 
-    image_id = str(uuid.uuid4())
+    image_id, reused = _store_uploaded_image(image)
 
-    _UPLOADED_IMAGES[image_id] = {
-        "image_b64": cleaned_b64,
-        "expires_at": time.time() + 3600,
+    result: Dict[str, Any] = {
+        "image_id": image_id,
+        "expires_in": _UPLOADED_IMAGE_TTL_S,
+        "sha256": image.key,
     }
-
-    current_time = time.time()
-    expired_ids = [
-        img_id
-        for img_id, data in _UPLOADED_IMAGES.items()
-        if data["expires_at"] < current_time
-    ]
-    for img_id in expired_ids:
-        _UPLOADED_IMAGES.pop(img_id, None)
-
-    return {"image_id": image_id, "expires_in": 3600}
+    if reused:
+        result["reused"] = True
+    duplicates = _find_duplicates(image)
+    if duplicates is not None:
+        result["duplicates"] = duplicates
+    return result
 
 
 @mcp.tool()
@@ -1228,6 +2125,9 @@ def list_collections() -> List[str]:
 
 @mcp.tool()
 def get_schema(collection: str) -> Dict[str, Any]:
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
     client = _connect()
     try:
         coll = client.collections.get(collection)
@@ -1245,17 +2145,734 @@ def get_schema(collection: str) -> Dict[str, Any]:
         client.close()
 
 
+# ==== Filtri strutturati ======================================================
+# {"source_pdf": "a.pdf" | [...], "page_index": 3 | [..] | {"gte": 1, "lte": 5}, "mediaType": "image"}
+# compilati in Filter Weaviate (push-down nella query) e valutabili in locale (replica).
+_FILTERABLE_PROPERTIES: Dict[str, type] = {"source_pdf": str, "page_index": int, "mediaType": str}
+_RANGE_OPERATORS = ("gt", "gte", "lt", "lte")
+_FILTER_INDEX_CACHE = _LRUCache(maxsize=32, ttl_s=600.0)
+
+
+class _SearchFilters:
+    """Filtri su source_pdf / page_index / mediaType: Filter Weaviate + match locale."""
+
+    def __init__(self, spec: Dict[str, Dict[str, Any]]):
+        self.spec = spec
+        self.key = json.dumps(spec, sort_keys=True)
+        self.weaviate = self._compile()
+
+    @classmethod
+    def parse(cls, raw: Any):
+        """Restituisce (filtri o None, errore o None)."""
+        if raw in (None, "", {}):
+            return None, None
+        if isinstance(raw, str):
+            try:
+                raw = json.loads(raw)
+            except (json.JSONDecodeError, TypeError):
+                return None, "filters must be a JSON object"
+        if not isinstance(raw, dict):
+            return None, "filters must be an object"
+        spec: Dict[str, Dict[str, Any]] = {}
+        for prop, cond in raw.items():
+            cast = _FILTERABLE_PROPERTIES.get(prop)
+            if cast is None:
+                return None, (
+                    f"Unsupported filter property '{prop}'. Use: {', '.join(_FILTERABLE_PROPERTIES)}"
+                )
+            if not isinstance(cond, dict):
+                cond = {"in": cond if isinstance(cond, list) else [cond]}
+            elif "eq" in cond:
+                cond = {**{k: v for k, v in cond.items() if k != "eq"}, "in": [cond["eq"]]}
+            unknown = set(cond) - {"in", *_RANGE_OPERATORS}
+            if unknown:
+                return None, f"Unsupported filter operator(s) for '{prop}': {', '.join(sorted(unknown))}"
+            if cast is str and set(cond) - {"in"}:
+                return None, "Range operators are only supported on page_index"
+            try:
+                norm = {op: cast(v) for op, v in cond.items() if op != "in"}
+                if "in" in cond:
+                    norm["in"] = sorted({cast(v) for v in cond["in"]})
+            except (TypeError, ValueError):
+                return None, f"Invalid value for filter '{prop}'"
+            if "in" in norm and not norm["in"]:
+                return None, f"Empty value list for filter '{prop}'"
+            spec[prop] = norm
+        return (cls(spec) if spec else None), None
+
+    def _compile(self):
+        parts = []
+        for prop, cond in self.spec.items():
+            f = Filter.by_property(prop)
+            values = cond.get("in")
+            if values is not None:
+                # contains_any è per proprietà array: su valori scalari serve un OR di uguaglianze
+                parts.append(
+                    f.equal(values[0]) if len(values) == 1 else Filter.any_of([f.equal(v) for v in values])
+                )
+            if "gt" in cond:
+                parts.append(f.greater_than(cond["gt"]))
+            if "gte" in cond:
+                parts.append(f.greater_or_equal(cond["gte"]))
+            if "lt" in cond:
+                parts.append(f.less_than(cond["lt"]))
+            if "lte" in cond:
+                parts.append(f.less_or_equal(cond["lte"]))
+        combined = parts[0]
+        for p in parts[1:]:
+            combined = combined & p
+        return combined
+
+    def matches(self, props: Dict[str, Any]) -> bool:
+        for prop, cond in self.spec.items():
+            value = props.get(prop)
+            if value is None:
+                return False
+            try:
+                value = _FILTERABLE_PROPERTIES[prop](value)
+            except (TypeError, ValueError):
+                return False
+            if "in" in cond and value not in cond["in"]:
+                return False
+            if ("gt" in cond and not value > cond["gt"]) or ("gte" in cond and not value >= cond["gte"]):
+                return False
+            if ("lt" in cond and not value < cond["lt"]) or ("lte" in cond and not value <= cond["lte"]):
+                return False
+        return True
+
+    def mask(self, properties: List[Dict[str, Any]]):
+        return np.fromiter((self.matches(p) for p in properties), dtype=bool, count=len(properties))
+
+
+def _weaviate_filter(search_filters: Optional[_SearchFilters]):
+    return search_filters.weaviate if search_filters is not None else None
+
+
+def _filter_index_hints(coll, search_filters: Optional[_SearchFilters]) -> List[str]:
+    """
+    Suggerimenti sulle proprietà filtrate senza indice filtrabile (schema in cache per 10 minuti):
+    senza indexFilterable il filtro è lento o viene rifiutato da Weaviate.
+    """
+    if search_filters is None:
+        return []
+    name = getattr(coll, "name", "")
+    indexes = _FILTER_INDEX_CACHE.get(name)
+    if indexes is None:
+        try:
+            config = coll.config.get()
+            indexes = {
+                p.name: bool(getattr(p, "index_filterable", True))
+                for p in getattr(config, "properties", []) or []
+            }
+        except Exception as e:
+            print(f"[filters] schema unavailable for index hints: {e}")
+            return []
+        _FILTER_INDEX_CACHE.put(name, indexes)
+    hints = []
+    for prop in search_filters.spec:
+        if prop not in indexes:
+            hints.append(
+                f"Property '{prop}' is not in the schema of '{name}': Weaviate rejects the query "
+                f"with an error, while local paths (replica, caches) return no results."
+            )
+        elif not indexes[prop]:
+            hints.append(
+                f"Property '{prop}' has no filterable index: enable indexFilterable on it "
+                f"(requires re-indexing) to filter efficiently."
+            )
+    return hints
+
+
+# ==== Store vettoriale quantizzato ============================================
+# vector_store.QuantizedVectorStore: codici int8/float16 in RAM per lo scoring
+# approssimato, float32 esatti memory-mapped per il re-scoring dei top candidati.
+
+
+def _get_vector_quantization() -> str:
+    """
+    Restituisce la quantizzazione dei vettori in memoria (replica locale, cache embedding).
+    VECTOR_QUANTIZATION: 'int8' (default), 'float16' o 'none'.
+    """
+    mode = os.environ.get("VECTOR_QUANTIZATION", "int8").lower()
+    return mode if mode in vector_store.QUANTIZATION_MODES else "int8"
+
+
+def _get_vector_store_dir() -> Path:
+    return Path(os.environ.get("VECTOR_STORE_DIR") or (_BASE_DIR / "data" / "vectors"))
+
+
+def _compact_vector(vec: List[float]):
+    """Rappresentazione compatta di un embedding per le cache (float16 se la quantizzazione è attiva)."""
+    dtype = np.float32 if _get_vector_quantization() == "none" else np.float16
+    return np.asarray(vec, dtype=dtype)
+
+
+# ==== Replica locale in-process della collection =============================
+# Opzionale (LOCAL_REPLICA_ENABLED): copia della collection di default in memoria
+# (local_replica.LocalReplica) con i vettori immagine quantizzati e un indice BM25
+# su caption/name. keyword_search, hybrid_search testuale in modalità fast e la
+# ricerca per immagine via embedding Vertex (stesso vettore `image` della query
+# Weaviate) la usano quando è fresca; altrimenti si torna a Weaviate.
+
+
+def _local_replica_enabled() -> bool:
+    return os.environ.get("LOCAL_REPLICA_ENABLED", "").lower() in ("1", "true", "yes")
+
+
+def _get_local_replica_max_age() -> float:
+    return _get_env_float("LOCAL_REPLICA_MAX_AGE_S", 600.0)
+
+
+def _replica_object(o, vector_name: str, rows: Dict[str, Dict[str, Any]], vectors: Dict[str, Any]) -> None:
+    """Riga e vettore (float32 compatto) di un oggetto Weaviate per la replica."""
+    uid = str(o.uuid)
+    updated = getattr(getattr(o, "metadata", None), "last_update_time", None)
+    rows[uid] = local_replica.make_row(
+        dict(getattr(o, "properties", {}) or {}),
+        int(updated.timestamp() * 1000) if updated else 0,
+    )
+    vec = _extract_vector(o, vector_name)
+    if vec:
+        vectors[uid] = np.asarray(vec, dtype=np.float32)
+
+
+def _replica_full_sync(replica: local_replica.LocalReplica, coll) -> int:
+    """Sync completo via cursor/iterator di Weaviate (rileva anche le cancellazioni)."""
+    vector_name = _get_image_vector_name()
+    rows: Dict[str, Dict[str, Any]] = {}
+    vectors: Dict[str, Any] = {}
+    for o in coll.iterator(
+        include_vector=True,
+        return_properties=list(local_replica.PROPERTIES),
+        return_metadata=MetadataQuery(last_update_time=True),
+    ):
+        _replica_object(o, vector_name, rows, vectors)
+    replica.replace(rows, vectors)
+    return len(rows)
+
+
+def _replica_incremental_sync(replica: local_replica.LocalReplica, coll, page_size: int = 500) -> int:
+    """Scarica solo gli oggetti aggiornati dopo l'ultimo sync (richiede indexTimestamps)."""
+    from datetime import datetime, timezone
+
+    since = datetime.fromtimestamp(replica.last_update_ms / 1000.0, tz=timezone.utc)
+    vector_name = _get_image_vector_name()
+    changed: Dict[str, Dict[str, Any]] = {}
+    vectors: Dict[str, Any] = {}
+    offset = 0
+    while True:
+        resp = coll.query.fetch_objects(
+            filters=Filter.by_update_time().greater_than(since),
+            limit=page_size,
+            offset=offset,
+            include_vector=True,
+            return_properties=list(local_replica.PROPERTIES),
+            return_metadata=MetadataQuery(last_update_time=True),
+        )
+        objs = getattr(resp, "objects", []) or []
+        for o in objs:
+            _replica_object(o, vector_name, changed, vectors)
+        if len(objs) < page_size:
+            break
+        offset += page_size
+    replica.update(changed, vectors)
+    return len(changed)
+
+
+_LOCAL_REPLICA: Optional[local_replica.LocalReplica] = None
+_LOCAL_REPLICA_THREAD_STARTED = False
+
+
+def _get_local_replica(collection: Optional[str]) -> Optional[local_replica.LocalReplica]:
+    """Replica fresca per la collection, oppure None (→ query a Weaviate)."""
+    replica = _LOCAL_REPLICA
+    if replica is None or replica.collection != collection:
+        return None
+    if not replica.is_fresh(_get_local_replica_max_age()):
+        replica.fallbacks += 1
+        return None
+    replica.local_queries += 1
+    return replica
+
+
+def _replica_status() -> Dict[str, Any]:
+    replica = _LOCAL_REPLICA
+    if replica is None:
+        return {"enabled": _local_replica_enabled()}
+    return {
+        "enabled": _local_replica_enabled(),
+        **replica.status(),
+        "fresh": replica.is_fresh(_get_local_replica_max_age()),
+    }
+
+
+def _attach_replica_images(collection: str, rows: List[Dict[str, Any]], properties: List[str]):
+    """
+    La replica non tiene image_b64: se richiesto, si recupera per UUID con un'unica
+    fetch per le sole righe che non lo hanno. Restituisce un errore o None.
+    """
+    ids = [r["uuid"] for r in rows if "image_b64" not in (r.get("properties") or {})]
+    if "image_b64" not in properties or not ids:
+        return None
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
+    client = _connect()
+    try:
+        images = _fetch_rows_by_ids(client.collections.get(collection), ids, ["image_b64"])
+    finally:
+        client.close()
+    for r in rows:
+        if r["uuid"] in images:
+            r["properties"] = {**(r.get("properties") or {}), "image_b64": images[r["uuid"]].get("image_b64")}
+    return None
+
+
+def _replica_near_vector(coll, vector: List[float], limit: int, search_filters=None, return_properties=None):
+    """
+    near_vector sulla replica fresca, se tiene le proprietà richieste: stessi vettori
+    `image` (embedding Vertex dell'immagine) della query Weaviate equivalente.
+    None se la replica non può rispondere.
+    """
+    properties = list(return_properties or [])
+    if not set(properties) - {"image_b64"} <= set(local_replica.PROPERTIES):
+        return None
+    replica = _get_local_replica(getattr(coll, "name", None))
+    resp = replica.near_vector(vector, limit, search_filters) if replica is not None else None
+    if resp is not None and resp.objects and "image_b64" in properties:
+        images = _fetch_rows_by_ids(coll, [o.uuid for o in resp.objects], ["image_b64"])
+        for o in resp.objects:
+            if o.uuid in images:
+                o.properties["image_b64"] = images[o.uuid].get("image_b64")
+    return resp
+
+
+def _sync_local_replica(full: bool = False) -> Dict[str, Any]:
+    global _LOCAL_REPLICA
+    collection = _get_default_collection()
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
+    replica = _LOCAL_REPLICA
+    if replica is None:
+        replica = local_replica.LocalReplica(
+            collection,
+            _get_vector_quantization(),
+            _get_vector_store_dir() / f"replica_{collection}.npy",
+        )
+    t0 = time.monotonic()
+    client = _connect()
+    try:
+        coll = client.collections.get(collection)
+        if full or replica.synced_at is None:
+            changed = _replica_full_sync(replica, coll)
+            kind = "full"
+        else:
+            try:
+                changed = _replica_incremental_sync(replica, coll)
+                kind = "incremental"
+            except Exception as e:
+                # es. indexTimestamps non abilitato: ripiego sul sync completo
+                print(f"[local-replica] incremental sync failed ({e}), doing full sync")
+                changed = _replica_full_sync(replica, coll)
+                kind = "full"
+            else:
+                # il sync incrementale non vede le cancellazioni: se il conteggio di
+                # Weaviate non torna con la replica, la si ricostruisce da capo
+                total = coll.aggregate.over_all(total_count=True).total_count
+                if total is not None and total != len(replica):
+                    print(f"[local-replica] {len(replica)} objects locally, {total} in Weaviate: full sync")
+                    changed = _replica_full_sync(replica, coll)
+                    kind = "full"
+    finally:
+        client.close()
+    _LOCAL_REPLICA = replica
+    elapsed = round(time.monotonic() - t0, 2)
+    print(f"[local-replica] {kind} sync: {changed} objects in {elapsed}s")
+    return {"kind": kind, "changed": changed, "elapsed_s": elapsed, **_replica_status()}
+
+
+def _local_replica_loop():
+    refresh_s = _get_env_float("LOCAL_REPLICA_REFRESH_S", 120.0)
+    full_every_s = _get_env_float("LOCAL_REPLICA_FULL_SYNC_S", 3600.0)
+    while True:
+        try:
+            replica = _LOCAL_REPLICA
+            full = (
+                replica is None
+                or replica.full_synced_at is None
+                or time.time() - replica.full_synced_at > full_every_s
+            )
+            _sync_local_replica(full=full)
+            time.sleep(refresh_s)
+        except Exception as e:
+            print(f"[local-replica] sync error: {e}")
+            time.sleep(60)
+
+
+def _maybe_start_local_replica():
+    global _LOCAL_REPLICA_THREAD_STARTED
+    if _LOCAL_REPLICA_THREAD_STARTED or not _local_replica_enabled():
+        return
+    if not _NUMPY_AVAILABLE:
+        print("[local-replica] numpy not installed; replica disabled")
+        return
+    t = threading.Thread(target=_local_replica_loop, daemon=True)
+    t.start()
+    _LOCAL_REPLICA_THREAD_STARTED = True
+
+
+@mcp.tool()
+def sync_local_replica(full: bool = False) -> Dict[str, Any]:
+    """Forza un sync della replica locale (incrementale, o completo con full=True)."""
+    if not _NUMPY_AVAILABLE:
+        return {"error": "numpy not installed"}
+    return _sync_local_replica(full=full)
+
+
+# ==== Autocompletamento dei nomi ==============================================
+# name_index.NameIndex sui valori di `name`, costruito all'avvio (o alla prima richiesta)
+# e aggiornato da insert_image_vertex.
+_SUGGEST_INDEX: Optional[name_index.NameIndex] = None
+_SUGGEST_LOCK = threading.Lock()
+
+
+def _build_suggest_index(collection: Optional[str] = None) -> Dict[str, Any]:
+    global _SUGGEST_INDEX
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
+    collection = collection or _get_default_collection()
+    t0 = time.monotonic()
+    client = _connect()
+    try:
+        coll = client.collections.get(collection)
+        index = name_index.NameIndex.build(
+            (o.properties or {}).get("name") for o in coll.iterator(return_properties=["name"])
+        )
+    finally:
+        client.close()
+    _SUGGEST_INDEX = index
+    elapsed = time.monotonic() - t0
+    print(f"[suggest] index built for {collection}: {len(index.names)} names in {elapsed:.1f}s")
+    return {"collection": collection, **index.status(), "build_s": round(elapsed, 2)}
+
+
+def _suggest_warmup():
+    # stesso lock di suggest_names: una sola costruzione anche se arriva una richiesta nel frattempo
+    with _SUGGEST_LOCK:
+        if _SUGGEST_INDEX is not None:
+            return
+        try:
+            _build_suggest_index()
+        except Exception as e:
+            print(f"[suggest] index build failed: {e}")
+
+
+def _maybe_start_suggest_index():
+    """Costruisce l'indice in background all'avvio (SUGGEST_WARMUP, default true)."""
+    if os.environ.get("SUGGEST_WARMUP", "true").lower() not in ("1", "true", "yes"):
+        return
+    threading.Thread(target=_suggest_warmup, daemon=True).start()
+
+
+@mcp.tool()
+def suggest_names(prefix: str, limit: int = 10) -> Dict[str, Any]:
+    """Autocompletamento dei nomi dei pezzi (proprietà `name`) per prefisso, in memoria."""
+    try:
+        limit = 10 if limit is None else int(limit)
+    except (TypeError, ValueError):
+        return {"error": f"limit must be an integer, got {limit!r}"}
+    if limit < 1:
+        return {"error": "limit must be >= 1"}
+    if not isinstance(prefix, str):
+        return {"error": "prefix must be a string"}
+    index = _SUGGEST_INDEX
+    if index is None:
+        with _SUGGEST_LOCK:
+            if _SUGGEST_INDEX is None:
+                try:
+                    _build_suggest_index()
+                except Exception as e:
+                    return {"error": f"Suggest index unavailable: {e}"}
+        index = _SUGGEST_INDEX
+    t0 = time.perf_counter()
+    suggestions = index.suggest(prefix, min(limit, name_index.TOP_K))
+    return {
+        "prefix": prefix,
+        "suggestions": suggestions,
+        "lookup_us": round((time.perf_counter() - t0) * 1e6, 1),
+    }
+
+
+# ==== Hash percettivi: quasi-duplicati delle immagini =========================
+# phash_index.PerceptualIndex: pHash (o dHash senza NumPy) a 64 bit per ogni immagine
+# salvata in un BK-tree, più lo sha256 dei byte per i duplicati esatti.
+# Un indice (e un file) per collection; all'avvio si calcolano solo gli oggetti nuovi.
+_PHASH_INDEXES: Dict[str, phash_index.PerceptualIndex] = {}
+_PHASH_LOCK = threading.Lock()
+_PHASH_LOOKUPS = _LRUCache(maxsize=256, ttl_s=3600.0)
+
+
+def _get_phash_index_path(collection: str) -> Path:
+    """
+    PHASH_INDEX_PATH è il file della collection di default; le altre collection
+    usano un file accanto con il nome della collection nel suffisso.
+    """
+    import re
+
+    path = Path(os.environ.get("PHASH_INDEX_PATH") or (_BASE_DIR / "data" / "phash_index.json"))
+    if collection == _get_default_collection():
+        return path
+    safe = re.sub(r"[^A-Za-z0-9_-]", "_", collection)
+    return path.with_name(f"{path.stem}.{safe}{path.suffix}")
+
+
+def _get_phash_max_distance() -> int:
+    """Distanza di Hamming massima (su 64 bit) per considerare due immagini quasi-duplicate."""
+    return max(0, int(_get_env_float("PHASH_MAX_DISTANCE", 6)))
+
+
+def _get_phash_shortcircuit_distance() -> int:
+    """
+    Distanza entro cui la ricerca per immagine salta caption ed embedding e parte
+    dal duplicato (PHASH_SHORTCIRCUIT_DISTANCE, default 4, -1 = mai).
+    """
+    return int(_get_env_float("PHASH_SHORTCIRCUIT_DISTANCE", 4))
+
+
+def _image_hashes(data: bytes):
+    """(sha256, dhash, phash) dei byte dell'immagine; i due hash percettivi nel pool immagini."""
+    dhash, phash = _IMAGE_POOL.run(image_worker.perceptual_hashes, data)
+    return _image_key(data), dhash, phash
+
+
+def _build_phash_index(collection: Optional[str] = None, batch_size: int = 50) -> Dict[str, Any]:
+    """
+    Carica l'indice da disco e calcola gli hash solo per gli oggetti che mancano:
+    un giro leggero per gli UUID, poi image_b64 per ID a blocchi di `batch_size`.
+    """
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
+    collection = collection or _get_default_collection()
+    path = _get_phash_index_path(collection)
+    index = phash_index.PerceptualIndex.load(path, collection, "phash" if _NUMPY_AVAILABLE else "dhash")
+    t0 = time.monotonic()
+    added = failed = 0
+    client = _connect()
+    try:
+        coll = client.collections.get(collection)
+        missing = [
+            str(o.uuid) for o in coll.iterator(return_properties=["name"]) if str(o.uuid) not in index.items
+        ]
+        workers = ThreadPoolExecutor(max_workers=max(1, _IMAGE_POOL.workers))
+        try:
+            for start in range(0, len(missing), batch_size):
+                ids = missing[start : start + batch_size]
+                resp = _guarded_call(
+                    "weaviate_query",
+                    coll.query.fetch_objects,
+                    filters=Filter.by_id().contains_any(ids),
+                    limit=len(ids),
+                    return_properties=["image_b64"],
+                )
+                images = []
+                for o in getattr(resp, "objects", []) or []:
+                    image_b64 = (getattr(o, "properties", {}) or {}).get("image_b64")
+                    image = _image_from_base64(image_b64) if image_b64 else None
+                    if image is not None:
+                        images.append((str(o.uuid), image.data))
+
+                def _hash(item):
+                    try:
+                        return item[0], _image_hashes(item[1])
+                    except Exception as e:
+                        print(f"[phash] cannot hash {item[0]}: {e}")
+                        return item[0], None
+
+                for uid, hashes in workers.map(_hash, images):
+                    if hashes is None:
+                        failed += 1
+                        continue
+                    index.add(uid, *hashes)
+                    added += 1
+        finally:
+            workers.shutdown(wait=False)
+    finally:
+        client.close()
+    index.built_at = time.time()
+    if added:
+        index.save(path)
+    _PHASH_INDEXES[collection] = index
+    elapsed = time.monotonic() - t0
+    print(f"[phash] index for {collection}: {len(index.items)} images (+{added}) in {elapsed:.1f}s")
+    return {**index.status(), "added": added, "failed": failed, "build_s": round(elapsed, 2)}
+
+
+def _phash_warmup():
+    # stesso lock di find_duplicate_images: una sola costruzione anche se arriva una richiesta nel frattempo
+    with _PHASH_LOCK:
+        if _get_default_collection() in _PHASH_INDEXES:
+            return
+        try:
+            _build_phash_index()
+        except Exception as e:
+            print(f"[phash] index build failed: {e}")
+
+
+def _maybe_start_phash_index():
+    """Costruisce/aggiorna l'indice in background all'avvio (PHASH_WARMUP, default true)."""
+    if not image_worker.PIL_AVAILABLE:
+        return
+    if os.environ.get("PHASH_WARMUP", "true").lower() not in ("1", "true", "yes"):
+        return
+    threading.Thread(target=_phash_warmup, daemon=True).start()
+
+
+def _find_duplicates(image: _ImageRecord, collection: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    Duplicati esatti e quasi-duplicati di un'immagine nella collection.
+    None se l'indice non è (ancora) disponibile o l'immagine non è leggibile.
+    """
+    index = _PHASH_INDEXES.get(collection or _get_default_collection())
+    if index is None:
+        return None
+    # la versione dell'indice nella chiave: dopo un inserimento i lookup vecchi non valgono più
+    key = (index.collection, index.version, image.key)
+    cached = _PHASH_LOOKUPS.get(key)
+    if cached is not None:
+        return cached
+    try:
+        sha, dhash, phash = _image_hashes(image.data)
+    except Exception as e:
+        print(f"[phash] cannot hash query image: {e}")
+        return None
+    matches = index.lookup(sha, dhash, phash, _get_phash_max_distance())
+    if matches:
+        # niente cache per i "nessun duplicato": l'immagine potrebbe essere inserita a breve
+        _PHASH_LOOKUPS.put(key, matches)
+    return matches
+
+
+def _shortcircuit_duplicate(image: _ImageRecord, collection: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Il duplicato più vicino, se entro PHASH_SHORTCIRCUIT_DISTANCE; altrimenti None."""
+    limit = _get_phash_shortcircuit_distance()
+    if limit < 0:
+        return None
+    matches = _find_duplicates(image, collection)
+    if matches and matches[0]["distance"] <= limit:
+        return matches[0]
+    return None
+
+
+@mcp.tool()
+def find_duplicate_images(
+    image_id: Optional[str] = None,
+    image_url: Optional[str] = None,
+    collection: Optional[str] = None,
+    max_distance: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Cerca nella collection copie esatte (stesso contenuto) e quasi-duplicati
+    (hash percettivo entro max_distance bit su 64) di un'immagine caricata.
+    Nessuna chiamata a GPT o Vertex; se l'indice della collection non è ancora
+    in memoria (warm-up non finito, o altra collection) questa chiamata lo
+    costruisce leggendo le immagini da Weaviate, poi basta l'indice in memoria.
+    """
+    collection = collection or _get_default_collection()
+    image = None
+    if image_id:
+        img_data = _UPLOADED_IMAGES.get(image_id)
+        if img_data is None or img_data["expires_at"] <= time.time():
+            return {"error": f"Image ID {image_id} not found or expired. Please upload the image again."}
+        image = img_data["image"]
+    elif image_url:
+        image = _load_image_from_url(image_url)
+        if image is None:
+            return {"error": f"Failed to load image from URL: {image_url}"}
+    else:
+        return {"error": "Either image_id or image_url must be provided"}
+
+    index = _PHASH_INDEXES.get(collection)
+    if index is None:
+        with _PHASH_LOCK:
+            if collection not in _PHASH_INDEXES:
+                try:
+                    built = _build_phash_index(collection)
+                except Exception as e:
+                    return {"error": f"Duplicate index unavailable: {e}"}
+                if "error" in built:
+                    return built
+        index = _PHASH_INDEXES[collection]
+    t0 = time.perf_counter()
+    try:
+        sha, dhash, phash = _image_hashes(image.data)
+    except Exception as e:
+        return {"error": f"Cannot hash image: {e}"}
+    radius = _get_phash_max_distance() if max_distance is None else max(0, min(int(max_distance), 32))
+    matches = index.lookup(sha, dhash, phash, radius)
+    return {
+        "collection": collection,
+        "sha256": sha,
+        "max_distance": radius,
+        "count": len(matches),
+        "duplicates": matches,
+        "lookup_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+    }
+
+
 @mcp.tool()
-def keyword_search(collection: str, query: str, limit: int = 10) -> Dict[str, Any]:
+def keyword_search(
+    collection: str,
+    query: str,
+    limit: int = 10,
+    filters: Optional[Any] = None,
+    paginate: bool = False,
+    page_token: Optional[str] = None,
+    return_properties: Optional[Any] = None,
+    include_image: bool = False,
+) -> Dict[str, Any]:
+    if page_token:
+        return _next_page(page_token, collection)
+    search_filters, error = _SearchFilters.parse(filters)
+    if error:
+        return {"error": error}
+    projection, error = _Projection.parse(return_properties, include_image)
+    if error:
+        return {"error": error}
+    page_size = limit
+    if paginate:
+        limit = _pagination_window(page_size)
+    replica = _get_local_replica(collection) if projection.local_ok() else None
+    if replica is not None:
+        out = [
+            {"uuid": r["uuid"], "properties": r["properties"], "bm25_score": r["bm25_score"]}
+            for r in _search_rows(replica.bm25(query, limit, search_filters=search_filters))
+        ]
+        result = {"count": len(out), "results": out, "served_by": "local_replica"}
+        if paginate:
+            _apply_first_page(result, collection, page_size, projection)
+        projection.apply(result["results"])
+        return _attach_replica_images(collection, result["results"], projection.properties) or result
+
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
     client = _connect()
     try:
         coll = client.collections.get(collection)
         if coll is None:
             return {"error": f"Collection '{collection}' not found"}
-        resp = coll.query.bm25(
+        resp = _guarded_call(
+            "weaviate_query",
+            coll.query.bm25,
             query=query,
+            # con la paginazione la finestra si classifica solo con UUID e punteggi
+            return_properties=[] if paginate else projection.fetch(),
             return_metadata=MetadataQuery(score=True),
             limit=limit,
+            filters=_weaviate_filter(search_filters),
         )
         out = []
         for o in getattr(resp, "objects", []) or []:
@@ -1266,35 +2883,1247 @@ def keyword_search(collection: str, query: str, limit: int = 10) -> Dict[str, An
                     "bm25_score": getattr(getattr(o, "metadata", None), "score", None),
                 }
             )
-        return {"count": len(out), "results": out}
+        result = {"count": len(out), "results": out}
+        hints = _filter_index_hints(coll, search_filters)
+        if hints:
+            result["filter_hints"] = hints
+        if paginate:
+            _apply_first_page(result, collection, page_size, projection, coll=coll)
+        projection.apply(result["results"])
+        return result
     finally:
         client.close()
 
 
 @mcp.tool()
-def semantic_search(collection: str, query: str, limit: int = 10) -> Dict[str, Any]:
+def semantic_search(
+    collection: str,
+    query: str,
+    limit: int = 10,
+    filters: Optional[Any] = None,
+    return_properties: Optional[Any] = None,
+    include_image: bool = False,
+    auto_limit: Optional[Any] = None,
+) -> Dict[str, Any]:
+    search_filters, error = _SearchFilters.parse(filters)
+    if error:
+        return {"error": error}
+    projection, error = _Projection.parse(return_properties, include_image)
+    if error:
+        return {"error": error}
+    auto_limit, error = _parse_auto_limit(auto_limit)
+    if error:
+        return {"error": error}
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
     client = _connect()
     try:
         coll = client.collections.get(collection)
         if coll is None:
             return {"error": f"Collection '{collection}' not found"}
-        resp = coll.query.near_text(
+        resp = _guarded_call(
+            "weaviate_query",
+            coll.query.near_text,
+            query=query,
+            limit=limit,
+            auto_limit=auto_limit,
+            return_properties=projection.fetch(),
+            return_metadata=MetadataQuery(distance=True),
+            filters=_weaviate_filter(search_filters),
+        )
+        out = []
+        for o in getattr(resp, "objects", []) or []:
+            out.append(
+                {
+                    "uuid": str(getattr(o, "uuid", "")),
+                    "properties": getattr(o, "properties", {}),
+                    "distance": getattr(getattr(o, "metadata", None), "distance", None),
+                }
+            )
+        result = {"count": len(out), "results": out}
+        if auto_limit:
+            _apply_autocut(result, auto_limit, limit, "weaviate", projection)
+        else:
+            projection.apply(out)
+        return result
+    finally:
+        client.close()
+
+
+# Proprietà restituite dalle ricerche (widget + LLM)
+_RESULT_PROPERTIES = ["name", "source_pdf", "page_index", "mediaType", "image_b64"]
+# Default delle ricerche: image_b64 (pesante) solo con include_image=True
+_DEFAULT_RETURN_PROPERTIES = [p for p in _RESULT_PROPERTIES if p != "image_b64"]
+_PROJECTION_MODES = ("metadata", "uuid")
+
+
+class _Projection:
+    """
+    Proiezione dei risultati (return_properties): le proprietà da chiedere a Weaviate
+    e da restituire. "metadata" = solo UUID e punteggi, "uuid" = solo UUID.
+    """
+
+    def __init__(self, properties: List[str], mode: str = "properties"):
+        self.mode = mode
+        self.properties = properties
+        self.key = (mode, tuple(properties))
+
+    @classmethod
+    def parse(cls, raw: Any, include_image: bool = False):
+        """Restituisce (proiezione, errore o None)."""
+        if isinstance(raw, str):
+            text = raw.strip()
+            if text.lower() in _PROJECTION_MODES:
+                return cls([], text.lower()), None
+            try:
+                raw = json.loads(text)
+            except (json.JSONDecodeError, TypeError):
+                raw = [p for p in text.split(",")]
+        if raw is None:
+            props = list(_DEFAULT_RETURN_PROPERTIES)
+        elif isinstance(raw, list) and all(isinstance(p, str) for p in raw):
+            props = list(dict.fromkeys(p.strip() for p in raw if p.strip()))
+            invalid = [p for p in props if not p.isidentifier()]
+            if invalid:
+                return None, f"Invalid property name(s) in return_properties: {', '.join(invalid)}"
+        else:
+            return None, "return_properties must be a list of property names, 'metadata' or 'uuid'"
+        # image_b64 solo con opt-in esplicito
+        props = [p for p in props if p != "image_b64"]
+        if include_image:
+            props.append("image_b64")
+        return (cls(props) if props else cls([], "metadata")), None
+
+    def local_ok(self) -> bool:
+        """True se la replica locale tiene le proprietà richieste (image_b64 si recupera per UUID)."""
+        return self.mode != "properties" or set(self.properties) - {"image_b64"} <= set(local_replica.PROPERTIES)
+
+    def fetch(self, *required: Optional[str]) -> List[str]:
+        """Proprietà da chiedere a Weaviate: quelle richieste più quelle che servono alla pipeline."""
+        return list(dict.fromkeys(self.properties + [p for p in required if p]))
+
+    def apply(self, rows: List[Dict[str, Any]]) -> None:
+        """Riduce le righe (in place) alla proiezione: anche quelle dei gruppi, che sono le stesse."""
+        for row in rows:
+            if self.mode == "uuid":
+                for k in [k for k in row if k != "uuid"]:
+                    del row[k]
+            elif self.mode == "metadata":
+                row.pop("properties", None)
+            elif "properties" in row:
+                props = row["properties"] or {}
+                row["properties"] = {k: props[k] for k in self.properties if k in props}
+
+# Quota del budget totale assegnata a ciascuno stadio della pipeline di ricerca
+_DEADLINE_STAGE_SHARES: Dict[str, float] = {
+    "image_load": 0.25,
+    "caption": 0.45,
+    "image_vector": 0.35,
+    "query": 1.0,
+}
+
+# Sotto questo tempo residuo (s) non tentiamo più la vettorizzazione lato Weaviate
+_DEADLINE_MIN_VECTOR_S = 0.5
+
+# Pool di thread per gli stadi senza timeout nativo (es. embedding Vertex). Uno stadio
+# scaduto continua a girare e tiene il suo thread finché la chiamata non termina: gli
+# slot limitano quanti stadi possono essere in corso, così una raffica di chiamate
+# lente non accoda le richieste successive dietro thread già persi.
+_STAGE_WORKERS = 8
+_STAGE_EXECUTOR = ThreadPoolExecutor(max_workers=_STAGE_WORKERS, thread_name_prefix="search-stage")
+_STAGE_SLOTS = threading.BoundedSemaphore(_STAGE_WORKERS)
+
+
+class _Deadline:
+    """
+    Budget di latenza di una singola richiesta, ripartito tra gli stadi della pipeline.
+    Tiene traccia dei tempi per stadio e degli stadi saltati (timeout o errore).
+    """
+
+    def __init__(self, budget_ms: Optional[float] = None):
+        self.budget_ms = budget_ms
+        self.budget_s = budget_ms / 1000.0 if budget_ms else None
+        self.started_at = time.monotonic()
+        self.stages_ms: Dict[str, float] = {}
+        self.skipped: List[Dict[str, str]] = []
+
+    def remaining(self) -> Optional[float]:
+        if self.budget_s is None:
+            return None
+        return max(0.0, self.budget_s - (time.monotonic() - self.started_at))
+
+    def stage_timeout(self, stage: str, default: Optional[float] = None) -> Optional[float]:
+        """Timeout (s) per lo stadio: quota del budget, mai oltre il tempo residuo."""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        share = _DEADLINE_STAGE_SHARES.get(stage, 1.0)
+        return min(remaining, self.budget_s * share)
+
+    def record(self, stage: str, started_at: float) -> None:
+        self.stages_ms[stage] = round((time.monotonic() - started_at) * 1000, 1)
+
+    def skip(self, stage: str, reason: str) -> None:
+        self.skipped.append({"stage": stage, "reason": reason})
+        print(f"[deadline] stage '{stage}' skipped: {reason}")
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "deadline_ms": self.budget_ms,
+            "elapsed_ms": round((time.monotonic() - self.started_at) * 1000, 1),
+            "stages_ms": dict(self.stages_ms),
+            "skipped_stages": list(self.skipped),
+            "degraded": bool(self.skipped),
+        }
+
+
+def _run_with_timeout(fn, timeout_s: Optional[float], *args, **kwargs):
+    """
+    Esegue fn rispettando un timeout (s). Senza timeout esegue direttamente;
+    allo scadere solleva TimeoutError (il thread worker termina in background e
+    libera il suo slot solo alla fine). Se tutti gli slot sono occupati da stadi
+    ancora in corso, lo stadio scade subito invece di mettersi in coda.
+    """
+    if timeout_s is None:
+        return fn(*args, **kwargs)
+    if timeout_s <= 0:
+        raise TimeoutError("no time left in request budget")
+    started = time.monotonic()
+    if not _STAGE_SLOTS.acquire(timeout=timeout_s):
+        raise TimeoutError("all stage workers busy with earlier slow calls")
+    try:
+        future = _STAGE_EXECUTOR.submit(fn, *args, **kwargs)
+    except Exception:
+        _STAGE_SLOTS.release()
+        raise
+    future.add_done_callback(lambda _: _STAGE_SLOTS.release())
+    return future.result(timeout=max(0.0, timeout_s - (time.monotonic() - started)))
+
+
+def _is_timeout_error(exc: Exception) -> bool:
+    if isinstance(exc, TimeoutError):
+        return True
+    name = type(exc).__name__.lower()
+    return "timeout" in name or "deadline" in name
+
+
+def _caption_within_deadline(image: _ImageRecord, deadline: _Deadline):
+    """
+    Genera la caption GPT entro la quota di budget dello stadio 'caption'.
+    Restituisce (caption, status) con status in: ok, timeout, error, circuit_open, unavailable.
+    """
+    if _OPENAI_CLIENT is None:
+        return "", "unavailable"
+    timeout = deadline.stage_timeout("caption")
+    if timeout is not None and timeout <= 0:
+        deadline.skip("caption", "no time left in budget")
+        return "", "timeout"
+    t0 = time.monotonic()
+    try:
+        caption = _describe_image(image, timeout=timeout)
+        status = "ok" if caption else "error"
+        if not caption:
+            deadline.skip("caption", "empty caption")
+    except _CircuitOpenError:
+        deadline.skip("caption", "circuit breaker open")
+        status = "circuit_open"
+    except Exception as e:
+        if _is_timeout_error(e):
+            deadline.skip("caption", "timeout" if timeout is None else f"timeout after {timeout:.2f}s")
+            status = "timeout"
+        else:
+            deadline.skip("caption", f"error: {e}")
+            status = "error"
+        caption = ""
+    deadline.record("caption", t0)
+    return caption, status
+
+
+def _image_vector_within_deadline(
+    image: _ImageRecord, deadline: _Deadline, dimension: Optional[int] = None
+) -> Optional[List[float]]:
+    """Embedding Vertex dell'immagine entro la quota dello stadio 'image_vector'."""
+    timeout = deadline.stage_timeout("image_vector")
+    if timeout is not None and timeout <= 0:
+        deadline.skip("image_vector", "no time left in budget")
+        return None
+    t0 = time.monotonic()
+    try:
+        vec = _run_with_timeout(_vertex_embed, timeout, image=image, dimension=dimension)
+    except _CircuitOpenError:
+        deadline.skip("image_vector", "circuit breaker open")
+        vec = None
+    except Exception as e:
+        reason = "timeout" if _is_timeout_error(e) else f"error: {e}"
+        deadline.skip("image_vector", reason)
+        vec = None
+    deadline.record("image_vector", t0)
+    return vec
+
+
+def _image_query_without_caption(
+    coll,
+    image: _ImageRecord,
+    query: str,
+    limit: int,
+    deadline: _Deadline,
+    caption_status: str,
+    fallback_mode: Optional[str] = None,
+    search_filters: Optional[_SearchFilters] = None,
+    return_properties: Optional[List[str]] = None,
+):
+    """
+    Ricerca per immagine quando la caption GPT non è disponibile.
+
+    - caption in ritardo + query utente → BM25 sulla query (nessuna altra chiamata remota)
+    - altrimenti segue fallback_mode (default CAPTION_FALLBACK_MODE): near_vector
+      (embedding Vertex), near_image (vettorizzazione lato Weaviate) o bm25; se
+      l'embedding Vertex non è disponibile si ripiega su near_image.
+    Restituisce la risposta Weaviate oppure None se nessuno stadio è eseguibile.
+    """
+    if return_properties is None:
+        return_properties = _RESULT_PROPERTIES
+    mode = fallback_mode or _get_caption_fallback_mode()
+    if query and (caption_status == "timeout" or mode == "bm25"):
+        deadline.skip("vector", f"caption {caption_status}, BM25-only on user query")
+        return _guarded_call(
+            "weaviate_query",
+            coll.query.bm25,
             query=query,
+            query_properties=["caption", "name"],
             limit=limit,
+            return_properties=return_properties,
+            return_metadata=MetadataQuery(score=True),
+            filters=_weaviate_filter(search_filters),
+        )
+
+    if mode in ("near_vector", "bm25"):
+        dimension = _get_embedding_dimension(getattr(coll, "name", None))
+        vec = _image_vector_within_deadline(image, deadline, dimension)
+        if vec:
+            resp = _replica_near_vector(coll, vec, limit, search_filters, return_properties)
+            if resp is not None:
+                return resp
+            return _guarded_call(
+                "weaviate_query",
+                coll.query.near_vector,
+                near_vector=vec,
+                target_vector=_get_image_vector_name(),
+                limit=limit,
+                return_properties=return_properties,
+                return_metadata=MetadataQuery(distance=True),
+                filters=_weaviate_filter(search_filters),
+            )
+
+    remaining = deadline.remaining()
+    if remaining is not None and remaining < _DEADLINE_MIN_VECTOR_S:
+        deadline.skip("near_image", f"only {remaining:.2f}s left")
+        return None
+    print(f"[hybrid_search] fallback near_image (caption {caption_status})")
+    return _guarded_call(
+        "weaviate_query",
+        coll.query.near_image,
+        image.b64,
+        target_vector=_get_image_vector_name(),
+        limit=limit,
+        return_properties=return_properties,
+        return_metadata=MetadataQuery(distance=True),
+        filters=_weaviate_filter(search_filters),
+    )
+
+
+def _duplicate_search(
+    coll,
+    duplicate: Dict[str, Any],
+    limit: int,
+    deadline: _Deadline,
+    search_filters: Optional[_SearchFilters] = None,
+    return_properties: Optional[List[str]] = None,
+    query: str = "",
+    alpha: float = 0.5,
+):
+    """
+    L'immagine di query è (quasi) un duplicato di un oggetto salvato: si salta solo
+    caption ed embedding e si usa il vettore già salvato del duplicato.
+
+    - senza query utente: near_object sul duplicato, come similar_to
+    - con query utente: hybrid con la query come testo e il vettore del duplicato
+      (fusione lato Weaviate); se il vettore non è leggibile si ripiega su near_object
+    """
+    reason = f"{'exact' if duplicate['exact'] else 'near'}-duplicate of {duplicate['uuid']}"
+    deadline.skip("caption", reason)
+    deadline.skip("image_vector", reason)
+    if return_properties is None:
+        return_properties = _RESULT_PROPERTIES
+    vector_name = _get_image_vector_name()
+    t0 = time.monotonic()
+    if query:
+        stored = _guarded_call(
+            "weaviate_query",
+            coll.query.fetch_object_by_id,
+            duplicate["uuid"],
+            include_vector=[vector_name],
+            return_properties=[],
+        )
+        vectors = getattr(stored, "vector", None) or {}
+        vec = vectors.get(vector_name) if isinstance(vectors, dict) else vectors
+        if vec:
+            resp = _guarded_call(
+                "weaviate_query",
+                coll.query.hybrid,
+                query=query,
+                vector=list(vec),
+                target_vector=vector_name,
+                alpha=alpha,
+                limit=limit,
+                query_properties=["caption", "name"],
+                return_properties=return_properties,
+                return_metadata=MetadataQuery(score=True, distance=True),
+                filters=_weaviate_filter(search_filters),
+            )
+            deadline.record("query", t0)
+            return SimpleNamespace(objects=list(getattr(resp, "objects", []) or []), near_duplicate=duplicate)
+        print(f"[phash] no stored vector for {duplicate['uuid']}, near_object without the query text")
+    resp = _guarded_call(
+        "weaviate_query",
+        coll.query.near_object,
+        near_object=duplicate["uuid"],
+        target_vector=vector_name,
+        limit=limit,
+        return_properties=return_properties,
+        return_metadata=MetadataQuery(distance=True),
+        filters=_weaviate_filter(search_filters),
+    )
+    deadline.record("query", t0)
+    return SimpleNamespace(objects=list(getattr(resp, "objects", []) or []), near_duplicate=duplicate)
+
+
+def _image_search_by_mode(
+    coll,
+    image: _ImageRecord,
+    query: str,
+    limit: int,
+    alpha: float,
+    mode: str,
+    deadline: _Deadline,
+    fusion: str = "server",
+    search_filters: Optional[_SearchFilters] = None,
+    return_properties: Optional[List[str]] = None,
+):
+    """
+    Pipeline di ricerca per immagine secondo il livello di latenza:
+
+    - fast: embedding Vertex dell'immagine → near_vector, nessuna chiamata LLM
+    - balanced: caption dalla cache se presente (→ hybrid), altrimenti solo vettore
+    - accurate: caption GPT → hybrid con vettorizzazione lato Weaviate
+
+    In tutti i livelli, se l'immagine è già nella collection (hash percettivo)
+    si parte dal vettore del duplicato, senza caption né embedding; la query
+    utente, se c'è, resta nella ricerca (hybrid).
+    """
+    duplicate = _shortcircuit_duplicate(image, getattr(coll, "name", None))
+    if duplicate is not None:
+        return _duplicate_search(
+            coll, duplicate, limit, deadline, search_filters, return_properties, query=query, alpha=alpha
+        )
+    if return_properties is None:
+        return_properties = _RESULT_PROPERTIES
+
+    if mode == "fast":
+        query_caption, caption_status = "", "skipped"
+        deadline.skip("caption", "mode=fast")
+    elif mode == "balanced":
+        query_caption = _CAPTION_CACHE.get(image.key) or ""
+        caption_status = "cached" if query_caption else "not_cached"
+        if not query_caption:
+            deadline.skip("caption", "mode=balanced, caption not cached")
+    else:
+        # 1️⃣ generiamo una descrizione testuale ad hoc per la query
+        query_caption, caption_status = _caption_within_deadline(image, deadline)
+    # DEBUG: log completo della query per confronto con Colab
+    print(f"[DEBUG] query_caption FULL: {repr(query_caption)}")
+    print(f"[DEBUG] query_caption length: {len(query_caption) if query_caption else 0}")
+    if query_caption:
+        print(f"[hybrid_search] query_caption (len={len(query_caption)}): {query_caption[:120]}...")
+    else:
+        print(f"[hybrid_search] nessuna query_caption generata ({caption_status})")
+
+    t0 = time.monotonic()
+    if query_caption:
+        # 2️⃣ usiamo SOLO la descrizione GPT come query testuale
+        #    ignoriamo completamente la query utente quando c'è un'immagine
+        #    Weaviate genererà automaticamente il vettore dalla query se ha un vectorizer configurato
+        hybrid_params: Dict[str, Any] = {
+            "query": query_caption,  # SOLO descrizione GPT, ignora query utente
+            "alpha": alpha,
+            "limit": limit,
+            # NON passiamo più "vector": il vettore verrà generato automaticamente da Weaviate dalla query
+            "return_properties": return_properties,
+            "return_metadata": MetadataQuery(score=True, distance=True),
+            "filters": _weaviate_filter(search_filters),
+        }
+        # Quando c'è un'immagine, limita BM25 a caption e name come nel Colab
+        hybrid_params["query_properties"] = ["caption", "name"]
+
+        # DEBUG: log dei parametri prima della chiamata
+        print(f"[DEBUG] hybrid_params: query={repr(hybrid_params['query'])}, alpha={hybrid_params['alpha']}, limit={hybrid_params['limit']}, query_properties={hybrid_params['query_properties']}")
+
+        if fusion != "server":
+            resp = _local_hybrid(
+                coll,
+                query_caption,
+                hybrid_params["query_properties"],
+                alpha,
+                limit,
+                fusion,
+                search_filters=search_filters,
+                return_properties=return_properties,
+            )
+        else:
+            resp = _guarded_call("weaviate_query", coll.query.hybrid, **hybrid_params)
+        deadline.record("query", t0)
+        return resp
+
+    # Caption non richiesta, in ritardo, fallita o breaker OpenAI aperto: solo vettore
+    resp = _image_query_without_caption(
+        coll,
+        image,
+        query,
+        limit,
+        deadline,
+        caption_status,
+        fallback_mode="near_vector" if mode != "accurate" else None,
+        search_filters=search_filters,
+        return_properties=return_properties,
+    )
+    if resp is None:
+        deadline.skip("query", "no fallback stage fits in the remaining budget")
+    else:
+        deadline.record("query", t0)
+    return resp
+
+
+def _search_rows(resp) -> List[Dict[str, Any]]:
+    out = []
+    for o in getattr(resp, "objects", []) or []:
+        md = getattr(o, "metadata", None)
+        out.append(
+            {
+                "uuid": str(getattr(o, "uuid", "")),
+                "properties": getattr(o, "properties", {}),
+                "bm25_score": getattr(md, "score", None),
+                "distance": getattr(md, "distance", None),
+            }
+        )
+    return out
+
+
+# ==== Raggruppamento per documento ============================================
+# group_by="source_pdf": i migliori N documenti, ciascuno con le sue pagine migliori.
+# Lato Weaviate (GroupBy) sul percorso testuale con fusione server, altrimenti in locale
+# su una lista candidata più ampia, preservando l'ordine di ranking.
+_GROUP_BY_PROPERTIES = ("source_pdf",)
+
+
+def _group_by_fetch_limit(limit: int, objects_per_group: int) -> int:
+    """Candidati da recuperare per riempire `limit` gruppi (GROUP_BY_MAX_CANDIDATES, default 200)."""
+    cap = int(_get_env_float("GROUP_BY_MAX_CANDIDATES", 200))
+    return max(limit, min(limit * objects_per_group * 3, cap))
+
+
+def _group_rows(
+    rows: List[Dict[str, Any]], prop: str, number_of_groups: int, objects_per_group: int
+) -> List[Dict[str, Any]]:
+    """Raggruppamento locale: i gruppi seguono il rank del loro miglior risultato."""
+    groups: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+    for r in rows:
+        value = (r.get("properties") or {}).get(prop)
+        key = "" if value is None else str(value)
+        bucket = groups.get(key)
+        if bucket is None:
+            if len(groups) >= number_of_groups:
+                continue
+            bucket = groups[key] = []
+        if len(bucket) < objects_per_group:
+            bucket.append(r)
+    return [{prop: k, "count": len(v), "results": v} for k, v in groups.items()]
+
+
+def _server_groups(resp, prop: str) -> List[Dict[str, Any]]:
+    """Gruppi restituiti dal GroupBy di Weaviate (nell'ordine di rilevanza)."""
+    out = []
+    for name, group in (getattr(resp, "groups", None) or {}).items():
+        rows = _search_rows(SimpleNamespace(objects=group.objects))
+        out.append({prop: name, "count": len(rows), "results": rows})
+    return out
+
+
+def _apply_grouping(
+    result: Dict[str, Any], groups: List[Dict[str, Any]], prop: str, objects_per_group: int, strategy: str
+) -> None:
+    """Sostituisce i risultati piatti con quelli raggruppati (results resta la lista appiattita)."""
+    flat = [r for g in groups for r in g["results"]]
+    result["groups"] = groups
+    result["results"] = flat
+    result["count"] = len(flat)
+    result["group_by"] = {
+        "property": prop,
+        "groups": len(groups),
+        "objects_per_group": objects_per_group,
+        "strategy": strategy,
+    }
+
+
+# ==== Paginazione a cursore ===================================================
+# Con paginate=True la prima pagina classifica una finestra più ampia e ne tiene in
+# cache solo gli UUID (con i punteggi); le pagine successive sono un lookup del token
+# più un fetch per ID dei soli oggetti nuovi (o nessun round trip con la replica locale).
+_PAGE_CACHE = _LRUCache(maxsize=512, ttl_s=_get_env_float("PAGE_TOKEN_TTL_S", 600.0))
+
+
+def _pagination_window(limit: int) -> int:
+    """Oggetti classificati alla prima pagina: limit × PAGINATION_PAGES (default 5), max 200."""
+    pages = int(_get_env_float("PAGINATION_PAGES", 5))
+    return max(limit, min(limit * pages, int(_get_env_float("PAGINATION_MAX_WINDOW", 200))))
+
+
+def _paginate_first(
+    collection: str,
+    rows: List[Dict[str, Any]],
+    page_size: int,
+    projection: Optional[_Projection] = None,
+) -> Dict[str, Any]:
+    """Restituisce la prima pagina e, se la finestra ne contiene altre, il token per la successiva."""
+    page = rows[:page_size]
+    info: Dict[str, Any] = {"offset": 0, "page_size": page_size, "ranked": len(rows)}
+    if len(rows) > page_size:
+        token = secrets.token_urlsafe(16)
+        _PAGE_CACHE.put(
+            token,
+            {
+                "collection": collection,
+                "ranked": [
+                    {k: r.get(k) for k in ("uuid", "bm25_score", "distance")} for r in rows
+                ],
+                "offset": page_size,
+                "page_size": page_size,
+                "projection": projection,
+            },
+        )
+        info["next_page_token"] = token
+    return {"rows": page, "page": info}
+
+
+def _fetch_rows_by_ids(
+    coll, ids: List[str], return_properties: Optional[List[str]] = None
+) -> Dict[str, Dict[str, Any]]:
+    """Proprietà degli oggetti per UUID in un'unica query (filtro by_id)."""
+    resp = _guarded_call(
+        "weaviate_query",
+        coll.query.fetch_objects,
+        filters=Filter.by_id().contains_any(ids),
+        limit=len(ids),
+        return_properties=return_properties or _RESULT_PROPERTIES,
+    )
+    return {
+        str(getattr(o, "uuid", "")): getattr(o, "properties", {}) or {}
+        for o in getattr(resp, "objects", []) or []
+    }
+
+
+def _apply_first_page(
+    result: Dict[str, Any],
+    collection: str,
+    page_size: int,
+    projection: Optional[_Projection] = None,
+    coll=None,
+) -> None:
+    """
+    Taglia il risultato alla prima pagina. Con `coll` la finestra è stata classificata
+    senza proprietà (solo UUID e punteggi): le proprietà della prima pagina si
+    recuperano qui con un'unica fetch per ID.
+    """
+    paged = _paginate_first(collection, result["results"], page_size, projection)
+    if coll is not None and paged["rows"] and (projection is None or projection.mode == "properties"):
+        props = _fetch_rows_by_ids(
+            coll, [r["uuid"] for r in paged["rows"]], projection.properties if projection else None
+        )
+        for r in paged["rows"]:
+            r["properties"] = props.get(r["uuid"], {})
+    result["results"] = paged["rows"]
+    result["count"] = len(paged["rows"])
+    result["page"] = paged["page"]
+
+
+def _next_page(page_token: str, collection: str) -> Dict[str, Any]:
+    """Pagina successiva da un token: lookup in cache + fetch per ID (o replica locale)."""
+    state = _PAGE_CACHE.get(page_token)
+    if state is None:
+        return {"error": "Invalid or expired page_token. Run the search again."}
+    if state["collection"] != collection:
+        return {"error": "page_token belongs to a different collection"}
+    offset, page_size = state["offset"], state["page_size"]
+    slice_ = state["ranked"][offset : offset + page_size]
+    ids = [r["uuid"] for r in slice_]
+    projection = state.get("projection") or _Projection(list(_DEFAULT_RETURN_PROPERTIES))
+
+    t0 = time.monotonic()
+    served_by = "weaviate"
+    replica = _get_local_replica(collection) if projection.local_ok() else None
+    if projection.mode != "properties":
+        # solo UUID/punteggi: nessuna proprietà da recuperare
+        props = {u: {} for u in ids}
+        served_by = "page_cache"
+    elif replica is not None:
+        props = replica.get_properties(ids)
+        served_by = "local_replica"
+    else:
+        props = {}
+    missing = [u for u in ids if u not in props]
+    if missing:
+        unavailable = _weaviate_unavailable()
+        if unavailable:
+            return unavailable
+        client = _connect()
+        try:
+            props.update(
+                _fetch_rows_by_ids(client.collections.get(collection), missing, projection.properties)
+            )
+        finally:
+            client.close()
+        served_by = "weaviate"
+
+    # oggetti cancellati nel frattempo: saltati
+    rows = [
+        {"uuid": r["uuid"], "properties": props[r["uuid"]], "bm25_score": r["bm25_score"], "distance": r["distance"]}
+        for r in slice_
+        if r["uuid"] in props
+    ]
+    projection.apply(rows)
+    if replica is not None:
+        unavailable = _attach_replica_images(collection, rows, projection.properties)
+        if unavailable:
+            return unavailable
+    next_offset = offset + page_size
+    info: Dict[str, Any] = {"offset": offset, "page_size": page_size, "ranked": len(state["ranked"])}
+    if next_offset < len(state["ranked"]):
+        token = secrets.token_urlsafe(16)
+        _PAGE_CACHE.put(token, {**state, "offset": next_offset})
+        info["next_page_token"] = token
+    return {
+        "count": len(rows),
+        "results": rows,
+        "page": info,
+        "fetch_ms": round((time.monotonic() - t0) * 1000, 1),
+        "served_by": served_by,
+    }
+
+
+# ==== Autocut: numero di risultati adattivo ===================================
+# auto_limit=N taglia la lista dopo l'N-esimo salto di punteggio, restituendo solo il
+# gruppo iniziale di risultati rilevanti (limit resta il massimo). Sulle query dirette
+# a Weaviate si usa il suo autocut (le righe tagliate non vengono trasferite); sui
+# percorsi locali (replica, fusione locale, re-rank, ricerca per immagine) un
+# rilevatore di salti sui punteggi già ordinati.
+# cut/bytes_saved sono misurati (solo taglio locale); per l'autocut di Weaviate le righe
+# tagliate non si vedono e si accumula solo un limite superiore (limit - righe restituite).
+_AUTOCUT_STATS = {
+    "requests": 0,
+    "returned": 0,
+    "measured_requests": 0,
+    "measured_returned": 0,
+    "cut": 0,
+    "bytes_saved": 0,
+    "cut_upper_bound": 0,
+    "bytes_saved_upper_bound": 0,
+}
+
+
+def _parse_auto_limit(raw: Any):
+    """Restituisce (numero di salti o None, errore o None): True = 1 salto, 0/False = disattivo."""
+    if isinstance(raw, str):
+        raw = raw.strip().lower()
+        raw = {"true": 1, "yes": 1, "false": 0, "no": 0, "": 0}.get(raw, raw)
+    if raw is None or raw is False:
+        return None, None
+    try:
+        jumps = int(raw)
+    except (TypeError, ValueError):
+        return None, "auto_limit must be a non-negative integer (number of score jumps)"
+    if jumps < 0:
+        return None, "auto_limit must be a non-negative integer (number of score jumps)"
+    return (jumps or None), None
+
+
+def _row_relevance(row: Dict[str, Any]) -> Optional[float]:
+    """Rilevanza di una riga (più alta = migliore): punteggio, altrimenti distanza negata."""
+    score = row.get("bm25_score")
+    if score is not None:
+        return float(score)
+    distance = row.get("distance")
+    return -float(distance) if distance is not None else None
+
+
+def _autocut_count(relevance: List[float], jumps: int) -> int:
+    """
+    Quanti risultati tenere: si taglia dopo il jumps-esimo salto. Un salto è un gap
+    tra punteggi consecutivi (normalizzati 0-1) più ampio di AUTOCUT_GAP_FACTOR volte
+    il gap medio (default 2) e comunque di AUTOCUT_MIN_GAP (default 0.1).
+    """
+    n = len(relevance)
+    hi, lo = max(relevance, default=0.0), min(relevance, default=0.0)
+    if n < 3 or hi == lo:
+        return n
+    threshold = max(
+        _get_env_float("AUTOCUT_MIN_GAP", 0.1),
+        _get_env_float("AUTOCUT_GAP_FACTOR", 2.0) / (n - 1),
+    )
+    seen = 0
+    for i in range(n - 1):
+        if (relevance[i] - relevance[i + 1]) / (hi - lo) > threshold:
+            seen += 1
+            if seen >= jumps:
+                return i + 1
+    return n
+
+
+def _apply_autocut(
+    result: Dict[str, Any], jumps: int, limit: int, strategy: str, projection: _Projection
+) -> None:
+    """
+    Taglio locale (strategy="local") o resoconto di quello di Weaviate, poi la proiezione.
+    result["autocut"] riporta risultati tenuti e tagliati e i byte di payload risparmiati.
+    Quando taglia Weaviate le righe scartate non si conoscono (la query poteva avere
+    meno di `limit` risultati): cut e bytes_saved sono None e si riportano solo
+    cut_upper_bound e bytes_saved_upper_bound.
+    """
+    rows = result["results"]
+    if strategy == "local":
+        relevance = [_row_relevance(r) for r in rows]
+        keep = len(rows) if None in relevance else _autocut_count(relevance, jumps)
+        rows, dropped = rows[:keep], rows[keep:]
+        projection.apply(rows)
+        projection.apply(dropped)
+        cut = len(dropped)
+        saved = len(json.dumps(dropped, default=str)) if dropped else 0
+        info = {"cut": cut, "bytes_saved": saved, "measured": True}
+    else:
+        projection.apply(rows)
+        cut_max = max(0, limit - len(rows))
+        saved_max = len(json.dumps(rows, default=str)) // len(rows) * cut_max if rows and cut_max else 0
+        info = {
+            "cut": None,
+            "bytes_saved": None,
+            "measured": False,
+            "cut_upper_bound": cut_max,
+            "bytes_saved_upper_bound": saved_max,
+        }
+    result["results"] = rows
+    result["count"] = len(rows)
+    result["autocut"] = {
+        "auto_limit": jumps,
+        "strategy": strategy,
+        "limit": limit,
+        "returned": len(rows),
+        **info,
+    }
+    _AUTOCUT_STATS["requests"] += 1
+    _AUTOCUT_STATS["returned"] += len(rows)
+    if info["measured"]:
+        _AUTOCUT_STATS["measured_requests"] += 1
+        _AUTOCUT_STATS["measured_returned"] += len(rows)
+        _AUTOCUT_STATS["cut"] += cut
+        _AUTOCUT_STATS["bytes_saved"] += saved
+    else:
+        _AUTOCUT_STATS["cut_upper_bound"] += cut_max
+        _AUTOCUT_STATS["bytes_saved_upper_bound"] += saved_max
+
+
+def _autocut_snapshot() -> Dict[str, Any]:
+    stats = dict(_AUTOCUT_STATS)
+    total = stats["measured_returned"] + stats["cut"]
+    if total:
+        stats["cut_ratio"] = round(stats["cut"] / total, 3)
+    return stats
+
+
+# ==== Fusione ibrida locale ===================================================
+# Le liste candidate BM25 e vettoriale vengono scaricate una volta (in parallelo),
+# messe in cache per query e fuse in-process: cambiare alpha o limit non rifà le query.
+_FUSION_CACHE = _LRUCache(
+    maxsize=256, ttl_s=_get_env_float("LOCAL_FUSION_TTL_S", 300.0)
+)
+_RANKED_FUSION_K = 60
+# Pool proprio per le due gambe della fusione: non condivide i thread con gli stadi
+# della pipeline, che possono restare occupati da chiamate Vertex/OpenAI scadute
+_FUSION_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fusion-leg")
+
+
+def _local_object(uuid_str: str, properties: Dict[str, Any], score=None, distance=None):
+    """Oggetto con la stessa forma dei risultati Weaviate (uuid, properties, metadata)."""
+    return SimpleNamespace(
+        uuid=uuid_str,
+        properties=properties,
+        metadata=SimpleNamespace(score=score, distance=distance),
+    )
+
+
+def _fetch_fusion_legs(
+    coll,
+    query_text: str,
+    query_properties: Optional[List[str]],
+    search_filters: Optional[_SearchFilters] = None,
+    return_properties: Optional[List[str]] = None,
+):
+    """
+    Scarica (o prende dalla cache) le due gambe candidate per la fusione locale.
+    Restituisce (legs, cache_hit); legs contiene array allineati sull'unione dei candidati.
+    """
+    if return_properties is None:
+        return_properties = _RESULT_PROPERTIES
+    pool = int(_get_env_float("LOCAL_FUSION_CANDIDATES", 100))
+    key = (
+        getattr(coll, "name", ""),
+        query_text,
+        tuple(query_properties or ()),
+        pool,
+        search_filters.key if search_filters is not None else None,
+        tuple(return_properties),
+    )
+    legs = _FUSION_CACHE.get(key)
+    if legs is not None:
+        return legs, True
+
+    bm25_params: Dict[str, Any] = {
+        "query": query_text,
+        "limit": pool,
+        "return_properties": return_properties,
+        "return_metadata": MetadataQuery(score=True),
+        "filters": _weaviate_filter(search_filters),
+    }
+    if query_properties:
+        bm25_params["query_properties"] = query_properties
+    bm25_future = _FUSION_EXECUTOR.submit(
+        _guarded_call, "weaviate_query", coll.query.bm25, **bm25_params
+    )
+    vector_future = _FUSION_EXECUTOR.submit(
+        _guarded_call,
+        "weaviate_query",
+        coll.query.near_text,
+        query=query_text,
+        limit=pool,
+        return_properties=return_properties,
+        return_metadata=MetadataQuery(distance=True),
+        filters=_weaviate_filter(search_filters),
+    )
+    bm25_objs = getattr(bm25_future.result(), "objects", []) or []
+    vector_objs = getattr(vector_future.result(), "objects", []) or []
+
+    index: Dict[str, int] = {}
+    properties: List[Dict[str, Any]] = []
+    for o in list(bm25_objs) + list(vector_objs):
+        uid = str(getattr(o, "uuid", ""))
+        if uid not in index:
+            index[uid] = len(properties)
+            properties.append(getattr(o, "properties", {}) or {})
+
+    n = len(properties)
+    bm25 = np.full(n, np.nan, dtype=np.float32)
+    bm25_rank = np.full(n, np.inf, dtype=np.float32)
+    for rank, o in enumerate(bm25_objs):
+        i = index[str(getattr(o, "uuid", ""))]
+        bm25[i] = getattr(getattr(o, "metadata", None), "score", None) or 0.0
+        bm25_rank[i] = rank
+    distance = np.full(n, np.nan, dtype=np.float32)
+    vector_rank = np.full(n, np.inf, dtype=np.float32)
+    for rank, o in enumerate(vector_objs):
+        i = index[str(getattr(o, "uuid", ""))]
+        d = getattr(getattr(o, "metadata", None), "distance", None)
+        distance[i] = d if d is not None else np.nan
+        vector_rank[i] = rank
+
+    legs = {
+        "uuids": list(index.keys()),
+        "properties": properties,
+        "bm25": bm25,
+        "bm25_rank": bm25_rank,
+        "distance": distance,
+        # similarità vettoriale: più alta è meglio (1 - distanza coseno)
+        "vector": 1.0 - distance,
+        "vector_rank": vector_rank,
+    }
+    _FUSION_CACHE.put(key, legs)
+    return legs, False
+
+
+def _normalize_scores(scores):
+    """Min-max in [0, 1] sui candidati presenti nella gamba; assenti → 0."""
+    present = ~np.isnan(scores)
+    out = np.zeros_like(scores, dtype=np.float32)
+    if not present.any():
+        return out
+    vals = scores[present]
+    lo, hi = vals.min(), vals.max()
+    out[present] = 1.0 if hi == lo else (vals - lo) / (hi - lo)
+    return out
+
+
+def _fuse_legs(legs: Dict[str, Any], alpha: float, fusion: str, limit: int):
+    """Fusione vettorizzata: relative_score (min-max pesato) o ranked (1 / (k + rank))."""
+    if fusion == "ranked":
+        fused = alpha / (_RANKED_FUSION_K + legs["vector_rank"] + 1.0) + (1.0 - alpha) / (
+            _RANKED_FUSION_K + legs["bm25_rank"] + 1.0
+        )
+    else:
+        fused = alpha * _normalize_scores(legs["vector"]) + (1.0 - alpha) * _normalize_scores(
+            legs["bm25"]
+        )
+    k = min(limit, fused.shape[0])
+    if k <= 0:
+        return [], fused
+    if k < fused.shape[0]:
+        top = np.argpartition(-fused, k - 1)[:k]
+        top = top[np.argsort(-fused[top], kind="stable")]
+    else:
+        top = np.argsort(-fused, kind="stable")
+    return top.tolist(), fused
+
+
+def _local_hybrid(
+    coll,
+    query_text: str,
+    query_properties: Optional[List[str]],
+    alpha: float,
+    limit: int,
+    fusion: str,
+    search_filters: Optional[_SearchFilters] = None,
+    return_properties: Optional[List[str]] = None,
+):
+    """
+    Ricerca ibrida con fusione locale. Restituisce una risposta con la stessa forma
+    di quella Weaviate, più 'fusion' con cache hit, numero di candidati e tempo di fusione.
+    """
+    legs, cache_hit = _fetch_fusion_legs(
+        coll, query_text, query_properties, search_filters, return_properties
+    )
+    t0 = time.perf_counter()
+    top, fused = _fuse_legs(legs, alpha, fusion, limit)
+    fusion_us = round((time.perf_counter() - t0) * 1e6, 1)
+    objects = []
+    for i in top:
+        d = legs["distance"][i]
+        objects.append(
+            _local_object(
+                legs["uuids"][i],
+                legs["properties"][i],
+                score=float(fused[i]),
+                distance=None if np.isnan(d) else float(d),
+            )
+        )
+    info = {
+        "type": fusion,
+        "cache_hit": cache_hit,
+        "candidates": len(legs["uuids"]),
+        "fusion_us": fusion_us,
+    }
+    return SimpleNamespace(objects=objects, fusion=info)
+
+
+# ==== Ricerca a due stadi =====================================================
+# Stadio 1: query economica (BM25 o near_vector con limit ampio) con include_vector.
+# Stadio 2: re-rank locale per similarità coseno con l'embedding della query, con MMR
+# opzionale. I candidati restano in cache: cambiare limit o mmr_lambda non rifà query.
+_RERANK_STRATEGIES = ("vector", "mmr")
+_CANDIDATE_CACHE = _LRUCache(maxsize=128, ttl_s=_get_env_float("TWO_STAGE_TTL_S", 300.0))
+
+
+def _two_stage_query_vector(
+    collection: str, query: str, image: Optional[_ImageRecord], deadline: _Deadline
+) -> Optional[List[float]]:
+    """Embedding Vertex della query: immagine se presente, altrimenti testo."""
+    dimension = _get_embedding_dimension(collection)
+    if image is not None:
+        return _image_vector_within_deadline(image, deadline, dimension)
+    t0 = time.monotonic()
+    try:
+        return _run_with_timeout(
+            _vertex_embed, deadline.stage_timeout("image_vector"), text=query, dimension=dimension
+        )
+    except Exception as e:
+        deadline.skip("query_vector", "timeout" if _is_timeout_error(e) else f"error: {e}")
+        return None
+    finally:
+        deadline.record("query_vector", t0)
+
+
+def _fetch_two_stage_candidates(
+    coll,
+    query: str,
+    image: Optional[_ImageRecord],
+    query_properties: Optional[List[str]],
+    pool: int,
+    deadline: _Deadline,
+    search_filters: Optional[_SearchFilters] = None,
+    return_properties: Optional[List[str]] = None,
+):
+    """
+    Stadio 1 (o cache). Con testo: BM25 su `pool` candidati; senza testo o senza risultati
+    BM25: near_vector sull'embedding della query. Restituisce (candidati, cache_hit).
+    La cache si consulta prima di toccare `coll`: con una _LazyCollection un hit non apre
+    la connessione.
+    """
+    if return_properties is None:
+        return_properties = _RESULT_PROPERTIES
+    collection = getattr(coll, "name", "")
+    key = (
+        collection,
+        query,
+        image.key if image is not None else None,
+        tuple(query_properties or ()),
+        pool,
+        _get_embedding_dimension(collection),
+        search_filters.key if search_filters is not None else None,
+        tuple(return_properties),
+    )
+    cached = _CANDIDATE_CACHE.get(key)
+    if cached is not None:
+        return cached, True
+
+    vector_name = _get_image_vector_name()
+    query_vector = _two_stage_query_vector(collection, query, image, deadline)
+    t0 = time.monotonic()
+    objs: List[Any] = []
+    stage1 = "bm25"
+    if query:
+        params: Dict[str, Any] = {
+            "query": query,
+            "limit": pool,
+            "include_vector": [vector_name],
+            "return_properties": return_properties,
+            "return_metadata": MetadataQuery(score=True),
+            "filters": _weaviate_filter(search_filters),
+        }
+        if query_properties:
+            params["query_properties"] = query_properties
+        objs = list(getattr(_guarded_call("weaviate_query", coll.query.bm25, **params), "objects", []) or [])
+    if not objs and query_vector:
+        stage1 = "near_vector"
+        resp = _guarded_call(
+            "weaviate_query",
+            coll.query.near_vector,
+            near_vector=query_vector,
+            target_vector=vector_name,
+            limit=pool,
+            include_vector=[vector_name],
+            return_properties=return_properties,
             return_metadata=MetadataQuery(distance=True),
+            filters=_weaviate_filter(search_filters),
         )
-        out = []
-        for o in getattr(resp, "objects", []) or []:
-            out.append(
-                {
-                    "uuid": str(getattr(o, "uuid", "")),
-                    "properties": getattr(o, "properties", {}),
-                    "distance": getattr(getattr(o, "metadata", None), "distance", None),
-                }
+        objs = list(getattr(resp, "objects", []) or [])
+    deadline.record("candidates", t0)
+
+    vectors = [_extract_vector(o, vector_name) for o in objs]
+    dim = len(query_vector) if query_vector else 0
+    matrix = np.zeros((len(objs), dim), dtype=np.float32)
+    has_vector = np.zeros(len(objs), dtype=bool)
+    for i, v in enumerate(vectors):
+        if v is not None and len(v) == dim:
+            matrix[i] = v
+            has_vector[i] = True
+    cands = {
+        "stage1": stage1,
+        "uuids": [str(getattr(o, "uuid", "")) for o in objs],
+        "properties": [getattr(o, "properties", {}) or {} for o in objs],
+        "bm25": [getattr(getattr(o, "metadata", None), "score", None) for o in objs],
+        "vectors": knn_graph.normalize_rows(matrix) if dim else matrix,
+        "has_vector": has_vector,
+        "query_vector": query_vector,
+    }
+    # senza embedding della query non c'è nulla da riordinare: non mettiamo in cache
+    if query_vector:
+        _CANDIDATE_CACHE.put(key, cands)
+    return cands, False
+
+
+def _mmr_select(sims, vectors, limit: int, mmr_lambda: float) -> List[int]:
+    """Maximal Marginal Relevance: bilancia rilevanza e diversità rispetto ai già scelti."""
+    n = sims.shape[0]
+    chosen: List[int] = []
+    redundancy = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(min(limit, n)):
+        scores = mmr_lambda * sims - (1.0 - mmr_lambda) * redundancy
+        scores[~available] = -np.inf
+        i = int(np.argmax(scores))
+        chosen.append(i)
+        available[i] = False
+        sim_i = vectors @ vectors[i]
+        redundancy = sim_i if len(chosen) == 1 else np.maximum(redundancy, sim_i)
+    return chosen
+
+
+def _two_stage_search(
+    coll,
+    query: str,
+    image: Optional[_ImageRecord],
+    query_properties: Optional[List[str]],
+    limit: int,
+    rerank: str,
+    candidates: Optional[int],
+    mmr_lambda: Optional[float],
+    deadline: _Deadline,
+    search_filters: Optional[_SearchFilters] = None,
+    return_properties: Optional[List[str]] = None,
+):
+    """
+    Ricerca a due stadi. Restituisce una risposta con la stessa forma di quella Weaviate,
+    più 'rerank' con strategia, stadio 1, numero di candidati, cache hit e tempo di re-rank.
+    """
+    pool = max(limit, int(candidates or _get_env_float("TWO_STAGE_CANDIDATES", 100)))
+    cands, cache_hit = _fetch_two_stage_candidates(
+        coll, query, image, query_properties, pool, deadline, search_filters, return_properties
+    )
+    t0 = time.perf_counter()
+    n = len(cands["uuids"])
+    if cands["query_vector"] is None or n == 0:
+        if n:
+            deadline.skip("rerank", "query embedding unavailable, stage-one order")
+        order, sims = list(range(min(limit, n))), None
+    else:
+        sims = cands["vectors"] @ knn_graph.normalize_rows(
+            np.asarray([cands["query_vector"]], dtype=np.float32)
+        )[0]
+        # candidati senza vettore immagine in fondo
+        sims = np.where(cands["has_vector"], sims, -1.0).astype(np.float32)
+        if rerank == "mmr":
+            order = _mmr_select(sims, cands["vectors"], limit, mmr_lambda)
+        else:
+            k = min(limit, n)
+            order = np.argsort(-sims, kind="stable")[:k].tolist()
+    rerank_us = round((time.perf_counter() - t0) * 1e6, 1)
+
+    objects = []
+    for i in order:
+        sim = float(sims[i]) if sims is not None and cands["has_vector"][i] else None
+        objects.append(
+            _local_object(
+                cands["uuids"][i],
+                cands["properties"][i],
+                score=sim if sim is not None else cands["bm25"][i],
+                distance=1.0 - sim if sim is not None else None,
             )
-        return {"count": len(out), "results": out}
-    finally:
-        client.close()
+        )
+    info = {
+        "strategy": rerank,
+        "stage1": cands["stage1"],
+        "candidates": n,
+        "cache_hit": cache_hit,
+        "rerank_us": rerank_us,
+    }
+    if rerank == "mmr":
+        info["mmr_lambda"] = mmr_lambda
+    return SimpleNamespace(objects=objects, rerank=info)
 
 
 @mcp.tool()
@@ -1306,11 +4135,145 @@ def hybrid_search(
     query_properties: Optional[Any] = None,
     image_id: Optional[str] = None,
     image_url: Optional[str] = None,
+    deadline_ms: Optional[int] = None,
+    mode: Optional[str] = None,
+    fusion: Optional[str] = None,
+    rerank: Optional[str] = None,
+    candidates: Optional[int] = None,
+    mmr_lambda: Optional[float] = None,
+    filters: Optional[Any] = None,
+    group_by: Optional[str] = None,
+    objects_per_group: int = 3,
+    paginate: bool = False,
+    page_token: Optional[str] = None,
+    return_properties: Optional[Any] = None,
+    include_image: bool = False,
+    auto_limit: Optional[Any] = None,
+) -> Dict[str, Any]:
+    return _hybrid_search(
+        collection=collection,
+        query=query,
+        limit=limit,
+        alpha=alpha,
+        query_properties=query_properties,
+        image_id=image_id,
+        image_url=image_url,
+        deadline_ms=deadline_ms,
+        mode=mode,
+        fusion=fusion,
+        rerank=rerank,
+        candidates=candidates,
+        mmr_lambda=mmr_lambda,
+        filters=filters,
+        group_by=group_by,
+        objects_per_group=objects_per_group,
+        paginate=paginate,
+        page_token=page_token,
+        return_properties=return_properties,
+        include_image=include_image,
+        auto_limit=auto_limit,
+    )
+
+
+def _hybrid_search(
+    collection: str,
+    query: str,
+    limit: int = 10,
+    alpha: Optional[float] = None,
+    query_properties: Optional[Any] = None,
+    image_id: Optional[str] = None,
+    image_url: Optional[str] = None,
+    deadline_ms: Optional[int] = None,
+    mode: Optional[str] = None,
+    fusion: Optional[str] = None,
+    rerank: Optional[str] = None,
+    candidates: Optional[int] = None,
+    mmr_lambda: Optional[float] = None,
+    filters: Optional[Any] = None,
+    group_by: Optional[str] = None,
+    objects_per_group: int = 3,
+    paginate: bool = False,
+    page_token: Optional[str] = None,
+    return_properties: Optional[Any] = None,
+    include_image: bool = False,
+    auto_limit: Optional[Any] = None,
+    client=None,
 ) -> Dict[str, Any]:
+    """
+    Implementazione di hybrid_search. Con `client` (client aperto o _LazyClient) usa
+    una connessione Weaviate condivisa (ricerche batch) senza chiuderla.
+    """
     # Se alpha non è specificato, usa il default da env (HYBRID_DEFAULT_ALPHA) o 0.2
     if alpha is None:
         alpha = _get_default_alpha()
 
+    # Fusione lato Weaviate (default) o locale con NumPy (HYBRID_FUSION come default)
+    fusion = (fusion or _get_default_fusion()).lower()
+    if fusion not in _FUSION_TYPES:
+        return {"error": f"Invalid fusion '{fusion}'. Use one of: {', '.join(_FUSION_TYPES)}"}
+    if fusion != "server" and not _NUMPY_AVAILABLE:
+        print("[hybrid_search] numpy not installed, falling back to server-side fusion")
+        fusion = "server"
+
+    # Filtri strutturati (source_pdf, page_index, mediaType), spinti dentro la query
+    search_filters, error = _SearchFilters.parse(filters)
+    if error:
+        return {"error": error}
+
+    # Proiezione dei risultati: a Weaviate chiediamo solo le proprietà restituite
+    # (più quella di group_by, che serve al raggruppamento locale)
+    projection, error = _Projection.parse(return_properties, include_image)
+    if error:
+        return {"error": error}
+    fetch_properties = projection.fetch(group_by)
+
+    # Autocut: solo il primo gruppo di risultati rilevanti (limit resta il massimo)
+    auto_limit, error = _parse_auto_limit(auto_limit)
+    if error:
+        return {"error": error}
+    if auto_limit and (group_by or paginate):
+        return {"error": "auto_limit cannot be combined with group_by or paginate"}
+    autocut_strategy = "local"
+
+    # Raggruppamento per documento: `limit` diventa il numero di gruppi, le pipeline
+    # lavorano su una lista candidata più ampia
+    number_of_groups = limit
+    if group_by:
+        if group_by not in _GROUP_BY_PROPERTIES:
+            return {"error": f"Invalid group_by '{group_by}'. Use one of: {', '.join(_GROUP_BY_PROPERTIES)}"}
+        objects_per_group = max(1, int(objects_per_group or 1))
+        limit = _group_by_fetch_limit(number_of_groups, objects_per_group)
+
+    # Paginazione: la prima pagina classifica una finestra più ampia (solo UUID in cache)
+    page_size = limit
+    if paginate and group_by:
+        return {"error": "paginate cannot be combined with group_by"}
+    paginate = bool(paginate)
+    if paginate:
+        limit = _pagination_window(page_size)
+        # la finestra si classifica solo con UUID e punteggi: le proprietà della
+        # prima pagina arrivano con una fetch per ID (_apply_first_page)
+        fetch_properties = []
+
+    # Ricerca a due stadi: candidati economici + re-rank locale (vector o mmr)
+    if rerank:
+        rerank = rerank.lower()
+        if rerank not in _RERANK_STRATEGIES:
+            return {"error": f"Invalid rerank '{rerank}'. Use one of: {', '.join(_RERANK_STRATEGIES)}"}
+        if not _NUMPY_AVAILABLE:
+            return {"error": "numpy not installed: rerank unavailable"}
+        if mmr_lambda is None:
+            mmr_lambda = _get_env_float("MMR_LAMBDA", 0.7)
+        mmr_lambda = min(max(float(mmr_lambda), 0.0), 1.0)
+
+    # Livello di latenza (SEARCH_DEFAULT_MODE come default)
+    mode = (mode or _get_default_search_mode()).lower()
+    if mode not in _SEARCH_MODES:
+        return {"error": f"Invalid mode '{mode}'. Use one of: {', '.join(_SEARCH_MODES)}"}
+
+    # Budget di latenza della richiesta (SEARCH_DEADLINE_MS come default)
+    deadline = _Deadline(deadline_ms if deadline_ms else _get_default_deadline_ms())
+
     # Usa la collection di default configurata, mantenendo lo stesso comportamento di forzatura
     default_collection = _get_default_collection()
     if not collection:
@@ -1322,19 +4285,23 @@ def hybrid_search(
         )
         collection = default_collection
 
+    # Pagina successiva: nessuna nuova ricerca, solo fetch per ID degli oggetti della pagina
+    if page_token:
+        return _next_page(page_token, collection)
+
     if query_properties and isinstance(query_properties, str):
         try:
             query_properties = json.loads(query_properties)
         except (json.JSONDecodeError, TypeError):
             pass
 
-    image_b64 = None
+    image = None
 
     if image_id:
         if image_id in _UPLOADED_IMAGES:
             img_data = _UPLOADED_IMAGES[image_id]
             if img_data["expires_at"] > time.time():
-                image_b64 = img_data["image_b64"]
+                image = img_data["image"]
             else:
                 _UPLOADED_IMAGES.pop(image_id, None)
                 return {
@@ -1349,63 +4316,147 @@ def hybrid_search(
                 )
             }
 
-    if image_url and not image_b64:
-        image_b64 = _load_image_from_url(image_url)
-        if not image_b64:
+    if image_url and image is None:
+        t0 = time.monotonic()
+        image = _load_image_from_url(
+            image_url, timeout=deadline.stage_timeout("image_load", 30)
+        )
+        deadline.record("image_load", t0)
+        if image is None:
             return {"error": f"Failed to load image from URL: {image_url}"}
-        image_b64 = _clean_base64(image_b64)
-        if not image_b64:
-            return {"error": f"Invalid image format from URL: {image_url}"}
 
-    client = _connect()
+    # Query testuale in modalità fast (solo BM25) con replica locale fresca: niente
+    # round trip verso Weaviate. La gamba vettoriale testuale resta a Weaviate, che
+    # vettorizza la query con il modello della collection
+    replica = (
+        None
+        if image is not None or rerank or mode != "fast" or not projection.local_ok()
+        else _get_local_replica(collection)
+    )
+    if replica is not None:
+        t0 = time.monotonic()
+        deadline.skip("vector", "mode=fast, BM25-only")
+        resp = replica.bm25(query, limit, query_properties, search_filters)
+        deadline.record("query", t0)
+        out = _search_rows(resp)
+        pipeline = deadline.report()
+        _record_tier_latency(mode, "text_local", pipeline["elapsed_ms"])
+        result = {
+            "count": len(out),
+            "results": out,
+            "mode": mode,
+            "pipeline": pipeline,
+            "served_by": "local_replica",
+        }
+        if group_by:
+            groups = _group_rows(out, group_by, number_of_groups, objects_per_group)
+            _apply_grouping(result, groups, group_by, objects_per_group, "local")
+        if paginate:
+            _apply_first_page(result, collection, page_size, projection)
+        if auto_limit:
+            _apply_autocut(result, auto_limit, limit, "local", projection)
+        else:
+            projection.apply(result["results"])
+        return _attach_replica_images(collection, result["results"], projection.properties) or result
+
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
+
+    # Connessione aperta al primo uso: un hit delle cache di fusione o dei candidati
+    # risponde senza round trip verso Weaviate
+    own_client = client is None
+    if own_client:
+        client = _LazyClient(query_timeout_s=deadline.remaining())
     try:
-        coll = client.collections.get(collection)
-        if coll is None:
-            return {"error": f"Collection '{collection}' not found"}
-
-        # Aggiorna i metadata gRPC prima della query per assicurarci che siano aggiornati
-        _update_client_grpc_metadata(client)
-
-        if image_b64:
-            # 1️⃣ generiamo una descrizione testuale ad hoc per la query
-            query_caption = describe_image_for_query(image_b64)
-            # DEBUG: log completo della query per confronto con Colab
-            print(f"[DEBUG] query_caption FULL: {repr(query_caption)}")
-            print(f"[DEBUG] query_caption length: {len(query_caption) if query_caption else 0}")
-            if query_caption:
-                print(f"[hybrid_search] query_caption (len={len(query_caption)}): {query_caption[:120]}...")
-            else:
-                print("[hybrid_search] nessuna query_caption generata, uso solo immagine")
-
-            # 2️⃣ usiamo SOLO la descrizione GPT come query testuale
-            #    ignoriamo completamente la query utente quando c'è un'immagine
-            #    Weaviate genererà automaticamente il vettore dalla query se ha un vectorizer configurato
-            hybrid_params: Dict[str, Any] = {
-                "query": query_caption if query_caption else "",  # SOLO descrizione GPT, ignora query utente
-                "alpha": alpha,
-                "limit": limit,
-                # NON passiamo più "vector": il vettore verrà generato automaticamente da Weaviate dalla query
-                "return_properties": ["name", "source_pdf", "page_index", "mediaType", "image_b64"],
-                "return_metadata": MetadataQuery(score=True, distance=True),
-            }
-            # Quando c'è un'immagine, limita BM25 a caption e name come nel Colab
-            hybrid_params["query_properties"] = ["caption", "name"]
-            
-            # DEBUG: log dei parametri prima della chiamata
-            print(f"[DEBUG] hybrid_params: query={repr(hybrid_params['query'])}, alpha={hybrid_params['alpha']}, limit={hybrid_params['limit']}, query_properties={hybrid_params['query_properties']}")
-
-            resp = coll.query.hybrid(**hybrid_params)
+        coll = _LazyCollection(collection, client)
+
+        resp = None
+        if rerank:
+            resp = _two_stage_search(
+                coll,
+                query,
+                image,
+                query_properties,
+                limit,
+                rerank,
+                candidates,
+                mmr_lambda,
+                deadline,
+                search_filters,
+                fetch_properties,
+            )
+            t0 = None
+        elif image is not None:
+            resp = _image_search_by_mode(
+                coll,
+                image,
+                query,
+                limit,
+                alpha,
+                mode,
+                deadline,
+                fusion=fusion,
+                search_filters=search_filters,
+                return_properties=fetch_properties,
+            )
+            t0 = None
         else:
-            hybrid_params = {
-                "query": query,
-                "alpha": alpha,
-                "limit": limit,
-                "return_properties": ["name", "source_pdf", "page_index", "mediaType", "image_b64"],
-                "return_metadata": MetadataQuery(score=True, distance=True),
-            }
-            if query_properties:
-                hybrid_params["query_properties"] = query_properties
-            resp = coll.query.hybrid(**hybrid_params)
+            remaining = deadline.remaining()
+            t0 = time.monotonic()
+            if mode == "fast" or (remaining is not None and remaining < _DEADLINE_MIN_VECTOR_S):
+                # Livello fast o budget quasi esaurito: solo BM25, senza vettorizzazione lato Weaviate
+                if mode == "fast":
+                    deadline.skip("vector", "mode=fast, BM25-only")
+                else:
+                    deadline.skip("vector", f"only {remaining:.2f}s left, BM25-only")
+                bm25_params: Dict[str, Any] = {
+                    "query": query,
+                    "limit": limit,
+                    "return_properties": fetch_properties,
+                    "return_metadata": MetadataQuery(score=True),
+                    "filters": _weaviate_filter(search_filters),
+                }
+                if query_properties:
+                    bm25_params["query_properties"] = query_properties
+                if auto_limit:
+                    bm25_params["auto_limit"] = auto_limit
+                    autocut_strategy = "weaviate"
+                if group_by:
+                    bm25_params["group_by"] = GroupBy(
+                        prop=group_by,
+                        objects_per_group=objects_per_group,
+                        number_of_groups=number_of_groups,
+                    )
+                resp = _guarded_call("weaviate_query", coll.query.bm25, **bm25_params)
+            else:
+                hybrid_params = {
+                    "query": query,
+                    "alpha": alpha,
+                    "limit": limit,
+                    "return_properties": fetch_properties,
+                    "return_metadata": MetadataQuery(score=True, distance=True),
+                    "filters": _weaviate_filter(search_filters),
+                }
+                if query_properties:
+                    hybrid_params["query_properties"] = query_properties
+                if fusion != "server":
+                    resp = _local_hybrid(
+                        coll, query, query_properties, alpha, limit, fusion, search_filters, fetch_properties
+                    )
+                else:
+                    if auto_limit:
+                        hybrid_params["auto_limit"] = auto_limit
+                        autocut_strategy = "weaviate"
+                    if group_by:
+                        hybrid_params["group_by"] = GroupBy(
+                            prop=group_by,
+                            objects_per_group=objects_per_group,
+                            number_of_groups=number_of_groups,
+                        )
+                    resp = _guarded_call("weaviate_query", coll.query.hybrid, **hybrid_params)
+        if resp is not None and t0 is not None:
+            deadline.record("query", t0)
 
         # Log dei risultati nel formato Colab
         print("[DEBUG] Risultati hybrid search:")
@@ -1418,22 +4469,417 @@ def hybrid_search(
             else:
                 print(f"{name}  score=N/A")
 
-        out = []
-        for o in getattr(resp, "objects", []) or []:
-            md = getattr(o, "metadata", None)
-            score = getattr(md, "score", None)
-            distance = getattr(md, "distance", None)
-            out.append(
-                {
-                    "uuid": str(getattr(o, "uuid", "")),
-                    "properties": getattr(o, "properties", {}),
-                    "bm25_score": score,
-                    "distance": distance,
-                }
+        out = _search_rows(resp)
+        pipeline = deadline.report()
+        _record_tier_latency(mode, "image" if image is not None else "text", pipeline["elapsed_ms"])
+        result = {"count": len(out), "results": out, "mode": mode, "pipeline": pipeline}
+        fusion_info = getattr(resp, "fusion", None)
+        if fusion_info:
+            result["fusion"] = fusion_info
+        rerank_info = getattr(resp, "rerank", None)
+        if rerank_info:
+            result["rerank"] = rerank_info
+        if getattr(resp, "near_duplicate", None):
+            result["near_duplicate"] = resp.near_duplicate
+        if search_filters is not None:
+            result["filters"] = search_filters.spec
+            hints = _filter_index_hints(coll, search_filters)
+            if hints:
+                result["filter_hints"] = hints
+        if group_by:
+            if getattr(resp, "groups", None) is not None:
+                groups, strategy = _server_groups(resp, group_by), "server"
+            else:
+                groups, strategy = _group_rows(out, group_by, number_of_groups, objects_per_group), "local"
+            _apply_grouping(result, groups, group_by, objects_per_group, strategy)
+        if paginate:
+            _apply_first_page(result, collection, page_size, projection, coll=coll)
+        if auto_limit:
+            _apply_autocut(result, auto_limit, limit, autocut_strategy, projection)
+        else:
+            projection.apply(result["results"])
+        return result
+    finally:
+        if own_client:
+            client.close()
+
+
+def _run_search_batch(
+    collection: Optional[str],
+    requests: List[Dict[str, Any]],
+    deadline_ms: Optional[int] = None,
+    **common: Any,
+) -> Dict[str, Any]:
+    """
+    Esegue più ricerche hybrid in parallelo su un'unica connessione Weaviate.
+    Le richieste identiche vengono eseguite una sola volta; le cache di caption ed
+    embedding sono condivise. Restituisce un item per richiesta con il proprio tempo.
+    """
+    max_requests = int(_get_env_float("BATCH_SEARCH_MAX", 20))
+    if not requests:
+        return {"error": "At least one query is required"}
+    if len(requests) > max_requests:
+        return {"error": f"Too many queries: {len(requests)} (max {max_requests}, BATCH_SEARCH_MAX)"}
+
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
+
+    collection = collection or _get_default_collection()
+    unique: Dict[str, Dict[str, Any]] = {}
+    for req in requests:
+        unique.setdefault(json.dumps(req, sort_keys=True, default=str), req)
+
+    def run_one(req: Dict[str, Any]) -> Dict[str, Any]:
+        t0 = time.monotonic()
+        try:
+            res = _hybrid_search(
+                collection=collection, deadline_ms=deadline_ms, client=client, **common, **req
             )
-        return {"count": len(out), "results": out}
+        except Exception as e:
+            print(f"[batch-search] query failed: {e}")
+            res = {"error": str(e)}
+        return {**req, "elapsed_ms": round((time.monotonic() - t0) * 1000, 1), **res}
+
+    t0 = time.monotonic()
+    workers = max(1, min(len(unique), int(_get_env_float("BATCH_SEARCH_CONCURRENCY", 4))))
+    # connessione condivisa aperta solo se almeno una ricerca manca le cache locali
+    client = _LazyClient(query_timeout_s=deadline_ms / 1000.0 if deadline_ms else None)
+    try:
+        # pool dedicato: gli stadi interni usano già _STAGE_EXECUTOR e _FUSION_EXECUTOR
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-search") as pool:
+            done = dict(zip(unique.keys(), pool.map(run_one, unique.values())))
+    finally:
+        client.close()
+    items = [done[json.dumps(req, sort_keys=True, default=str)] for req in requests]
+    return {
+        "count": len(items),
+        "items": items,
+        "unique_queries": len(unique),
+        "concurrency": workers,
+        "elapsed_ms": round((time.monotonic() - t0) * 1000, 1),
+    }
+
+
+@mcp.tool()
+def batch_hybrid_search(
+    collection: str,
+    queries: Any,
+    limit: int = 10,
+    alpha: Optional[float] = None,
+    query_properties: Optional[Any] = None,
+    deadline_ms: Optional[int] = None,
+    mode: Optional[str] = None,
+    fusion: Optional[str] = None,
+    rerank: Optional[str] = None,
+    filters: Optional[Any] = None,
+    return_properties: Optional[Any] = None,
+    include_image: bool = False,
+) -> Dict[str, Any]:
+    """
+    Più ricerche hybrid testuali in una sola chiamata (es. una per pezzo di un assieme),
+    eseguite in parallelo su una connessione condivisa. deadline_ms vale per ogni query.
+    """
+    if isinstance(queries, str):
+        try:
+            queries = json.loads(queries)
+        except (json.JSONDecodeError, TypeError):
+            queries = [queries]
+    if not isinstance(queries, list) or not all(isinstance(q, str) and q.strip() for q in queries):
+        return {"error": "queries must be a non-empty list of strings"}
+    return _run_search_batch(
+        collection,
+        [{"query": q} for q in queries],
+        deadline_ms=deadline_ms,
+        limit=limit,
+        alpha=alpha,
+        query_properties=query_properties,
+        mode=mode,
+        fusion=fusion,
+        rerank=rerank,
+        filters=filters,
+        return_properties=return_properties,
+        include_image=include_image,
+    )
+
+
+def _is_valid_uuid(value: str) -> bool:
+    return _normalize_uuid(value) is not None
+
+
+def _normalize_uuid(value: Any) -> Optional[str]:
+    """Forma canonica (minuscola, con trattini) di un UUID, o None se non valido."""
+    try:
+        return str(uuid.UUID(str(value).strip()))
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+@mcp.tool()
+def similar_to(
+    uuid: str,
+    limit: int = 10,
+    collection: Optional[str] = None,
+    return_properties: Optional[Any] = None,
+    include_image: bool = False,
+) -> Dict[str, Any]:
+    """
+    "Altri come questo": cerca gli oggetti più simili a un risultato esistente
+    usando il suo vettore immagine già salvato in Weaviate (near_object).
+    Niente upload, caption GPT o embedding Vertex: una sola query vettoriale.
+    """
+    # forma canonica: Weaviate restituisce UUID minuscoli con trattini
+    source_uuid = _normalize_uuid(uuid)
+    if source_uuid is None:
+        return {"error": f"Invalid uuid: {uuid!r}"}
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return {"error": f"limit must be an integer, got {limit!r}"}
+    if limit < 1:
+        return {"error": "limit must be >= 1"}
+    projection, error = _Projection.parse(return_properties, include_image)
+    if error:
+        return {"error": error}
+
+    collection = collection or _get_default_collection()
+    if collection != _get_default_collection():
+        print(
+            f"[similar_to] warning: collection '{collection}' requested, "
+            f"but using '{_get_default_collection()}' as per instructions"
+        )
+        collection = _get_default_collection()
+
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
+
+    t0 = time.monotonic()
+    client = _connect()
+    try:
+        coll = client.collections.get(collection)
+        if coll is None:
+            return {"error": f"Collection '{collection}' not found"}
+        # +1 perché l'oggetto sorgente è (quasi sempre) il primo risultato di se stesso
+        resp = _guarded_call(
+            "weaviate_query",
+            coll.query.near_object,
+            near_object=source_uuid,
+            target_vector=_get_image_vector_name(),
+            limit=limit + 1,
+            return_properties=projection.fetch(),
+            return_metadata=MetadataQuery(distance=True),
+        )
+        out = [r for r in _search_rows(resp) if r["uuid"] != source_uuid][:limit]
+        projection.apply(out)
+        return {
+            "source_uuid": source_uuid,
+            "count": len(out),
+            "results": out,
+            "elapsed_ms": round((time.monotonic() - t0) * 1000, 1),
+        }
+    finally:
+        client.close()
+
+
+# ==== Grafo k-NN precomputato ================================================
+# Job offline (build_knn_graph / build_knn_graph.py) sui vettori immagine salvati:
+# il grafo (knn_graph.KnnGraph) si salva in un .npz compatto e related_items lo
+# legge dalla memoria, senza query vettoriali live.
+_KNN_GRAPH = None
+_KNN_GRAPH_LOCK = threading.Lock()
+_KNN_GRAPH_SAVE_TIMER: Optional[threading.Timer] = None
+
+
+def _get_knn_graph_path() -> Path:
+    """
+    Restituisce il path del grafo k-NN.
+    Se KNN_GRAPH_PATH è impostata usa quella; altrimenti data/knn_graph.npz.
+    """
+    return Path(os.environ.get("KNN_GRAPH_PATH") or (_BASE_DIR / "data" / "knn_graph.npz"))
+
+
+def _get_knn_graph_k() -> int:
+    return max(1, int(_get_env_float("KNN_GRAPH_K", 20)))
+
+
+def _extract_vector(obj, vector_name: str) -> Optional[List[float]]:
+    vec = getattr(obj, "vector", None)
+    if isinstance(vec, dict):
+        vec = vec.get(vector_name) or (vec.get("default") if len(vec) == 1 else None)
+    return list(vec) if vec else None
+
+
+def _get_knn_graph() -> Optional[knn_graph.KnnGraph]:
+    """Grafo k-NN in memoria, caricato dal disco al primo utilizzo."""
+    global _KNN_GRAPH
+    if _KNN_GRAPH is not None or not _NUMPY_AVAILABLE:
+        return _KNN_GRAPH
+    path = _get_knn_graph_path()
+    if not path.exists():
+        return None
+    with _KNN_GRAPH_LOCK:
+        if _KNN_GRAPH is None:
+            try:
+                _KNN_GRAPH = knn_graph.KnnGraph.load(path)
+                print(f"[knn-graph] loaded {len(_KNN_GRAPH.uuids)} rows (k={_KNN_GRAPH.k}) from {path}")
+            except Exception as e:
+                print(f"[knn-graph] cannot load {path}: {e}")
+    return _KNN_GRAPH
+
+
+def _flush_knn_graph() -> None:
+    """Salva su disco il grafo in memoria se ha inserimenti incrementali non salvati."""
+    global _KNN_GRAPH_SAVE_TIMER
+    with _KNN_GRAPH_LOCK:
+        _KNN_GRAPH_SAVE_TIMER = None
+        graph = _KNN_GRAPH
+        if graph is None or not graph.unsaved_updates:
+            return
+        try:
+            graph.save(_get_knn_graph_path())
+        except Exception as e:
+            print(f"[knn-graph] save failed: {e}")
+            return
+        saved, graph.unsaved_updates = graph.unsaved_updates, 0
+    print(f"[knn-graph] saved after {saved} incremental updates")
+
+
+def _knn_graph_add(collection: str, uuid_str: str, vector: List[float]) -> None:
+    """
+    Aggiorna il grafo (se presente e della stessa collection) dopo un inserimento.
+    Il salvataggio del .npz è differito di KNN_GRAPH_SAVE_DELAY_S (default 30s): una
+    raffica di inserimenti riscrive il file una volta sola.
+    """
+    global _KNN_GRAPH_SAVE_TIMER
+    graph = _get_knn_graph()
+    if graph is None or graph.collection != collection:
+        return
+    try:
+        with _KNN_GRAPH_LOCK:
+            updated = graph.add(uuid_str, vector)
+            graph.unsaved_updates += 1
+            if _KNN_GRAPH_SAVE_TIMER is None:
+                _KNN_GRAPH_SAVE_TIMER = threading.Timer(
+                    _get_env_float("KNN_GRAPH_SAVE_DELAY_S", 30.0), _flush_knn_graph
+                )
+                _KNN_GRAPH_SAVE_TIMER.daemon = True
+                _KNN_GRAPH_SAVE_TIMER.start()
+        print(f"[knn-graph] added {uuid_str}, {updated} rows updated")
+    except Exception as e:
+        print(f"[knn-graph] incremental update failed for {uuid_str}: {e}")
+
+
+atexit.register(_flush_knn_graph)
+
+
+@mcp.tool()
+def build_knn_graph(collection: Optional[str] = None, k: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Job offline: costruisce il grafo k-NN sui vettori immagine salvati della collection
+    e lo salva su disco (KNN_GRAPH_PATH). Sostituisce il grafo in memoria.
+    """
+    global _KNN_GRAPH
+    if not _NUMPY_AVAILABLE:
+        return {"error": "numpy not installed"}
+    collection = collection or _get_default_collection()
+    k = k or _get_knn_graph_k()
+    vector_name = _get_image_vector_name()
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
+
+    t0 = time.monotonic()
+    client = _connect()
+    try:
+        coll = client.collections.get(collection)
+        if coll is None:
+            return {"error": f"Collection '{collection}' not found"}
+        uuids: List[str] = []
+        vectors: List[List[float]] = []
+        for o in coll.iterator(include_vector=True, return_properties=[]):
+            vec = _extract_vector(o, vector_name)
+            if vec:
+                uuids.append(str(o.uuid))
+                vectors.append(vec)
     finally:
         client.close()
+    fetched_s = time.monotonic() - t0
+
+    if not vectors:
+        return {"error": f"No '{vector_name}' vectors found in collection '{collection}'"}
+
+    graph = knn_graph.KnnGraph.build(collection, uuids, vectors, k)
+    path = _get_knn_graph_path()
+    graph.save(path)
+    with _KNN_GRAPH_LOCK:
+        _KNN_GRAPH = graph
+    return {
+        "collection": collection,
+        "objects": len(uuids),
+        "k": graph.k,
+        "dimensions": int(graph.vectors.shape[1]),
+        "path": str(path),
+        "size_bytes": path.stat().st_size,
+        "fetch_s": round(fetched_s, 2),
+        "total_s": round(time.monotonic() - t0, 2),
+    }
+
+
+@mcp.tool()
+def related_items(
+    uuid: str,
+    limit: int = 10,
+    include_properties: bool = False,
+    return_properties: Optional[Any] = None,
+    include_image: bool = False,
+) -> Dict[str, Any]:
+    """
+    Vicini precomputati di un oggetto dal grafo k-NN (nessuna ricerca vettoriale live).
+    Con include_properties=True (o return_properties) recupera le proprietà dei vicini
+    con un solo fetch per ID.
+    """
+    projection, error = _Projection.parse(return_properties, include_image)
+    if error:
+        return {"error": error}
+    include_properties = (include_properties or return_properties is not None or include_image) and (
+        projection.mode == "properties"
+    )
+    graph = _get_knn_graph()
+    if graph is None:
+        return {"error": "k-NN graph not built yet. Run build_knn_graph first."}
+    t0 = time.perf_counter()
+    source_uuid = _normalize_uuid(uuid) or str(uuid or "").strip()
+    # add() fa crescere index/vettori/vicini in più passi: leggiamo sotto lo stesso lock
+    with _KNN_GRAPH_LOCK:
+        neighbours = graph.related(source_uuid, int(limit))
+    if neighbours is None:
+        return {"error": f"Object {source_uuid} not in k-NN graph (built {graph.built_at:.0f})"}
+    result: Dict[str, Any] = {
+        "source_uuid": source_uuid,
+        "count": len(neighbours),
+        "results": neighbours,
+        "lookup_us": round((time.perf_counter() - t0) * 1e6, 1),
+    }
+    if include_properties and neighbours and _weaviate_unavailable() is None:
+        client = _connect()
+        try:
+            coll = client.collections.get(graph.collection)
+            resp = _guarded_call(
+                "weaviate_query",
+                coll.query.fetch_objects,
+                filters=Filter.by_id().contains_any([n["uuid"] for n in neighbours]),
+                limit=len(neighbours),
+                return_properties=projection.fetch(),
+            )
+            props = {str(o.uuid): o.properties for o in getattr(resp, "objects", []) or []}
+        finally:
+            client.close()
+        for n in neighbours:
+            n["properties"] = props.get(n["uuid"], {})
+    if projection.mode == "uuid":
+        projection.apply(neighbours)
+    return result
 
 
 try:
@@ -1457,12 +4903,11 @@ def _ensure_gcp_adc():
         _load_vertex_user_project(os.environ["GOOGLE_APPLICATION_CREDENTIALS"])
 
 
-def _load_image_from_url(image_url: str) -> Optional[str]:
+def _load_image_from_url(image_url: str, timeout: Optional[float] = 30) -> Optional[_ImageRecord]:
     try:
         import requests
-        import base64
 
-        response = requests.get(image_url, timeout=30, stream=True)
+        response = requests.get(image_url, timeout=timeout, stream=True)
         response.raise_for_status()
 
         content_type = response.headers.get("content-type", "").lower()
@@ -1501,53 +4946,297 @@ def _load_image_from_url(image_url: str) -> Optional[str]:
         if not is_valid:
             print(f"[image] warning: {image_url} may not be a valid image format")
 
-        return base64.b64encode(content).decode("utf-8")
+        return _image_from_bytes(content)
     except Exception as e:
         print(f"[image] error loading from URL {image_url}: {e}")
         return None
 
 
-def _clean_base64(image_b64: str) -> Optional[str]:
-    import base64
-    import re
+def _image_from_bytes(
+    data: bytes, b64: Optional[str] = None, key: Optional[str] = None
+) -> Optional[_ImageRecord]:
+    if len(data) == 0:
+        print("[image] empty image data")
+        return None
+
+    if len(data) < 10:
+        print(f"[image] image too small ({len(data)} bytes)")
+        return None
+
+    return _ImageRecord(data, b64, key)
 
+
+def _image_from_base64(image_b64: str) -> Optional[_ImageRecord]:
+    """
+    Valida e decodifica il base64 in un solo passaggio (binascii in modalità
+    strict, niente regex sull'intera stringa). I byte decodificati restano nel
+    record, così caption ed embedding non decodificano di nuovo.
+    """
     if image_b64.startswith("data:"):
-        match = re.match(r"data:image/[^;]+;base64,(.+)", image_b64)
-        if match:
-            image_b64 = match.group(1)
-        else:
+        header, sep, payload = image_b64.partition(",")
+        if not sep or not header.startswith("data:image/") or not header.endswith(";base64"):
             return None
+        image_b64 = payload
 
     image_b64 = image_b64.strip()
 
     try:
-        if not re.match(r"^[A-Za-z0-9+/=]+$", image_b64):
-            print("[image] invalid base64 characters")
-            return None
+        decoded = _IMAGE_POOL.run(image_worker.decode_base64, image_b64)
+    except Exception as e:
+        print(f"[image] base64 validation error: {e}")
+        return None
 
-        decoded = base64.b64decode(image_b64, validate=True)
+    return _image_from_bytes(decoded, b64=image_b64)
+
+
+# ==== Pool di processi per il lavoro CPU sulle immagini ====
+
+
+def _data_size(args) -> int:
+    return sum(len(a) for a in args if isinstance(a, (bytes, bytearray, memoryview, str)))
+
+
+def _image_pool_start_method() -> str:
+    import multiprocessing
+
+    available = multiprocessing.get_all_start_methods()
+    method = os.environ.get("IMAGE_WORKERS_START_METHOD", "").strip().lower()
+    if method not in ("forkserver", "spawn") or method not in available:
+        if method:
+            print(f"[image-pool] start method {method!r} not allowed, using default")
+        method = "forkserver" if "forkserver" in available else "spawn"
+    return method
 
-        if len(decoded) == 0:
-            print("[image] empty image data")
-            return None
 
-        if len(decoded) < 10:
-            print(f"[image] image too small ({len(decoded)} bytes)")
+class _ImageWorkerPool:
+    """
+    Pool di processi per base64, decodifica e resize delle immagini, così il
+    lavoro pesante non tiene il GIL mentre il server serve le altre richieste.
+
+    - IMAGE_WORKERS: numero di processi (default 2, 0 = tutto nel thread chiamante)
+    - IMAGE_WORKERS_MIN_BYTES: sotto questa dimensione si lavora inline (default 256 KiB),
+      perché il passaggio al processo costa più del lavoro stesso
+
+    - IMAGE_WORKERS_START_METHOD: "forkserver" (default dove disponibile) o "spawn";
+      mai fork, che copierebbe lock, thread e socket gRPC del processo server
+
+    Le funzioni eseguite stanno in image_worker (nessun import di serve) e
+    ricevono/restituiscono bytes. Se il pool si rompe si ricrea al giro
+    successivo; intanto si lavora inline.
+    """
+
+    def __init__(self, workers: int, min_bytes: int):
+        self.workers = workers
+        self.min_bytes = min_bytes
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.submitted = 0
+        self.inline = 0
+        self.failed = 0
+        self.latency = _LatencyStats()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self.workers <= 0:
             return None
+        with self._lock:
+            if self._executor is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                try:
+                    ctx = multiprocessing.get_context(_image_pool_start_method())
+                    if ctx.get_start_method() == "forkserver":
+                        ctx.set_forkserver_preload(["image_worker"])
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+                    print(
+                        f"[image-pool] started {self.workers} worker processes "
+                        f"({ctx.get_start_method()})"
+                    )
+                except Exception as e:
+                    print(f"[image-pool] cannot start process pool, running inline: {e}")
+                    self.workers = 0
+            return self._executor
+
+    def _reset(self, executor) -> None:
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        try:
+            executor.shutdown(wait=False)
+        except Exception:
+            pass
+
+    def _submit(self, fn, args):
+        executor = self._get_executor() if _data_size(args) >= self.min_bytes else None
+        if executor is None:
+            return None, None
+        with self._lock:
+            self.in_flight += 1
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.in_flight - self.workers)
+        t0 = time.perf_counter()
+
+        def _done(_):
+            with self._lock:
+                self.in_flight -= 1
+            self.latency.record((time.perf_counter() - t0) * 1000.0)
+
+        try:
+            future = executor.submit(fn, *args)
+        except Exception as e:
+            _done(None)
+            print(f"[image-pool] submit failed, running inline: {e}")
+            self._reset(executor)
+            return None, None
+        future.add_done_callback(_done)
+        return executor, future
+
+    def _inline(self, fn, args):
+        with self._lock:
+            self.inline += 1
+        return fn(*args)
+
+    def run(self, fn, *args):
+        """Esegue fn(*args) nel pool e ne attende il risultato (inline se disabilitato o dati piccoli)."""
+        from concurrent.futures.process import BrokenProcessPool
+
+        executor, future = self._submit(fn, args)
+        if future is None:
+            return self._inline(fn, args)
+        try:
+            return future.result()
+        except BrokenProcessPool as e:
+            print(f"[image-pool] worker died, running inline: {e}")
+            self.failed += 1
+            self._reset(executor)
+            return self._inline(fn, args)
+
+    async def run_async(self, fn, *args):
+        """Come run, ma per gli handler async: l'event loop resta libero durante l'attesa."""
+        import asyncio
+        from concurrent.futures.process import BrokenProcessPool
+
+        executor, future = self._submit(fn, args)
+        if future is None:
+            return self._inline(fn, args)
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool as e:
+            print(f"[image-pool] worker died, running inline: {e}")
+            self.failed += 1
+            self._reset(executor)
+            return self._inline(fn, args)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": self._executor is not None,
+            "min_bytes": self.min_bytes,
+            "in_flight": self.in_flight,
+            "queue_depth": max(0, self.in_flight - self.workers),
+            "max_queue_depth": max(0, self.max_queue_depth),
+            "submitted": self.submitted,
+            "inline": self.inline,
+            "failed": self.failed,
+            "latency": self.latency.snapshot(),
+        }
+
+
+_IMAGE_POOL = _ImageWorkerPool(
+    workers=max(0, int(_get_env_float("IMAGE_WORKERS", 2))),
+    min_bytes=max(0, int(_get_env_float("IMAGE_WORKERS_MIN_BYTES", 256 * 1024))),
+)
+atexit.register(_IMAGE_POOL.shutdown)
 
-        return image_b64
+
+# ==== Pre-processing immagini (prima di caption GPT ed embedding Vertex) ====
+
+_PREPARED_IMAGE_CACHE = _LRUCache(maxsize=64, ttl_s=3600.0)
+_PREPROCESS_LATENCY = _LatencyStats()
+_PREPROCESS_STATS = {"images": 0, "resized": 0, "reencoded": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def _get_image_max_edge() -> int:
+    """Lato massimo (px) delle immagini inviate alle API (IMAGE_MAX_EDGE, default 1568, 0 = nessun limite)."""
+    return max(0, int(_get_env_float("IMAGE_MAX_EDGE", 1568)))
+
+
+def _image_preprocess_options() -> Dict[str, Any]:
+    """Configurazione del pre-processing, letta qui e passata ai worker (che non vedono l'env del server)."""
+    return {
+        "max_edge": _get_image_max_edge(),
+        "grayscale": os.environ.get("IMAGE_GRAYSCALE", "").lower() in ("1", "true", "yes"),
+        "crop_margins": os.environ.get("IMAGE_CROP_MARGINS", "").lower() in ("1", "true", "yes"),
+        "crop_threshold": int(_get_env_float("IMAGE_CROP_THRESHOLD", 245)),
+        "jpeg_quality": int(_get_env_float("IMAGE_JPEG_QUALITY", 85)),
+    }
+
+
+def _prepare_image(image: _ImageRecord):
+    """
+    Byte pronti per le API (caption GPT / embedding Vertex) e relativo MIME type.
+    Il ridimensionamento gira nel pool immagini sui byte già decodificati del
+    record; il risultato è in cache per chiave contenuto dell'immagine, così
+    caption ed embedding della stessa query lo calcolano una volta sola.
+    """
+    cached = _PREPARED_IMAGE_CACHE.get(image.key)
+    if cached is not None:
+        return cached
+
+    t0 = time.perf_counter()
+    try:
+        data, mime, resized = _IMAGE_POOL.run(
+            image_worker.preprocess, image.data, _image_preprocess_options()
+        )
     except Exception as e:
-        print(f"[image] base64 validation error: {e}")
-        return None
+        print(f"[image] preprocessing failed, using original bytes: {e}")
+        data, mime, resized = None, image_worker.sniff_mime(image.data), False
+    _PREPROCESS_LATENCY.record((time.perf_counter() - t0) * 1000.0)
+    _PREPROCESS_STATS["images"] += 1
+    _PREPROCESS_STATS["resized"] += int(resized)
+    _PREPROCESS_STATS["reencoded"] += int(data is not None)
+    if data is None:
+        data = image.data
+    _PREPROCESS_STATS["bytes_in"] += len(image.data)
+    _PREPROCESS_STATS["bytes_out"] += len(data)
+    prepared = (data, mime)
+    _PREPARED_IMAGE_CACHE.put(image.key, prepared)
+    return prepared
+
+
+def _preprocess_snapshot() -> Dict[str, Any]:
+    stats = dict(_PREPROCESS_STATS)
+    if stats["bytes_in"]:
+        stats["bytes_saved_ratio"] = round(1.0 - stats["bytes_out"] / stats["bytes_in"], 3)
+    stats["latency"] = _PREPROCESS_LATENCY.snapshot()
+    stats["pillow"] = image_worker.PIL_AVAILABLE
+    stats["max_edge"] = _get_image_max_edge()
+    return stats
 
 
 def _vertex_embed(
-    image_b64: Optional[str] = None,
+    image: Optional[_ImageRecord] = None,
     text: Optional[str] = None,
     model: str = "multimodalembedding@001",
+    dimension: Optional[int] = None,
 ):
     if not _VERTEX_AVAILABLE:
         raise RuntimeError("google-cloud-aiplatform not installed")
+    dimension = dimension or _VERTEX_DEFAULT_DIMENSION
+    cache_key = (image.key if image is not None else None, text, model, dimension)
+    cached = _EMBEDDING_CACHE.get(cache_key)
+    if cached is not None:
+        return cached.astype(np.float32).tolist() if _NUMPY_AVAILABLE else list(cached)
+    if _BREAKERS["vertex_embed"].is_open():
+        raise _CircuitOpenError("circuit breaker 'vertex_embed' is open")
     project = _discover_gcp_project()
     location = os.environ.get("VERTEX_LOCATION", "us-central1")
     if not project:
@@ -1558,23 +5247,29 @@ def _vertex_embed(
     from vertexai.vision_models import MultiModalEmbeddingModel, Image
 
     mdl = MultiModalEmbeddingModel.from_pretrained(model)
-    import base64
 
-    image = None
-    if image_b64:
-        image_bytes = base64.b64decode(image_b64)
-        image = Image(image_bytes)
-    resp = mdl.get_embeddings(image=image, contextual_text=text)
+    vertex_image = None
+    if image is not None:
+        image_bytes, _ = _prepare_image(image)
+        vertex_image = Image(image_bytes)
+    kwargs: Dict[str, Any] = {"image": vertex_image, "contextual_text": text}
+    if dimension != _VERTEX_DEFAULT_DIMENSION:
+        kwargs["dimension"] = dimension
+    resp = _guarded_call("vertex_embed", mdl.get_embeddings, **kwargs)
+    vec = None
     if getattr(resp, "image_embedding", None):
-        return list(resp.image_embedding)
-    if getattr(resp, "text_embedding", None):
-        return list(resp.text_embedding)
-    if getattr(resp, "embedding", None):
-        return list(resp.embedding)
-    raise RuntimeError("No embedding returned from Vertex AI")
-
-
-def describe_image_for_query(image_b64: str) -> Optional[str]:
+        vec = list(resp.image_embedding)
+    elif getattr(resp, "text_embedding", None):
+        vec = list(resp.text_embedding)
+    elif getattr(resp, "embedding", None):
+        vec = list(resp.embedding)
+    if vec is None:
+        raise RuntimeError("No embedding returned from Vertex AI")
+    _EMBEDDING_CACHE.put(cache_key, _compact_vector(vec) if _NUMPY_AVAILABLE else vec)
+    return vec
+
+
+def describe_image_for_query(image: _ImageRecord) -> Optional[str]:
     """
     Usa GPT per generare una descrizione breve e tecnica del pezzo meccanico
     nell'immagine di query, da usare come parte testuale del vettore Vertex.
@@ -1583,55 +5278,80 @@ def describe_image_for_query(image_b64: str) -> Optional[str]:
         return None
 
     try:
-        resp = _OPENAI_CLIENT.chat.completions.create(
-            model="gpt-4.1-mini",
-            temperature=0,
-            max_tokens=350,
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "Sei un esperto di disegno meccanico. "
-                        "Riceverai immagini di tavole tecniche con pezzi meccanici. "
-                        "Devi descrivere solo la geometria del pezzo (forme, fori, spessori, simmetrie), "
-                        "ignorando completamente testi, quote, misure e intestazioni."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": (
-                                "Descrivi in modo conciso ma tecnico la forma del pezzo meccanico mostrato. "
-                                "Ignora testo, numeri, quote, cartigli e tutto ciò che non è geometria. "
-                                "Se vedi più viste (frontale, laterale, sezione), usale per ricostruire mentalmente "
-                                "la forma 3D del pezzo.\n\n"
-                                "Rispondi in al massimo 4 frasi, per un totale di non più di 900 caratteri."
-                            ),
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{image_b64}"
-                            },
-                        },
-                    ],
-                },
-            ],
-        )
+        return _describe_image(image)
+    except Exception as e:
+        print(f"[query-caption] errore nella descrizione immagine: {e}")
+        return ""
 
-        caption = resp.choices[0].message.content.strip()
 
-        MAX_CAPTION_CHARS = 1024
-        if len(caption) > MAX_CAPTION_CHARS:
-            caption = caption[:MAX_CAPTION_CHARS]
+def _describe_image(image: _ImageRecord, timeout: Optional[float] = None) -> str:
+    """
+    Chiamata GPT vera e propria: solleva eccezioni (incluso il timeout),
+    così la pipeline di ricerca può distinguere una caption in ritardo da una fallita.
+    """
+    cache_key = image.key
+    cached = _CAPTION_CACHE.get(cache_key)
+    if cached:
+        return cached
+
+    extra: Dict[str, Any] = {}
+    if timeout is not None:
+        extra["timeout"] = timeout
+
+    image_bytes, mime = _prepare_image(image)
+    image_b64 = _IMAGE_POOL.run(image_worker.encode_base64, image_bytes).decode("ascii")
+    data_url = f"data:{mime};base64,{image_b64}"
+
+    resp = _guarded_call(
+        "openai_caption",
+        _OPENAI_CLIENT.chat.completions.create,
+        model="gpt-4.1-mini",
+        temperature=0,
+        max_tokens=350,
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "Sei un esperto di disegno meccanico. "
+                    "Riceverai immagini di tavole tecniche con pezzi meccanici. "
+                    "Devi descrivere solo la geometria del pezzo (forme, fori, spessori, simmetrie), "
+                    "ignorando completamente testi, quote, misure e intestazioni."
+                ),
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": (
+                            "Descrivi in modo conciso ma tecnico la forma del pezzo meccanico mostrato. "
+                            "Ignora testo, numeri, quote, cartigli e tutto ciò che non è geometria. "
+                            "Se vedi più viste (frontale, laterale, sezione), usale per ricostruire mentalmente "
+                            "la forma 3D del pezzo.\n\n"
+                            "Rispondi in al massimo 4 frasi, per un totale di non più di 900 caratteri."
+                        ),
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": data_url
+                        },
+                    },
+                ],
+            },
+        ],
+        **extra,
+    )
 
-        return caption
+    caption = resp.choices[0].message.content.strip()
 
-    except Exception as e:
-        print(f"[query-caption] errore nella descrizione immagine: {e}")
-        return ""
+    MAX_CAPTION_CHARS = 1024
+    if len(caption) > MAX_CAPTION_CHARS:
+        caption = caption[:MAX_CAPTION_CHARS]
+
+    if caption:
+        _CAPTION_CACHE.put(cache_key, caption)
+    return caption
 
 
 @mcp.tool()
@@ -1641,14 +5361,15 @@ def insert_image_vertex(
     image_url: Optional[str] = None,
     caption: Optional[str] = None,
     id: Optional[str] = None,
+    name: Optional[str] = None,
 ) -> Dict[str, Any]:
-    image_b64 = None
+    image = None
 
     if image_id:
         if image_id in _UPLOADED_IMAGES:
             img_data = _UPLOADED_IMAGES[image_id]
             if img_data["expires_at"] > time.time():
-                image_b64 = img_data["image_b64"]
+                image = img_data["image"]
             else:
                 _UPLOADED_IMAGES.pop(image_id, None)
                 return {
@@ -1661,36 +5382,405 @@ def insert_image_vertex(
                 )
             }
 
-    if image_url and not image_b64:
-        image_b64 = _load_image_from_url(image_url)
-        if not image_b64:
+    if image_url and image is None:
+        image = _load_image_from_url(image_url)
+        if image is None:
             return {"error": f"Failed to load image from URL: {image_url}"}
-        image_b64 = _clean_base64(image_b64)
-        if not image_b64:
-            return {"error": f"Invalid image format from URL: {image_url}"}
 
-    if not image_b64:
+    if image is None:
         return {"error": "Either image_id or image_url must be provided"}
 
-    vec = _vertex_embed(image_b64=image_b64, text=caption)
+    vec = _vertex_embed(
+        image=image, text=caption, dimension=_get_embedding_dimension(collection)
+    )
+    vector_name = _get_image_vector_name()
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
     client = _connect()
     try:
         coll = client.collections.get(collection)
         if coll is None:
             return {"error": f"Collection '{collection}' not found"}
 
-        obj = coll.data.insert(
-            properties={"caption": caption, "image_b64": image_b64},
-            vectors={"image": vec},
-        )
+        properties = {"caption": caption, "image_b64": image.b64}
+        if name:
+            properties["name"] = name
+        obj = coll.data.insert(properties=properties, vectors={vector_name: vec})
+        # insert() restituisce direttamente l'UUID nel client v4
+        new_uuid = str(getattr(obj, "uuid", obj) or "")
+        if new_uuid:
+            _knn_graph_add(collection, new_uuid, vec)
+            if _LOCAL_REPLICA is not None and _LOCAL_REPLICA.collection == collection:
+                _LOCAL_REPLICA.upsert(new_uuid, properties, vec)
+            if name and _SUGGEST_INDEX is not None and collection == _get_default_collection():
+                _SUGGEST_INDEX.add(name)
+            duplicates_index = _PHASH_INDEXES.get(collection)
+            if duplicates_index is not None:
+                try:
+                    duplicates_index.add(new_uuid, *_image_hashes(image.data))
+                except Exception as e:
+                    print(f"[phash] cannot hash {new_uuid}: {e}")
         return {
-            "uuid": str(getattr(obj, "uuid", "")),
-            "named_vector": "image",
+            "uuid": new_uuid,
+            "named_vector": vector_name,
+            "dimensions": len(vec),
         }
     finally:
         client.close()
 
 
+def _reembed_properties(props: Dict[str, Any], dimension: int) -> Optional[List[float]]:
+    """Ricalcola l'embedding Vertex di un oggetto (immagine + caption, come in insert_image_vertex)."""
+    image_b64 = props.get("image_b64")
+    image = _image_from_base64(image_b64) if image_b64 else None
+    if image is None:
+        return None
+    return _vertex_embed(image=image, text=props.get("caption"), dimension=dimension)
+
+
+# ==== Job di ri-vettorizzazione (migrazione embedding) =======================
+# Un solo job alla volta, in un thread di background: pagine via cursor API
+# (fetch_objects con after=), embedding Vertex concorrenti limitati da un token
+# bucket (quota), scrittura con batch di Weaviate e checkpoint JSON dopo ogni pagina.
+_MIGRATION_JOB: Optional["_ReembedJob"] = None
+_MIGRATION_LOCK = threading.Lock()
+
+
+def _get_migration_checkpoint_path() -> Path:
+    """
+    Restituisce il path del checkpoint della migrazione embedding.
+    Se MIGRATION_CHECKPOINT_PATH è impostata usa quella; altrimenti data/migration_checkpoint.json.
+    """
+    return Path(
+        os.environ.get("MIGRATION_CHECKPOINT_PATH") or (_BASE_DIR / "data" / "migration_checkpoint.json")
+    )
+
+
+class _TokenBucket:
+    """Token bucket thread-safe: `rate` richieste/s con burst fino a `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = max(rate, 0.01)
+        self.capacity = capacity or max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class _ReembedJob:
+    """Stato e loop della migrazione; il checkpoint contiene parametri, cursore e contatori."""
+
+    _PARAMS = ("collection", "target_collection", "target_vector", "dimension")
+
+    def __init__(self, collection: str, target_collection: str, target_vector: str, dimension: int):
+        self.collection = collection
+        self.target_collection = target_collection
+        self.target_vector = target_vector
+        self.dimension = dimension
+        self.cursor: Optional[str] = None
+        self.processed = 0
+        self.migrated = 0
+        self.skipped = 0
+        self.failed = 0  # rifiutati dal batch di Weaviate
+        self.pending: set = set()  # UUID saltati o rifiutati, da riprovare a fine cursore
+        self.retry_rounds = 0
+        self.errors: "deque[str]" = deque(maxlen=20)
+        self.total: Optional[int] = None
+        self.status = "pending"
+        self.last_error: Optional[str] = None
+        self.run_started_at: Optional[float] = None
+        self.run_processed = 0
+        self.finished_at: Optional[float] = None
+        self._pause = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # -- checkpoint ----------------------------------------------------------
+    def params(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self._PARAMS}
+
+    def save_checkpoint(self) -> None:
+        path = _get_migration_checkpoint_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            **self.params(),
+            "cursor": self.cursor,
+            "processed": self.processed,
+            "migrated": self.migrated,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "pending": sorted(self.pending),
+            "status": self.status,
+            "saved_at": time.time(),
+        }
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, path)
+
+    @classmethod
+    def from_checkpoint(cls) -> Optional["_ReembedJob"]:
+        path = _get_migration_checkpoint_path()
+        if not path.exists():
+            return None
+        data = json.loads(path.read_text(encoding="utf-8"))
+        job = cls(*(data[k] for k in cls._PARAMS))
+        job.cursor = data.get("cursor")
+        job.processed = int(data.get("processed", 0))
+        job.migrated = int(data.get("migrated", 0))
+        job.skipped = int(data.get("skipped", 0))
+        job.failed = int(data.get("failed", 0))
+        job.pending = set(data.get("pending") or [])
+        job.status = data.get("status", "paused")
+        return job
+
+    # -- esecuzione ----------------------------------------------------------
+    def start(self) -> None:
+        self._pause.clear()
+        self.status = "running"
+        self.last_error = None
+        self.run_started_at = time.monotonic()
+        self.run_processed = 0
+        self.retry_rounds = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def pause(self) -> None:
+        self._pause.set()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _embed(self, bucket: _TokenBucket, props: Dict[str, Any]) -> Optional[List[float]]:
+        # con il breaker Vertex aperto aspettiamo invece di bruciare la pagina in errori
+        while _BREAKERS["vertex_embed"].is_open() and not self._pause.is_set():
+            time.sleep(1.0)
+        bucket.acquire()
+        return _reembed_properties(props, self.dimension)
+
+    def _write_page(self, pool, bucket: _TokenBucket, dst, objects, batch_size: int) -> List[str]:
+        """Ri-vettorizza e scrive una pagina; restituisce gli UUID da riprovare."""
+        futures = [pool.submit(self._embed, bucket, dict(o.properties or {})) for o in objects]
+        added: List[str] = []
+        retry: List[str] = []
+        with dst.batch.fixed_size(batch_size=batch_size) as batch:
+            for o, fut in zip(objects, futures):
+                try:
+                    vec = fut.result()
+                except Exception as e:
+                    self.errors.append(f"{o.uuid}: {e}")
+                    vec = None
+                if vec is None:
+                    self.skipped += 1
+                    retry.append(str(o.uuid))
+                    continue
+                # l'upsert via batch sostituisce l'oggetto: riportiamo anche gli altri vettori
+                vectors = dict(o.vector or {}) if self.target_collection == self.collection else {}
+                vectors[self.target_vector] = vec
+                batch.add_object(properties=o.properties, uuid=o.uuid, vector=vectors)
+                added.append(str(o.uuid))
+        # migrati solo gli oggetti che il batch ha effettivamente scritto
+        failed = list(dst.batch.failed_objects or [])
+        failed_ids = {str(f.object_.uuid) for f in failed}
+        self.failed += len(failed_ids)
+        self.migrated += sum(1 for u in added if u not in failed_ids)
+        for f in failed[:20]:
+            self.errors.append(f"{f.object_.uuid}: {f.message}")
+        return retry + [u for u in added if u in failed_ids]
+
+    def _retry_pending(self, pool, bucket: _TokenBucket, src, dst, page_size: int) -> None:
+        """
+        A fine cursore riprova gli oggetti saltati o rifiutati (al massimo MIGRATION_MAX_RETRIES
+        giri per esecuzione). Se ne restano il job finisce "incomplete", non "done".
+        """
+        max_rounds = int(_get_env_float("MIGRATION_MAX_RETRIES", 3))
+        while self.pending and self.retry_rounds < max_rounds and not self._pause.is_set():
+            self.retry_rounds += 1
+            ids = sorted(self.pending)
+            for start in range(0, len(ids), page_size):
+                if self._pause.is_set():
+                    return
+                chunk = ids[start : start + page_size]
+                resp = _guarded_call(
+                    "weaviate_query",
+                    src.query.fetch_objects,
+                    filters=Filter.by_id().contains_any(chunk),
+                    limit=len(chunk),
+                    include_vector=True,
+                )
+                objects = list(getattr(resp, "objects", []) or [])
+                # anche quelli non più nella sorgente (cancellati nel frattempo) escono dalla lista
+                self.pending.difference_update(chunk)
+                self.pending.update(self._write_page(pool, bucket, dst, objects, page_size))
+                self.save_checkpoint()
+        if self._pause.is_set():
+            return
+        self.status = "done" if not self.pending else "incomplete"
+        self.finished_at = time.time()
+
+    def _run(self) -> None:
+        page_size = int(_get_env_float("MIGRATION_BATCH_SIZE", 32))
+        workers = int(_get_env_float("MIGRATION_CONCURRENCY", 4))
+        bucket = _TokenBucket(_get_env_float("MIGRATION_QPS", 2.0))
+        unavailable = _weaviate_unavailable()
+        if unavailable:
+            self.status = "failed"
+            self.last_error = unavailable["error"]
+            print(f"[migrate] not started: {self.last_error}")
+            return
+        client = None
+        try:
+            client = _connect()
+            src = client.collections.get(self.collection)
+            dst = client.collections.get(self.target_collection)
+            if self.total is None:
+                try:
+                    self.total = src.aggregate.over_all(total_count=True).total_count
+                except Exception as e:
+                    print(f"[migrate] total count unavailable: {e}")
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                while not self._pause.is_set():
+                    resp = _guarded_call(
+                        "weaviate_query",
+                        src.query.fetch_objects,
+                        limit=page_size,
+                        after=self.cursor,
+                        include_vector=True,
+                    )
+                    objects = list(getattr(resp, "objects", []) or [])
+                    if not objects:
+                        self._retry_pending(pool, bucket, src, dst, page_size)
+                        break
+                    self.pending.update(self._write_page(pool, bucket, dst, objects, page_size))
+                    self.cursor = str(objects[-1].uuid)
+                    self.processed += len(objects)
+                    self.run_processed += len(objects)
+                    self.save_checkpoint()
+            if self.status == "running":
+                self.status = "paused"
+        except Exception as e:
+            self.status = "failed"
+            self.last_error = str(e)
+            print(f"[migrate] job failed at cursor {self.cursor}: {e}")
+        finally:
+            if client is not None:
+                client.close()
+            self.save_checkpoint()
+        print(f"[migrate] {self.collection} → {self.target_collection}/{self.target_vector}: {self.status}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.run_started_at if self.run_started_at else 0.0
+        rate = self.run_processed / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total - self.processed, 0) if self.total is not None else None
+        return {
+            **self.params(),
+            "status": self.status,
+            "running": self.is_running(),
+            "cursor": self.cursor,
+            "processed": self.processed,
+            "migrated": self.migrated,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "pending": len(self.pending),
+            "unfinished": sorted(self.pending)[:50] if self.status == "incomplete" else [],
+            "total": self.total,
+            "objects_per_s": round(rate, 2),
+            "eta_s": round(remaining / rate) if remaining is not None and rate > 0 else None,
+            "last_error": self.last_error,
+            "errors": list(self.errors),
+            "checkpoint": str(_get_migration_checkpoint_path()),
+        }
+
+
+@mcp.tool()
+def start_reembed_migration(
+    collection: Optional[str] = None,
+    dimension: Optional[int] = None,
+    target_collection: Optional[str] = None,
+    target_vector: Optional[str] = None,
+    resume: bool = True,
+) -> Dict[str, Any]:
+    """
+    Avvia (o riprende dal checkpoint) la ri-vettorizzazione di una collection in background.
+
+    - target_collection: copia gli oggetti (stessi UUID e proprietà) nella collection indicata,
+      che deve già esistere con il named vector di destinazione
+    - target_vector: named vector di destinazione (default WEAVIATE_IMAGE_VECTOR)
+    - dimension: dimensione Vertex (default quella della collection di destinazione)
+    Con resume=True e un checkpoint con gli stessi parametri riparte dal cursore salvato.
+    Throttling: MIGRATION_QPS, MIGRATION_CONCURRENCY, MIGRATION_BATCH_SIZE.
+    """
+    global _MIGRATION_JOB
+    if not _VERTEX_AVAILABLE:
+        return {"error": "google-cloud-aiplatform not installed"}
+    collection = collection or _get_default_collection()
+    target_collection = target_collection or collection
+    target_vector = target_vector or _get_image_vector_name()
+    try:
+        dimension = int(dimension) if dimension else _get_embedding_dimension(target_collection)
+    except (TypeError, ValueError):
+        dimension = 0
+    if dimension not in _VERTEX_EMBED_DIMENSIONS:
+        return {"error": f"Invalid dimension. Use one of: {', '.join(map(str, _VERTEX_EMBED_DIMENSIONS))}"}
+
+    with _MIGRATION_LOCK:
+        if _MIGRATION_JOB is not None and _MIGRATION_JOB.is_running():
+            return {"error": "A migration is already running", "status": _MIGRATION_JOB.snapshot()}
+        params = {
+            "collection": collection,
+            "target_collection": target_collection,
+            "target_vector": target_vector,
+            "dimension": dimension,
+        }
+        job = None
+        if resume:
+            try:
+                job = _ReembedJob.from_checkpoint()
+            except Exception as e:
+                print(f"[migrate] unreadable checkpoint, starting over: {e}")
+            if job is not None and (job.params() != params or job.status == "done"):
+                job = None
+        if job is None:
+            job = _ReembedJob(**params)
+        _MIGRATION_JOB = job
+        job.start()
+        return job.snapshot()
+
+
+@mcp.tool()
+def pause_reembed_migration() -> Dict[str, Any]:
+    """Mette in pausa la migrazione dopo la pagina corrente (il checkpoint resta su disco)."""
+    if _MIGRATION_JOB is None or not _MIGRATION_JOB.is_running():
+        return {"error": "No migration running"}
+    _MIGRATION_JOB.pause()
+    return {"status": "pausing", "cursor": _MIGRATION_JOB.cursor}
+
+
+@mcp.tool()
+def reembed_migration_status() -> Dict[str, Any]:
+    """Avanzamento della migrazione: oggetti/s, ETA, errori recenti (anche da checkpoint)."""
+    job = _MIGRATION_JOB
+    if job is None:
+        try:
+            job = _ReembedJob.from_checkpoint()
+        except Exception as e:
+            return {"error": f"Unreadable checkpoint: {e}"}
+    if job is None:
+        return {"status": "idle"}
+    return job.snapshot()
+
+
 @mcp.tool()
 def image_search_vertex(
     collection: str,
@@ -1698,7 +5788,27 @@ def image_search_vertex(
     image_url: Optional[str] = None,
     caption: Optional[str] = None,
     limit: int = 10,
+    mode: Optional[str] = None,
+    filters: Optional[Any] = None,
+    return_properties: Optional[Any] = None,
+    include_image: bool = False,
+    auto_limit: Optional[Any] = None,
 ) -> Dict[str, Any]:
+    mode = (mode or _get_default_search_mode()).lower()
+    if mode not in _SEARCH_MODES:
+        return {"error": f"Invalid mode '{mode}'. Use one of: {', '.join(_SEARCH_MODES)}"}
+    search_filters, error = _SearchFilters.parse(filters)
+    if error:
+        return {"error": error}
+    projection, error = _Projection.parse(return_properties, include_image)
+    if error:
+        return {"error": error}
+    auto_limit, error = _parse_auto_limit(auto_limit)
+    if error:
+        return {"error": error}
+    autocut_strategy = "local"
+    deadline = _Deadline(_get_default_deadline_ms())
+
     # Usa la collection di default configurata, mantenendo lo stesso comportamento di forzatura
     default_collection = _get_default_collection()
     if not collection:
@@ -1710,13 +5820,13 @@ def image_search_vertex(
         )
         collection = default_collection
 
-    image_b64 = None
+    image = None
 
     if image_id:
         if image_id in _UPLOADED_IMAGES:
             img_data = _UPLOADED_IMAGES[image_id]
             if img_data["expires_at"] > time.time():
-                image_b64 = img_data["image_b64"]
+                image = img_data["image"]
             else:
                 _UPLOADED_IMAGES.pop(image_id, None)
                 return {
@@ -1729,28 +5839,54 @@ def image_search_vertex(
                 )
             }
 
-    if image_url and not image_b64:
-        image_b64 = _load_image_from_url(image_url)
-        if not image_b64:
+    if image_url and image is None:
+        image = _load_image_from_url(image_url)
+        if image is None:
             return {"error": f"Failed to load image from URL: {image_url}"}
-        image_b64 = _clean_base64(image_b64)
-        if not image_b64:
-            return {"error": f"Invalid image format from URL: {image_url}"}
 
-    if not image_b64:
+    if image is None:
         return {"error": "Either image_id or image_url must be provided"}
 
+    unavailable = _weaviate_unavailable()
+    if unavailable:
+        return unavailable
     client = _connect()
     try:
         coll = client.collections.get(collection)
         if coll is None:
             return {"error": f"Collection '{collection}' not found"}
-        resp = coll.query.near_image(
-            image_b64,
-            limit=limit,
-            return_properties=["name", "source_pdf", "page_index", "mediaType", "image_b64"],
-            return_metadata=MetadataQuery(distance=True),
-        )
+        duplicate = _shortcircuit_duplicate(image, collection)
+        if duplicate is not None:
+            resp = _duplicate_search(
+                coll, duplicate, limit, deadline, search_filters, projection.fetch()
+            )
+        elif mode == "accurate":
+            t0 = time.monotonic()
+            resp = _guarded_call(
+                "weaviate_query",
+                coll.query.near_image,
+                image.b64,
+                limit=limit,
+                auto_limit=auto_limit,
+                return_properties=projection.fetch(),
+                return_metadata=MetadataQuery(distance=True),
+                filters=_weaviate_filter(search_filters),
+            )
+            deadline.record("query", t0)
+            autocut_strategy = "weaviate"
+        else:
+            # fast / balanced: embedding Vertex (o caption in cache) senza chiamate LLM
+            resp = _image_search_by_mode(
+                coll,
+                image,
+                "",
+                limit,
+                _get_default_alpha(),
+                mode,
+                deadline,
+                search_filters=search_filters,
+                return_properties=projection.fetch(),
+            )
         out = []
         for o in getattr(resp, "objects", []) or []:
             out.append(
@@ -1760,7 +5896,19 @@ def image_search_vertex(
                     "distance": getattr(getattr(o, "metadata", None), "distance", None),
                 }
             )
-        return {"count": len(out), "results": out}
+        pipeline = deadline.report()
+        _record_tier_latency(mode, "image_vertex", pipeline["elapsed_ms"])
+        result = {"count": len(out), "results": out, "mode": mode, "pipeline": pipeline}
+        if auto_limit:
+            _apply_autocut(result, auto_limit, limit, autocut_strategy, projection)
+        else:
+            projection.apply(out)
+        if getattr(resp, "near_duplicate", None):
+            result["near_duplicate"] = resp.near_duplicate
+        hints = _filter_index_hints(coll, search_filters)
+        if hints:
+            result["filter_hints"] = hints
+        return result
     finally:
         client.close()
 
@@ -1794,9 +5942,38 @@ def diagnose_vertex() -> Dict[str, Any]:
         info["token_expiry"] = str(expiry) if expiry else None
     except Exception as e:
         info["token_error"] = str(e)
+    info["circuit_breakers"] = _circuit_breaker_snapshot()
     return info
 
 
+@mcp.tool()
+def get_metrics() -> Dict[str, Any]:
+    """
+    Metriche runtime del server: stato dei circuit breaker (OpenAI caption,
+    Vertex embed, Weaviate query), latenze per livello di ricerca e cache.
+    """
+    return {
+        "circuit_breakers": _circuit_breaker_snapshot(),
+        "caption_fallback_mode": _get_caption_fallback_mode(),
+        "default_search_mode": _get_default_search_mode(),
+        "search_tiers": {key: stats.snapshot() for key, stats in sorted(_TIER_METRICS.items())},
+        "caches": {
+            "caption": _CAPTION_CACHE.stats(),
+            "embedding": _EMBEDDING_CACHE.stats(),
+            "fusion": _FUSION_CACHE.stats(),
+            "two_stage_candidates": _CANDIDATE_CACHE.stats(),
+            "prepared_images": _PREPARED_IMAGE_CACHE.stats(),
+            "widget_results": _WIDGET_RESULTS.stats(),
+        },
+        "image_preprocessing": _preprocess_snapshot(),
+        "autocut": _autocut_snapshot(),
+        "image_workers": _IMAGE_POOL.snapshot(),
+        "local_replica": _replica_status(),
+        "suggest_index": _SUGGEST_INDEX.status() if _SUGGEST_INDEX is not None else None,
+        "phash_index": {c: index.status() for c, index in list(_PHASH_INDEXES.items())} or None,
+    }
+
+
 # Registry dei tool normali che vuoi esporre alla App
 TOOL_REGISTRY: Dict[str, Any] = {
     "get_instructions": get_instructions,
@@ -1810,9 +5987,20 @@ TOOL_REGISTRY: Dict[str, Any] = {
     "keyword_search": keyword_search,
     "semantic_search": semantic_search,
     "hybrid_search": hybrid_search,
+    "batch_hybrid_search": batch_hybrid_search,
+    "similar_to": similar_to,
+    "related_items": related_items,
+    "suggest_names": suggest_names,
+    "find_duplicate_images": find_duplicate_images,
+    "build_knn_graph": build_knn_graph,
+    "sync_local_replica": sync_local_replica,
+    "start_reembed_migration": start_reembed_migration,
+    "pause_reembed_migration": pause_reembed_migration,
+    "reembed_migration_status": reembed_migration_status,
     "insert_image_vertex": insert_image_vertex,
     "image_search_vertex": image_search_vertex,  # Nota: questa non ha @mcp.tool() ma è una funzione normale
     "diagnose_vertex": diagnose_vertex,
+    "get_metrics": get_metrics,
     "get_last_sinde_results": get_last_sinde_results,
     # (opzionale) tieni ancora l'helper interno, ma NON serve come tool:
     # "sinde_widget_push_results": sinde_widget_push_results,
@@ -1827,6 +6015,12 @@ _HIDDEN_TOOLS: set[str] = {
     "insert_image_vertex",
     "image_search_vertex",
     "diagnose_vertex",
+    "get_metrics",
+    "build_knn_graph",
+    "sync_local_replica",
+    "start_reembed_migration",
+    "pause_reembed_migration",
+    "reembed_migration_status",
 }
 
 
@@ -1898,7 +6092,14 @@ def _maybe_start_vertex_oauth_refresher():
     _VERTEX_REFRESH_THREAD_STARTED = True
 
 
-_maybe_start_vertex_oauth_refresher()
+# Con spawn/forkserver i worker di _IMAGE_POOL rieseguono il __main__ del padre
+# come __mp_main__: con `python serve.py` sarebbe questo file, e lì non vanno
+# avviati thread di background né connessioni a Weaviate/Vertex.
+if __name__ != "__mp_main__":
+    _maybe_start_vertex_oauth_refresher()
+    _maybe_start_local_replica()
+    _maybe_start_suggest_index()
+    _maybe_start_phash_index()
 
 # --- Alias /mcp senza slash finale, se serve --------------------------------
 try:
@@ -1986,8 +6187,26 @@ async def _list_tools() -> List[types.Tool]:
         if name == "get_last_sinde_results":
             input_schema = {
                 "type": "object",
-                "properties": {},
-                "required": [],               # nessun argomento richiesto
+                "properties": {
+                    "session_id": {
+                        "type": "string",
+                        "description": "Sessione del widget: sinde_session_id nello stato del widget.",
+                    },
+                    "properties": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Proprietà da restituire (default: name, source_pdf, page_index, mediaType, caption).",
+                    },
+                    "include_image": {
+                        "type": "boolean",
+                        "description": "Includi image_b64 (pesante, solo se serve mostrare l'immagine).",
+                    },
+                    "include_properties": {
+                        "type": "boolean",
+                        "description": "false = solo UUID e punteggi, senza rileggere le proprietà.",
+                    },
+                },
+                "required": ["session_id"],
                 "additionalProperties": False,
             }
             tool_title = "Risultati ricerca immagini Sinde"
@@ -2031,9 +6250,24 @@ async def _list_tools() -> List[types.Tool]:
                         "description": "Proprietà su cui cercare (default: ['caption', 'name'])",
                     },
                     "return_properties": {
-                        "type": "array",
+                        "type": ["array", "string"],
                         "items": {"type": "string"},
-                        "description": "Proprietà da restituire (default: ['name', 'source_pdf', 'page_index', 'mediaType'])",
+                        "description": (
+                            "Proprietà da restituire (default: ['name', 'source_pdf', 'page_index', 'mediaType']). "
+                            "'metadata' = solo uuid e punteggi, 'uuid' = solo uuid."
+                        ),
+                    },
+                    "include_image": {
+                        "type": "boolean",
+                        "description": "Includi image_b64 nei risultati (pesante: solo se devi mostrare le immagini)",
+                        "default": False,
+                    },
+                    "auto_limit": {
+                        "type": "integer",
+                        "description": (
+                            "Autocut: restituisce solo i risultati prima dell'N-esimo salto di punteggio "
+                            "(1 = solo il gruppo più rilevante; limit resta il massimo). Non combinabile con group_by o paginate."
+                        ),
                     },
                     "image_id": {
                         "type": "string",
@@ -2043,6 +6277,93 @@ async def _list_tools() -> List[types.Tool]:
                         "type": "string",
                         "description": "URL pubblico dell'immagine da usare per la ricerca",
                     },
+                    "deadline_ms": {
+                        "type": "integer",
+                        "description": (
+                            "Budget di latenza in millisecondi (opzionale). Allo scadere la pipeline "
+                            "degrada (solo BM25 o solo vettore immagine) e riporta gli stadi saltati in pipeline.skipped_stages."
+                        ),
+                    },
+                    "mode": {
+                        "type": "string",
+                        "enum": list(_SEARCH_MODES),
+                        "description": (
+                            "Livello di latenza: 'fast' (solo vettore Vertex / solo BM25, niente LLM), "
+                            "'balanced' (caption in cache se presente, altrimenti solo vettore), "
+                            "'accurate' (caption GPT + ricerca ibrida). Default configurabile con SEARCH_DEFAULT_MODE."
+                        ),
+                        "default": _get_default_search_mode(),
+                    },
+                    "fusion": {
+                        "type": "string",
+                        "enum": list(_FUSION_TYPES),
+                        "description": (
+                            "Dove fondere BM25 e vettoriale: 'server' (Weaviate) oppure localmente con "
+                            "'relative_score' o 'ranked'. Con la fusione locale le liste candidate restano in cache: "
+                            "ripetere la query cambiando solo alpha o limit non rifà le query a Weaviate."
+                        ),
+                        "default": _get_default_fusion(),
+                    },
+                    "rerank": {
+                        "type": "string",
+                        "enum": list(_RERANK_STRATEGIES),
+                        "description": (
+                            "Ricerca a due stadi (opzionale): candidati economici (BM25 o near_vector) con i vettori, "
+                            "poi re-rank locale per similarità con l'embedding della query ('vector') o con "
+                            "diversità MMR ('mmr'). I candidati restano in cache: cambiare limit o mmr_lambda non rifà query."
+                        ),
+                    },
+                    "candidates": {
+                        "type": "integer",
+                        "description": "Numero di candidati dello stadio 1 (default TWO_STAGE_CANDIDATES, 100).",
+                    },
+                    "mmr_lambda": {
+                        "type": "number",
+                        "description": "Solo con rerank='mmr': 1 = solo rilevanza, 0 = solo diversità (default 0.7).",
+                    },
+                    "filters": {
+                        "type": "object",
+                        "description": (
+                            "Filtri strutturati applicati da Weaviate (opzionale): "
+                            "source_pdf (stringa o lista), page_index (intero, lista o {gte, lte, gt, lt}), "
+                            "mediaType (stringa o lista). Es. {\"source_pdf\": \"catalogo.pdf\", \"page_index\": {\"gte\": 10}}."
+                        ),
+                        "properties": {
+                            "source_pdf": {},
+                            "page_index": {},
+                            "mediaType": {},
+                        },
+                        "additionalProperties": False,
+                    },
+                    "group_by": {
+                        "type": "string",
+                        "enum": list(_GROUP_BY_PROPERTIES),
+                        "description": (
+                            "Raggruppa per documento (opzionale): limit diventa il numero di PDF distinti, "
+                            "ciascuno con le sue pagine migliori. Utile quando i risultati ripetono lo stesso PDF."
+                        ),
+                    },
+                    "objects_per_group": {
+                        "type": "integer",
+                        "description": "Con group_by: pagine per documento (default 3)",
+                        "default": 3,
+                    },
+                    "paginate": {
+                        "type": "boolean",
+                        "description": (
+                            "Se true la risposta include page.next_page_token quando ci sono altri risultati. "
+                            "Per vedere altri risultati usa il token invece di aumentare limit. "
+                            "Non combinabile con group_by."
+                        ),
+                        "default": False,
+                    },
+                    "page_token": {
+                        "type": "string",
+                        "description": (
+                            "Token page.next_page_token di una risposta precedente: restituisce la pagina successiva "
+                            "della stessa ricerca (gli altri parametri sono ignorati, query può essere ripetuta)."
+                        ),
+                    },
                 },
                 "required": ["collection", "query"],
                 "additionalProperties": False,
@@ -2053,8 +6374,242 @@ async def _list_tools() -> List[types.Tool]:
                 "Tool principale per cercare nella collection Sinde.\n\n"
                 "ISTRUZIONI: Usa SEMPRE collection='Sinde'. Usa query_properties=['caption','name'] e "
                 "return_properties=['name','source_pdf','page_index','mediaType']. Mantieni alpha=0.8 e limit=10 "
-                "salvo richieste diverse. Per ricerche per immagini, usa image_id (da /upload-image) o image_url."
+                "salvo richieste diverse. Per ricerche per immagini, usa image_id (da /upload-image) o image_url. "
+                "Per limitare a un PDF, a certe pagine o a un mediaType usa filters invece di aumentare limit."
+            )
+
+        # ✅ Più ricerche ibride in una chiamata (es. una per pezzo di un assieme)
+        elif name == "batch_hybrid_search":
+            input_schema = {
+                "type": "object",
+                "properties": {
+                    "collection": {
+                        "type": "string",
+                        "description": "Nome della collection (usa sempre 'Sinde')",
+                        "default": "Sinde",
+                    },
+                    "queries": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Elenco di query testuali, eseguite in parallelo (max BATCH_SEARCH_MAX, default 20)",
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Numero massimo di risultati per query",
+                        "default": 10,
+                    },
+                    "alpha": {
+                        "type": "number",
+                        "description": "Peso vettoriale vs BM25 (0 = solo BM25, 1 = solo vettoriale)",
+                    },
+                    "query_properties": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Proprietà su cui fare BM25 (es. ['caption','name'])",
+                    },
+                    "deadline_ms": {
+                        "type": "integer",
+                        "description": "Budget di latenza per ciascuna query (opzionale)",
+                    },
+                    "mode": {
+                        "type": "string",
+                        "enum": list(_SEARCH_MODES),
+                        "default": _get_default_search_mode(),
+                    },
+                    "fusion": {
+                        "type": "string",
+                        "enum": list(_FUSION_TYPES),
+                        "default": _get_default_fusion(),
+                    },
+                    "rerank": {
+                        "type": "string",
+                        "enum": list(_RERANK_STRATEGIES),
+                    },
+                    "filters": {
+                        "type": "object",
+                        "description": (
+                            "Filtri strutturati applicati da Weaviate (opzionale): "
+                            "source_pdf (stringa o lista), page_index (intero, lista o {gte, lte, gt, lt}), "
+                            "mediaType (stringa o lista). Es. {\"source_pdf\": \"catalogo.pdf\", \"page_index\": {\"gte\": 10}}."
+                        ),
+                        "properties": {
+                            "source_pdf": {},
+                            "page_index": {},
+                            "mediaType": {},
+                        },
+                        "additionalProperties": False,
+                    },
+                    "return_properties": {
+                        "type": ["array", "string"],
+                        "items": {"type": "string"},
+                        "description": "Proprietà da restituire per ogni risultato, oppure 'metadata' / 'uuid'",
+                    },
+                    "include_image": {
+                        "type": "boolean",
+                        "description": "Includi image_b64 (pesante)",
+                        "default": False,
+                    },
+                },
+                "required": ["collection", "queries"],
+                "additionalProperties": False,
+            }
+            tool_title = "Ricerca ibrida multipla"
+            tool_description = (
+                "Esegue più ricerche ibride (BM25 + vettoriale) in una sola chiamata, in parallelo. "
+                "Usalo invece di più hybrid_search consecutive quando servono risultati per più pezzi o più "
+                "formulazioni. Restituisce un item per query, nello stesso ordine, con i tempi di ciascuna."
+            )
+            annotations = {
+                "destructiveHint": False,
+                "openWorldHint": False,
+                "readOnlyHint": True,
+            }
+
+        # ✅ Autocompletamento dei nomi dei pezzi
+        elif name == "suggest_names":
+            input_schema = {
+                "type": "object",
+                "properties": {
+                    "prefix": {
+                        "type": "string",
+                        "description": "Inizio del nome del pezzo (anche di una parola interna, es. 'M8')",
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Numero massimo di suggerimenti (max 50)",
+                        "default": 10,
+                    },
+                },
+                "required": ["prefix"],
+                "additionalProperties": False,
+            }
+            tool_title = "Suggerimenti nomi pezzi"
+            tool_description = (
+                "Completa un nome di pezzo parziale con i nomi presenti nella collection Sinde (indice in memoria, "
+                "nessuna ricerca). Usalo per proporre il nome esatto prima di una hybrid_search."
+            )
+            annotations = {
+                "destructiveHint": False,
+                "openWorldHint": False,
+                "readOnlyHint": True,
+            }
+
+        # ✅ Immagine già presente in Sinde? (hash percettivi, senza ricerca)
+        elif name == "find_duplicate_images":
+            input_schema = {
+                "type": "object",
+                "properties": {
+                    "image_id": {
+                        "type": "string",
+                        "description": "ID dell'immagine caricata tramite /upload-image",
+                    },
+                    "image_url": {
+                        "type": "string",
+                        "description": "URL pubblico dell'immagine (alternativa a image_id)",
+                    },
+                    "max_distance": {
+                        "type": "integer",
+                        "description": "Distanza massima in bit (su 64) per i quasi-duplicati (default 6)",
+                    },
+                },
+                "additionalProperties": False,
+            }
+            tool_title = "Duplicati di un'immagine"
+            tool_description = (
+                "Dice se un'immagine caricata è già in Sinde: copie esatte e quasi-duplicati (scansioni, "
+                "foto o ridimensionamenti dello stesso disegno), con distanza in bit. Non fa ricerche "
+                "(la prima chiamata su una collection senza indice può richiedere qualche secondo): "
+                "se c'è un duplicato, usa similar_to sul suo uuid per i pezzi simili."
+            )
+            annotations = {
+                "destructiveHint": False,
+                "openWorldHint": False,
+                "readOnlyHint": True,
+            }
+
+        # ✅ "Altri come questo" a partire da un risultato esistente
+        elif name == "similar_to":
+            input_schema = {
+                "type": "object",
+                "properties": {
+                    "uuid": {
+                        "type": "string",
+                        "description": "UUID di un risultato già restituito (hybrid_search o widget)",
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Numero massimo di risultati simili",
+                        "default": 10,
+                    },
+                    "return_properties": {
+                        "type": ["array", "string"],
+                        "items": {"type": "string"},
+                        "description": "Proprietà da restituire, oppure 'metadata' / 'uuid'",
+                    },
+                    "include_image": {
+                        "type": "boolean",
+                        "description": "Includi image_b64 (pesante)",
+                        "default": False,
+                    },
+                },
+                "required": ["uuid"],
+                "additionalProperties": False,
+            }
+            tool_title = "Progetti simili a un risultato"
+            tool_description = (
+                "Trova i disegni più simili a un risultato già mostrato, usando il suo vettore immagine "
+                "salvato in Weaviate. Usalo quando l'utente chiede 'altri come questo', 'simili al primo risultato', ecc. "
+                "Non serve ricaricare l'immagine."
+            )
+            annotations = {
+                "destructiveHint": False,
+                "openWorldHint": False,
+                "readOnlyHint": True,
+            }
+
+        # ✅ Vicini precomputati dal grafo k-NN (catalogo)
+        elif name == "related_items":
+            input_schema = {
+                "type": "object",
+                "properties": {
+                    "uuid": {
+                        "type": "string",
+                        "description": "UUID dell'oggetto di cui mostrare i correlati",
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Numero massimo di correlati",
+                        "default": 10,
+                    },
+                    "include_properties": {
+                        "type": "boolean",
+                        "description": "Se true, aggiunge name/source_pdf/page_index/mediaType dei correlati (un fetch per ID)",
+                        "default": False,
+                    },
+                    "return_properties": {
+                        "type": ["array", "string"],
+                        "items": {"type": "string"},
+                        "description": "Proprietà dei correlati da restituire (implica include_properties), oppure 'uuid'",
+                    },
+                    "include_image": {
+                        "type": "boolean",
+                        "description": "Includi image_b64 dei correlati (pesante)",
+                        "default": False,
+                    },
+                },
+                "required": ["uuid"],
+                "additionalProperties": False,
+            }
+            tool_title = "Correlati precomputati"
+            tool_description = (
+                "Restituisce gli oggetti correlati a un risultato leggendo il grafo k-NN precomputato "
+                "(istantaneo, nessuna ricerca live). Utile per la navigazione del catalogo."
             )
+            annotations = {
+                "destructiveHint": False,
+                "openWorldHint": False,
+                "readOnlyHint": True,
+            }
 
         tools.append(
             types.Tool(
@@ -2155,7 +6710,7 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
         if name == "get_last_sinde_results":
             print("[call_tool] get_last_sinde_results invoked")
 
-        # Caso speciale: hybrid_search → ripuliamo gli argomenti (niente return_properties)
+        # Caso speciale: hybrid_search → ripuliamo gli argomenti (solo quelli noti)
         if name == "hybrid_search":
             print("[call_tool] hybrid_search called with:", args)
 
@@ -2191,10 +6746,31 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
                 clean_args["image_id"] = args["image_id"]
             if "image_url" in args:
                 clean_args["image_url"] = args["image_url"]
+            if "deadline_ms" in args:
+                clean_args["deadline_ms"] = args["deadline_ms"]
+            if "mode" in args:
+                clean_args["mode"] = args["mode"]
+            if "fusion" in args:
+                clean_args["fusion"] = args["fusion"]
+            for key in (
+                "rerank",
+                "candidates",
+                "mmr_lambda",
+                "filters",
+                "group_by",
+                "objects_per_group",
+                "paginate",
+                "page_token",
+                "return_properties",
+                "include_image",
+                "auto_limit",
+            ):
+                if key in args:
+                    clean_args[key] = args[key]
 
             # 🔴 QUI LA COSA IMPORTANTE:
             # sovrascriviamo args con la versione ripulita
-            # (così return_properties e qualsiasi altro extra SPARISCONO)
+            # (così qualsiasi argomento extra non previsto SPARISCE)
             args = clean_args
 
         # Tutti gli altri tool normali rimangono come prima
@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# i moduli del server stanno nella root del repo, senza package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# importare serve non deve avviare i warm-up in background (che chiamano Weaviate)
+os.environ.setdefault("SUGGEST_WARMUP", "false")
+os.environ.setdefault("PHASH_WARMUP", "false")
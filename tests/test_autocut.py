@@ -0,0 +1,46 @@
+import pytest
+
+from serve import _autocut_count, _parse_auto_limit
+
+
+def test_cuts_after_the_first_jump():
+    assert _autocut_count([0.95, 0.94, 0.93, 0.40, 0.39, 0.38], 1) == 3
+
+
+def test_more_jumps_keep_more_results():
+    scores = [1.0, 0.99, 0.6, 0.59, 0.2, 0.19]
+    assert _autocut_count(scores, 1) == 2
+    assert _autocut_count(scores, 2) == 4
+    assert _autocut_count(scores, 3) == 6
+
+
+def test_no_cut_without_a_clear_jump():
+    assert _autocut_count([1.0, 0.9, 0.8, 0.7, 0.6, 0.5], 1) == 6
+    assert _autocut_count([0.5, 0.5, 0.5], 1) == 3
+    assert _autocut_count([1.0, 0.1], 1) == 2
+    assert _autocut_count([], 1) == 0
+
+
+def test_works_on_negated_distances():
+    assert _autocut_count([-0.10, -0.11, -0.12, -0.45, -0.46], 1) == 3
+
+
+def test_thresholds_come_from_the_environment(monkeypatch):
+    scores = [1.0, 0.85, 0.7, 0.55, 0.0]
+    assert _autocut_count(scores, 1) == 4
+    monkeypatch.setenv("AUTOCUT_MIN_GAP", "0.6")
+    assert _autocut_count(scores, 1) == 5
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [(None, (None, None)), (False, (None, None)), (True, (1, None)), ("yes", (1, None)), ("2", (2, None)), (0, (None, None))],
+)
+def test_parse_auto_limit(raw, expected):
+    assert _parse_auto_limit(raw) == expected
+
+
+@pytest.mark.parametrize("raw", [-1, "many", [1]])
+def test_parse_auto_limit_rejects_invalid_values(raw):
+    jumps, error = _parse_auto_limit(raw)
+    assert jumps is None and error
@@ -0,0 +1,104 @@
+import base64
+import binascii
+import io
+
+import pytest
+
+import image_worker
+
+needs_pil = pytest.mark.skipif(not image_worker.PIL_AVAILABLE, reason="Pillow not installed")
+
+
+def _image(size=(400, 300), fmt="PNG", color=(255, 255, 255), box=None, mode="RGB"):
+    from PIL import Image, ImageDraw
+
+    img = Image.new(mode, size, color)
+    if box:
+        ImageDraw.Draw(img).rectangle(box, fill=(0, 0, 0) if mode == "RGB" else 0)
+    out = io.BytesIO()
+    img.save(out, format=fmt)
+    return out.getvalue()
+
+
+def _open(data):
+    from PIL import Image
+
+    return Image.open(io.BytesIO(data))
+
+
+def test_decode_base64_accepts_str_and_bytes():
+    raw = bytes(range(256))
+    encoded = base64.b64encode(raw)
+    assert image_worker.decode_base64(encoded) == raw
+    assert image_worker.decode_base64(encoded.decode("ascii")) == raw
+    assert image_worker.encode_base64(raw) == encoded
+
+
+@pytest.mark.parametrize("bad", ["abc", "ab!d", "YWJj\nZA==xx", b"\xff\xfe"])
+def test_decode_base64_rejects_invalid_input(bad):
+    with pytest.raises((binascii.Error, ValueError)):
+        image_worker.decode_base64(bad)
+
+
+def test_detect_mime_from_magic_bytes():
+    assert image_worker.detect_mime(b"\x89PNG\r\n\x1a\n....") == "image/png"
+    assert image_worker.detect_mime(b"\xff\xd8\xff\xe0") == "image/jpeg"
+    assert image_worker.detect_mime(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert image_worker.detect_mime(b"plain text") is None
+    assert image_worker.sniff_mime(b"plain text") == "image/png"
+
+
+@needs_pil
+def test_preprocess_downscales_to_max_edge_and_keeps_jpeg():
+    data = _image((2000, 1000), fmt="JPEG", box=(100, 100, 1900, 900))
+    out, mime, resized = image_worker.preprocess(data, {"max_edge": 500})
+    assert resized and mime == "image/jpeg"
+    assert max(_open(out).size) == 500
+
+
+@needs_pil
+def test_preprocess_returns_none_when_nothing_changes():
+    data = _image((200, 100))
+    assert image_worker.preprocess(data, {"max_edge": 1024}) == (None, "image/png", False)
+
+
+@needs_pil
+def test_preprocess_crops_margins_and_converts_to_grayscale():
+    data = _image((400, 400), box=(150, 150, 250, 250))
+    out, mime, resized = image_worker.preprocess(
+        data, {"max_edge": 0, "crop_margins": True, "grayscale": True}
+    )
+    img = _open(out)
+    assert mime == "image/png" and resized
+    assert img.mode == "L"
+    assert img.size[0] < 150 and img.size[1] < 150
+
+
+@needs_pil
+def test_preprocess_reencodes_unsupported_formats_as_png():
+    data = _image((64, 64), fmt="BMP")
+    out, mime, _ = image_worker.preprocess(data, {"max_edge": 1024})
+    assert mime == "image/png"
+    assert out.startswith(b"\x89PNG")
+
+
+@needs_pil
+def test_perceptual_hashes_are_stable_under_resize_and_differ_across_images():
+    drawing = _image((512, 512), box=(50, 60, 300, 400))
+    smaller = image_worker.preprocess(drawing, {"max_edge": 200})[0]
+    other = _image((512, 512), box=(300, 20, 500, 200))
+    d1, p1 = image_worker.perceptual_hashes(drawing)
+    d2, p2 = image_worker.perceptual_hashes(smaller)
+    d3, p3 = image_worker.perceptual_hashes(other)
+    assert 0 <= d1 < 2**64
+    assert bin(d1 ^ d2).count("1") <= 4
+    assert bin(d1 ^ d3).count("1") > 10
+    if p1 is not None:
+        assert bin(p1 ^ p2).count("1") <= 4
+        assert bin(p1 ^ p3).count("1") > 10
+
+
+@needs_pil
+def test_perceptual_hashes_reject_unreadable_images():
+    with pytest.raises(Exception):
+        image_worker.perceptual_hashes(b"not an image")
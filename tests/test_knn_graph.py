@@ -0,0 +1,73 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from knn_graph import KnnGraph, normalize_rows
+
+
+def _vectors(n=40, dim=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def _brute_force(vectors, k):
+    mat = normalize_rows(vectors)
+    sims = mat @ mat.T
+    np.fill_diagonal(sims, -np.inf)
+    return np.argsort(-sims, axis=1)[:, :k]
+
+
+def test_normalize_rows_keeps_zero_rows():
+    out = normalize_rows(np.array([[3.0, 4.0], [0.0, 0.0]]))
+    assert np.allclose(out, [[0.6, 0.8], [0.0, 0.0]])
+
+
+def test_build_matches_brute_force_across_blocks():
+    vectors = _vectors()
+    uuids = [f"u{i}" for i in range(len(vectors))]
+    graph = KnnGraph.build("C", uuids, vectors, k=5, block_size=7)
+    assert graph.k == 5
+    assert np.array_equal(graph.neighbors, _brute_force(vectors, 5))
+    assert np.all(np.diff(graph.scores.astype(np.float32), axis=1) <= 0)
+
+
+def test_build_clamps_k_to_collection_size():
+    graph = KnnGraph.build("C", ["a", "b", "c"], _vectors(3), k=10)
+    assert graph.k == 2
+    assert set(graph.neighbors[0].tolist()) == {1, 2}
+
+
+def test_related_returns_neighbours_and_none_for_unknown():
+    vectors = _vectors(10)
+    uuids = [f"u{i}" for i in range(10)]
+    graph = KnnGraph.build("C", uuids, vectors, k=3)
+    related = graph.related("u0", 2)
+    assert [r["uuid"] for r in related] == [uuids[j] for j in graph.neighbors[0, :2]]
+    assert related[0]["similarity"] >= related[1]["similarity"]
+    assert graph.related("missing", 2) is None
+
+
+def test_add_updates_new_row_and_affected_rows():
+    vectors = _vectors(30)
+    uuids = [f"u{i}" for i in range(30)]
+    graph = KnnGraph.build("C", uuids, vectors, k=4)
+    # quasi identico a u3: deve diventare il primo vicino di u3
+    new = vectors[3] + 1e-3
+    graph.add("new", new)
+    row = graph.index["new"]
+    assert graph.neighbors[row, 0] == 3
+    assert graph.neighbors[3, 0] == row
+
+    expected = _brute_force(np.vstack([vectors, new[None, :]]), 4)
+    assert np.array_equal(graph.neighbors, expected)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    vectors = _vectors(12)
+    graph = KnnGraph.build("C", [f"u{i}" for i in range(12)], vectors, k=3)
+    path = tmp_path / "graph.npz"
+    graph.save(path)
+    loaded = KnnGraph.load(path)
+    assert loaded.collection == "C"
+    assert loaded.uuids == graph.uuids
+    assert np.array_equal(loaded.neighbors, graph.neighbors)
+    assert loaded.related("u1", 3) == graph.related("u1", 3)
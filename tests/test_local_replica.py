@@ -0,0 +1,78 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from local_replica import PROPERTIES, LocalReplica, make_row, tokenize
+
+
+def _rows(captions):
+    return {
+        f"u{i}": make_row(
+            {"name": f"pezzo {i}", "caption": c, "source_pdf": "a.pdf", "page_index": i, "image_b64": "AAAA"},
+            1000 + i,
+        )
+        for i, c in enumerate(captions)
+    }
+
+
+def _replica(captions, vectors=None):
+    replica = LocalReplica("C", "int8")
+    replica.replace(_rows(captions), vectors or {})
+    return replica
+
+
+def test_tokenize_lowercases_and_splits_on_non_word():
+    assert tokenize("Flangia DN-50, foro") == ["flangia", "dn", "50", "foro"]
+    assert tokenize(None) == []
+
+
+def test_rows_keep_only_light_properties():
+    replica = _replica(["flangia con foro"])
+    props = replica.get_properties(["u0", "missing"])
+    assert list(props) == ["u0"]
+    assert set(props["u0"]) <= set(PROPERTIES)
+    assert "image_b64" not in props["u0"]
+    # copie: chi modifica il risultato non tocca la replica
+    props["u0"]["image_b64"] = "x"
+    assert "image_b64" not in replica.properties[0]
+
+
+def test_bm25_ranks_matching_documents():
+    replica = _replica(["flangia flangia foro", "valvola", "flangia cieca lunga descrizione qui"])
+    resp = replica.bm25("flangia", 10)
+    assert [o.uuid for o in resp.objects] == ["u0", "u2"]
+    assert resp.objects[0].metadata.score > resp.objects[1].metadata.score
+
+
+def test_update_replaces_postings_of_changed_rows():
+    replica = _replica(["flangia", "valvola"])
+    replica.update({"u0": make_row({"caption": "raccordo"}, 5000)}, {})
+    assert replica.bm25("flangia", 10).objects == []
+    assert [o.uuid for o in replica.bm25("raccordo", 10).objects] == ["u0"]
+    assert replica.last_update_ms == 5000
+    assert len(replica) == 2
+
+
+def test_replace_drops_objects_missing_from_full_sync():
+    replica = _replica(["flangia", "flangia valvola"])
+    replica.replace({"u1": _rows(["x", "flangia valvola"])["u1"]}, {})
+    assert len(replica) == 1
+    assert [o.uuid for o in replica.bm25("flangia", 10).objects] == ["u1"]
+
+
+def test_near_vector_uses_image_vectors_and_checks_dimension():
+    rng = np.random.default_rng(0)
+    vectors = {f"u{i}": rng.normal(size=8).astype(np.float32) for i in range(3)}
+    replica = _replica(["a", "b", "c"], vectors)
+    resp = replica.near_vector(vectors["u2"].tolist(), 2)
+    assert resp.objects[0].uuid == "u2"
+    assert resp.objects[0].metadata.distance == pytest.approx(0.0, abs=1e-5)
+    assert replica.near_vector([1.0, 0.0], 2) is None
+
+
+def test_is_fresh_requires_recent_sync_and_objects():
+    assert not LocalReplica("C").is_fresh(600)
+    replica = _replica(["a"])
+    assert replica.is_fresh(600)
+    replica.synced_at -= 1000
+    assert not replica.is_fresh(600)
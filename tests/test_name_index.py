@@ -0,0 +1,50 @@
+from name_index import TOP_K, NameIndex
+
+NAMES = ["Vite M8", "vite m8", "Vite M10", "Dado M8", "Rondella", "vite autofilettante", "Vite M8"]
+
+
+def _names(result):
+    return [r["name"] for r in result]
+
+
+def test_suggest_prefers_whole_name_matches_then_frequency():
+    index = NameIndex.build(NAMES)
+    result = index.suggest("vi")
+    assert _names(result)[0] == "Vite M8"
+    assert result[0]["count"] == 3
+    assert set(_names(result)) == {"Vite M8", "Vite M10", "vite autofilettante"}
+
+
+def test_suggest_matches_inner_words_after_whole_names():
+    index = NameIndex.build(NAMES)
+    # "m8" inizia solo parole interne: tutti i nomi con m8, il più frequente prima
+    assert _names(index.suggest("m8")) == ["Vite M8", "Dado M8"]
+    assert _names(index.suggest("Vite M")) == ["Vite M8", "Vite M10"]
+
+
+def test_suggest_normalizes_prefix_and_respects_limit():
+    index = NameIndex.build(NAMES)
+    assert index.suggest("  VITE-m1 ") == [{"name": "Vite M10", "count": 1}]
+    assert len(index.suggest("v", limit=1)) == 1
+    assert index.suggest("") == []
+    assert index.suggest("zzz") == []
+
+
+def test_long_prefix_scan_and_short_bucket_agree():
+    names = [f"pezzo {i}" for i in range(TOP_K + 20)] + ["pezzo speciale"] * 3
+    index = NameIndex.build(names)
+    # prefisso corto (bucket, al massimo TOP_K) e lungo (scansione) danno lo stesso primo
+    assert index.suggest("pez", limit=5)[0] == {"name": "pezzo speciale", "count": 3}
+    assert index.suggest("pezzo", limit=5)[0] == {"name": "pezzo speciale", "count": 3}
+    assert len(index.suggest("pezzo", limit=200)) == TOP_K + 21
+
+
+def test_add_updates_keys_and_buckets():
+    index = NameIndex.build(["Vite M8"])
+    index.add("Valvola")
+    index.add("valvola")
+    index.add(None)
+    assert index.suggest("va") == [{"name": "Valvola", "count": 2}]
+    # con due inserimenti Valvola supera Vite M8 anche nel bucket "v"
+    assert _names(index.suggest("v")) == ["Valvola", "Vite M8"]
+    assert index.status()["names"] == 2
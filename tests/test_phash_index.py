@@ -0,0 +1,82 @@
+import random
+
+from phash_index import BKTree, PerceptualIndex, hamming
+
+
+def _hashes(n, seed=0):
+    rng = random.Random(seed)
+    return [rng.getrandbits(64) for _ in range(n)]
+
+
+def test_hamming():
+    assert hamming(0, 0) == 0
+    assert hamming(0b1011, 0b0001) == 2
+    assert hamming(0, 2**64 - 1) == 64
+
+
+def test_bktree_search_matches_linear_scan():
+    hashes = _hashes(300)
+    # alcuni vicini a distanza 1-3 del primo hash
+    near = [hashes[0] ^ (1 << 3), hashes[0] ^ 0b111, hashes[0] ^ (1 << 60 | 1)]
+    tree = BKTree()
+    for i, h in enumerate(hashes + near):
+        tree.add(h, f"v{i}")
+    for query in (hashes[0], hashes[42], 0):
+        for radius in (0, 3, 20):
+            expected = sorted(
+                (hamming(query, h), f"v{i}") for i, h in enumerate(hashes + near) if hamming(query, h) <= radius
+            )
+            found = tree.search(query, radius)
+            assert sorted(found) == expected
+            assert [d for d, _ in found] == sorted(d for d, _ in found)
+
+
+def test_bktree_groups_identical_hashes():
+    tree = BKTree()
+    tree.add(5, "a")
+    tree.add(5, "b")
+    assert tree.size == 1
+    assert sorted(tree.search(5, 0)) == [(0, "a"), (0, "b")]
+    assert BKTree().search(5, 10) == []
+
+
+def test_lookup_reports_exact_then_near_duplicates():
+    index = PerceptualIndex("C", "phash")
+    index.add("a", "sha-a", 0, 0b1111)
+    index.add("b", "sha-b", 0, 0b1110)
+    index.add("c", "sha-c", 0, 2**63)
+    matches = index.lookup("sha-a", 0, 0b1111, radius=2)
+    assert matches == [
+        {"uuid": "a", "distance": 0, "exact": True},
+        {"uuid": "b", "distance": 1, "exact": False},
+    ]
+    assert index.lookup("sha-x", 0, 0b1111, radius=0) == [{"uuid": "a", "distance": 0, "exact": False}]
+
+
+def test_add_is_idempotent_and_bumps_version():
+    index = PerceptualIndex("C", "dhash")
+    index.add("a", "sha", 7, None)
+    version = index.version
+    index.add("a", "sha", 7, None)
+    assert index.version == version
+    index.add("b", "sha2", 8, None)
+    assert index.version == version + 1
+    assert len(index.items) == 2
+    # senza l'hash del tipo scelto l'immagine non entra
+    phash_only = PerceptualIndex("C", "phash")
+    phash_only.add("x", "sha", 1, None)
+    assert phash_only.items == {} and phash_only.version == 0
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = tmp_path / "phash.json"
+    index = PerceptualIndex("C", "phash")
+    for i, h in enumerate(_hashes(20)):
+        index.add(f"u{i}", f"sha{i}", h, h)
+    index.save(path)
+    loaded = PerceptualIndex.load(path, "C", "phash")
+    assert loaded.items == index.items
+    assert loaded.lookup("sha3", 0, index.items["u3"][2], 0)[0]["uuid"] == "u3"
+    # altra collection o altro tipo di hash: indice vuoto, da ricostruire
+    assert PerceptualIndex.load(path, "D", "phash").items == {}
+    assert PerceptualIndex.load(path, "C", "dhash").items == {}
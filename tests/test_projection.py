@@ -0,0 +1,61 @@
+import pytest
+
+from serve import _DEFAULT_RETURN_PROPERTIES, _Projection
+
+
+def test_default_projection_leaves_out_images():
+    projection, error = _Projection.parse(None)
+    assert error is None
+    assert projection.mode == "properties"
+    assert projection.properties == _DEFAULT_RETURN_PROPERTIES
+    assert "image_b64" not in projection.properties
+
+
+def test_images_only_with_include_image():
+    projection, _ = _Projection.parse(["name", "image_b64"])
+    assert projection.properties == ["name"]
+    projection, _ = _Projection.parse(["name"], include_image=True)
+    assert projection.properties == ["name", "image_b64"]
+
+
+@pytest.mark.parametrize("raw", ['["name", "page_index"]', "name, page_index", ["name", " page_index", "name"]])
+def test_parse_accepts_json_comma_lists_and_lists(raw):
+    projection, error = _Projection.parse(raw)
+    assert error is None
+    assert projection.properties == ["name", "page_index"]
+
+
+def test_metadata_and_uuid_modes():
+    assert _Projection.parse("metadata")[0].mode == "metadata"
+    assert _Projection.parse(" UUID ")[0].mode == "uuid"
+    # nessuna proprietà rimasta = solo metadati
+    assert _Projection.parse([])[0].mode == "metadata"
+
+
+@pytest.mark.parametrize("raw", [["name; drop"], [1, 2], {"name": True}])
+def test_parse_rejects_invalid_input(raw):
+    projection, error = _Projection.parse(raw)
+    assert projection is None
+    assert error
+
+
+def test_fetch_adds_pipeline_properties_once():
+    projection, _ = _Projection.parse(["name"])
+    assert projection.fetch("source_pdf", None, "name") == ["name", "source_pdf"]
+
+
+def test_apply_trims_rows_in_place():
+    rows = [{"uuid": "u", "bm25_score": 1.0, "properties": {"name": "n", "caption": "c", "image_b64": "x"}}]
+    _Projection.parse(["name"])[0].apply(rows)
+    assert rows[0]["properties"] == {"name": "n"}
+    _Projection.parse("metadata")[0].apply(rows)
+    assert rows[0] == {"uuid": "u", "bm25_score": 1.0}
+    _Projection.parse("uuid")[0].apply(rows)
+    assert rows[0] == {"uuid": "u"}
+
+
+def test_local_ok_depends_on_replica_properties():
+    assert _Projection.parse(None)[0].local_ok()
+    assert _Projection.parse(["name"], include_image=True)[0].local_ok()
+    assert _Projection.parse("uuid")[0].local_ok()
+    assert not _Projection.parse(["drawing_number"])[0].local_ok()
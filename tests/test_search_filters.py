@@ -0,0 +1,63 @@
+import pytest
+
+import serve
+from serve import _SearchFilters
+
+
+def test_parse_empty_means_no_filters():
+    for raw in (None, "", {}):
+        assert _SearchFilters.parse(raw) == (None, None)
+
+
+def test_parse_normalizes_scalars_lists_and_eq():
+    filters, error = _SearchFilters.parse(
+        '{"source_pdf": "a.pdf", "mediaType": ["image", "image"], "page_index": {"eq": "3"}}'
+    )
+    assert error is None
+    assert filters.spec == {
+        "source_pdf": {"in": ["a.pdf"]},
+        "mediaType": {"in": ["image"]},
+        "page_index": {"in": [3]},
+    }
+    assert filters.weaviate is not None
+
+
+@pytest.mark.parametrize(
+    "raw, message",
+    [
+        ("not json", "JSON object"),
+        ([1, 2], "must be an object"),
+        ({"caption": "x"}, "Unsupported filter property"),
+        ({"page_index": {"near": 3}}, "Unsupported filter operator"),
+        ({"source_pdf": {"gte": "a"}}, "only supported on page_index"),
+        ({"page_index": "three"}, "Invalid value"),
+        ({"source_pdf": []}, "Empty value list"),
+    ],
+)
+def test_parse_rejects_invalid_filters(raw, message):
+    filters, error = _SearchFilters.parse(raw)
+    assert filters is None
+    assert message in error
+
+
+def test_matches_ranges_and_value_lists():
+    filters, _ = _SearchFilters.parse({"source_pdf": ["a.pdf", "b.pdf"], "page_index": {"gte": 2, "lt": 5}})
+    assert filters.matches({"source_pdf": "a.pdf", "page_index": 2})
+    assert filters.matches({"source_pdf": "b.pdf", "page_index": "4"})
+    assert not filters.matches({"source_pdf": "a.pdf", "page_index": 5})
+    assert not filters.matches({"source_pdf": "c.pdf", "page_index": 3})
+    assert not filters.matches({"source_pdf": "a.pdf"})
+    assert not filters.matches({"source_pdf": "a.pdf", "page_index": "x"})
+
+
+def test_key_is_independent_of_input_order():
+    a, _ = _SearchFilters.parse({"source_pdf": ["b.pdf", "a.pdf"], "page_index": 1})
+    b, _ = _SearchFilters.parse({"page_index": [1], "source_pdf": ["a.pdf", "b.pdf"]})
+    assert a.key == b.key
+
+
+@pytest.mark.skipif(not serve._NUMPY_AVAILABLE, reason="numpy not installed")
+def test_mask_evaluates_each_row():
+    filters, _ = _SearchFilters.parse({"page_index": {"lte": 1}})
+    rows = [{"page_index": 0}, {"page_index": 3}, {}, {"page_index": 1}]
+    assert filters.mask(rows).tolist() == [True, False, False, True]
@@ -0,0 +1,81 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from knn_graph import normalize_rows
+from vector_store import QUANTIZATION_MODES, QuantizedVectorStore
+
+
+def _matrix(n=500, dim=32, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def _exact_top(mat, query, k):
+    return np.argsort(-(normalize_rows(mat) @ (query / np.linalg.norm(query))))[:k]
+
+
+@pytest.mark.parametrize("mode", QUANTIZATION_MODES)
+def test_approx_similarities_close_to_exact(mode, tmp_path):
+    mat = _matrix()
+    store = QuantizedVectorStore.from_matrix(mat, mode, tmp_path / "v.npy")
+    query = _matrix(1, seed=1)[0]
+    exact = normalize_rows(mat) @ (query / np.linalg.norm(query))
+    approx = store.approx_similarities(query)
+    assert approx.dtype == np.float32
+    assert np.allclose(approx, exact, atol=2e-2)
+
+
+@pytest.mark.parametrize("mode", ("float16", "int8"))
+def test_chunked_scoring_matches_single_block(mode, monkeypatch):
+    mat = _matrix(1000)
+    store = QuantizedVectorStore.from_matrix(mat, mode)
+    query = _matrix(1, seed=2)[0]
+    whole = store.approx_similarities(query)
+    monkeypatch.setattr(QuantizedVectorStore, "SCORE_CHUNK_ROWS", 7)
+    assert np.allclose(store.approx_similarities(query), whole, atol=1e-6)
+
+
+@pytest.mark.parametrize("mode", QUANTIZATION_MODES)
+def test_search_rescores_to_exact_top_k(mode, tmp_path):
+    mat = _matrix()
+    store = QuantizedVectorStore.from_matrix(mat, mode, tmp_path / "v.npy")
+    query = mat[17] + 0.01
+    rows, sims = store.search(query, 10)
+    assert rows.tolist() == _exact_top(mat, query, 10).tolist()
+    assert rows[0] == 17
+    assert np.all(np.diff(sims) <= 0)
+
+
+def test_search_respects_mask():
+    mat = _matrix(100)
+    store = QuantizedVectorStore.from_matrix(mat, "int8")
+    mask = np.zeros(100, dtype=bool)
+    mask[::2] = True
+    rows, _ = store.search(mat[3], 5, mask=mask)
+    assert len(rows) == 5
+    assert all(r % 2 == 0 for r in rows.tolist())
+    empty, _ = store.search(mat[3], 5, mask=np.zeros(100, dtype=bool))
+    assert empty.size == 0
+
+
+def test_set_rows_updates_and_appends_with_memmap(tmp_path):
+    mat = _matrix(10)
+    store = QuantizedVectorStore.from_matrix(mat, "int8", tmp_path / "v.npy")
+    extra = _matrix(4, seed=5)
+    store.set_rows([2, 10, 11, 12], extra)
+    assert len(store) == 13
+    assert store.codes.shape[0] >= 13
+    for row, vec in zip([2, 10, 11, 12], extra):
+        found, _ = store.search(vec, 1)
+        assert found[0] == row
+    # le righe float32 esatte sono su disco e aggiornate
+    reloaded = np.load(tmp_path / "v.npy", mmap_mode="r")
+    assert np.allclose(reloaded[11], normalize_rows(extra)[2])
+
+
+def test_nbytes_reports_compact_codes(tmp_path):
+    mat = _matrix(200, 64)
+    sizes = {m: QuantizedVectorStore.from_matrix(mat, m, tmp_path / f"{m}.npy").nbytes() for m in QUANTIZATION_MODES}
+    assert sizes["int8"]["ram_bytes"] < sizes["float16"]["ram_bytes"] < sizes["none"]["ram_bytes"]
+    assert sizes["int8"]["float32_bytes"] == 200 * 64 * 4
+    assert sizes["int8"]["disk_bytes"] > 0
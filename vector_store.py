@@ -0,0 +1,157 @@
+"""
+Store vettoriale quantizzato per la replica locale di serve.py.
+
+Codici compatti in RAM (int8 con scala per vettore, oppure float16) per lo scoring
+approssimato su tutto il corpus; i vettori float32 esatti stanno in un file
+memory-mapped e vengono letti solo per ri-ordinare i top candidati.
+
+Il modulo non importa serve: modalità e path del file arrivano come argomenti.
+"""
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+# NumPy opzionale come in serve.py, che senza non crea store
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+from knn_graph import normalize_rows
+
+QUANTIZATION_MODES = ("none", "float16", "int8")
+
+
+class QuantizedVectorStore:
+    """Vettori normalizzati quantizzati, con re-scoring esatto dei top candidati."""
+
+    SCORE_CHUNK_ROWS = 16384
+
+    def __init__(self, codes, scales, full, mode: str, path: Optional[Path] = None):
+        self.codes = codes  # (capacità, d) int8 / float16 / float32
+        self.scales = scales  # (capacità,) float32, solo per int8
+        self.full = full  # (capacità, d) float32 esatti: memmap su disco (o array in RAM)
+        self.mode = mode
+        self.path = path
+        self.n = int(codes.shape[0])  # righe valide; oltre ci sono solo righe di riserva
+
+    @staticmethod
+    def _quantize(mat, mode: str):
+        """(codici, scale) per righe già normalizzate."""
+        if mode == "int8":
+            scales = np.abs(mat).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            return np.round(mat / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        if mode == "float16":
+            return mat.astype(np.float16), None
+        return mat, None
+
+    @classmethod
+    def from_matrix(cls, matrix, mode: str = "int8", path: Optional[Path] = None):
+        mat = np.ascontiguousarray(normalize_rows(np.asarray(matrix, dtype=np.float32)))
+        if mode not in ("int8", "float16"):
+            return cls(mat, None, mat, "none", None)
+        codes, scales = cls._quantize(mat, mode)
+
+        full = mat
+        if path is not None:
+            # scrittura su file temporaneo + rename: eventuali store precedenti ancora
+            # mappati continuano a leggere il vecchio inode
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            mm = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=mat.shape)
+            mm[:] = mat
+            mm.flush()
+            del mm
+            os.replace(tmp, path)
+            full = np.load(path, mmap_mode="r+")
+        return cls(codes, scales, full, mode, path)
+
+    def set_rows(self, rows, matrix) -> None:
+        """
+        Aggiorna in place le righe indicate, o le aggiunge in coda (indice == len(self)).
+        La capacità raddoppia quando serve: solo allora il file memory-mapped si riscrive.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size == 0:
+            return
+        mat = normalize_rows(np.asarray(matrix, dtype=np.float32))
+        n = max(self.n, int(rows.max()) + 1)
+        if n > self.codes.shape[0]:
+            self._grow(max(n, 2 * self.codes.shape[0]))
+        codes, scales = self._quantize(mat, self.mode)
+        self.codes[rows] = codes
+        if scales is not None:
+            self.scales[rows] = scales
+        if self.full is not self.codes:
+            self.full[rows] = mat
+        self.n = n
+
+    def _grow(self, capacity: int) -> None:
+        n, dim = self.n, self.dim
+        codes = np.zeros((capacity, dim), dtype=self.codes.dtype)
+        codes[:n] = self.codes[:n]
+        if self.scales is not None:
+            scales = np.ones(capacity, dtype=np.float32)
+            scales[:n] = self.scales[:n]
+            self.scales = scales
+        if self.full is self.codes:
+            full = codes
+        elif self.path is not None:
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            mm = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(capacity, dim))
+            mm[:n] = self.full[:n]
+            mm.flush()
+            del mm
+            os.replace(tmp, self.path)
+            full = np.load(self.path, mmap_mode="r+")
+        else:
+            full = np.zeros((capacity, dim), dtype=np.float32)
+            full[:n] = self.full[:n]
+        self.codes, self.full = codes, full
+
+    def __len__(self) -> int:
+        return self.n
+
+    @property
+    def dim(self) -> int:
+        return int(self.codes.shape[1])
+
+    def approx_similarities(self, query):
+        q = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        q = q / norm if norm else q
+        out = np.empty(self.n, dtype=np.float32)
+        # a blocchi: codes @ q su tutta la matrice int8/float16 ne creerebbe una copia
+        # float32 completa a ogni query
+        for start in range(0, self.n, self.SCORE_CHUNK_ROWS):
+            end = min(start + self.SCORE_CHUNK_ROWS, self.n)
+            out[start:end] = self.codes[start:end].astype(np.float32) @ q
+        if self.mode == "int8":
+            out *= self.scales[: self.n]
+        return out
+
+    def exact_similarities(self, rows, query):
+        q = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        q = q / norm if norm else q
+        rows = np.asarray(rows, dtype=np.int64)
+        return np.asarray(self.full[np.sort(rows)] @ q)[np.argsort(np.argsort(rows))]
+
+    def search(self, query, k: int, rescore_factor: int = 4, mask=None):
+        """Top-k: scoring approssimato su tutto, poi re-scoring esatto di k * rescore_factor candidati."""
+        approx = self.approx_similarities(query)
+        candidates = np.arange(len(self)) if mask is None else np.nonzero(mask)[0]
+        if candidates.size == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        pool = min(candidates.size, max(k, k * rescore_factor) if self.mode != "none" else k)
+        sub = approx[candidates]
+        top = candidates[np.argpartition(-sub, pool - 1)[:pool]]
+        exact = self.exact_similarities(top, query) if self.mode != "none" else approx[top]
+        order = np.argsort(-exact, kind="stable")[:k]
+        return top[order], exact[order].astype(np.float32)
+
+    def nbytes(self) -> Dict[str, int]:
+        ram = int(self.codes.nbytes) + (int(self.scales.nbytes) if self.scales is not None else 0)
+        disk = int(self.path.stat().st_size) if self.path is not None and self.path.exists() else 0
+        return {"ram_bytes": ram, "disk_bytes": disk, "float32_bytes": len(self) * self.dim * 4}
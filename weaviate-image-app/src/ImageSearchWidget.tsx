@@ -1,5 +1,5 @@
 // src/ImageSearchWidget.tsx
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 
 // URL base del tuo server MCP (quello con serve.py)
 const MCP_BASE_URL = "https://weaviate-openai-app-sdk.onrender.com";
@@ -17,11 +17,40 @@ type SearchResult = {
   distance?: number;
 };
 
+// sha256 esadecimale dei byte del file (undefined se WebCrypto non è disponibile)
+async function sha256Hex(file: File): Promise<string | undefined> {
+  if (!globalThis.crypto?.subtle) return undefined;
+  const digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest))
+    .map((b) => b.toString(16).padStart(2, "0"))
+    .join("");
+}
+
+// image_id già valido sul server per questi byte: evita di ricaricare l'immagine
+async function findUploadedImage(file: File): Promise<string | undefined> {
+  try {
+    const sha = await sha256Hex(file);
+    if (!sha) return undefined;
+    const resp = await fetch(`${MCP_BASE_URL}/images/${sha}`);
+    if (!resp.ok) return undefined;
+    const data = await resp.json();
+    return data.image_id as string | undefined;
+  } catch {
+    return undefined;
+  }
+}
+
 export const ImageSearchWidget: React.FC = () => {
   const [file, setFile] = useState<File | null>(null);
   const [status, setStatus] = useState<string | null>(null);
   const [results, setResults] = useState<SearchResult[] | null>(null);
   const [isLoading, setIsLoading] = useState(false);
+  // Sessione del widget: i risultati salvati sul server sono separati per sessione
+  const sessionId = useRef<string>(
+    (window as any).openai?.widgetState?.sinde_session_id ||
+      globalThis.crypto?.randomUUID?.() ||
+      `${Date.now()}-${Math.random().toString(16).slice(2)}`
+  );
   const [enlargedImage, setEnlargedImage] = useState<{
     src: string;
     alt: string;
@@ -55,24 +84,29 @@ export const ImageSearchWidget: React.FC = () => {
       setIsLoading(true);
       setStatus("Caricamento del progetto in corso...");
 
-      // 1️⃣ Upload immagine al tuo endpoint /upload-image (HTTP, non MCP tool)
-      const form = new FormData();
-      form.append("image", file);
+      // 1️⃣ Se il server ha già questi byte (stesso sha256) riusa l'image_id,
+      // altrimenti upload al tuo endpoint /upload-image (HTTP, non MCP tool)
+      let imageId = await findUploadedImage(file);
 
-      const uploadResp = await fetch(`${MCP_BASE_URL}/upload-image`, {
-        method: "POST",
-        body: form,
-      });
+      if (!imageId) {
+        const form = new FormData();
+        form.append("image", file);
 
-      if (!uploadResp.ok) {
-        const text = await uploadResp.text();
-        throw new Error(
-          `Upload fallito (${uploadResp.status}): ${text || "errore sconosciuto"}`
-        );
-      }
+        const uploadResp = await fetch(`${MCP_BASE_URL}/upload-image`, {
+          method: "POST",
+          body: form,
+        });
 
-      const uploadData = await uploadResp.json();
-      const imageId = uploadData.image_id as string | undefined;
+        if (!uploadResp.ok) {
+          const text = await uploadResp.text();
+          throw new Error(
+            `Upload fallito (${uploadResp.status}): ${text || "errore sconosciuto"}`
+          );
+        }
+
+        const uploadData = await uploadResp.json();
+        imageId = uploadData.image_id as string | undefined;
+      }
 
       if (!imageId) {
         throw new Error("Risposta /upload-image senza image_id");
@@ -127,10 +161,14 @@ export const ImageSearchWidget: React.FC = () => {
           method: "POST",
           headers: { "Content-Type": "application/json" },
           body: JSON.stringify({
+            session_id: sessionId.current,
+            collection: "Sinde",
             results_summary: resultsSummary,
             raw_results: searchJson,
           }),
         });
+        // il session_id resta nello stato del widget, visibile al modello per get_last_sinde_results
+        (window as any).openai?.setWidgetState?.({ sinde_session_id: sessionId.current });
 
         if (!resp.ok) {
           const errJson = await resp.json().catch(() => ({}));